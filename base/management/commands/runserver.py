@@ -46,7 +46,8 @@ class Command(BaseCommand):
             self.port = self.default_port
         if not self.port.isdigit():
             raise CommandError("%r is not a valid port number." % self.port)
-        if settings.DEBUG:
+        # The autoreloader does not work with several processes.
+        if settings.DEBUG and settings.SERVER_WORKERS == 1:
             autoreload.main(self.inner_run, args, options)
         else:
             self.inner_run(*args, **options)
@@ -16,34 +16,109 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import atexit
+import signal
+
 from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 from tornado.httpserver import HTTPServer
-from tornado.ioloop import IOLoop
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.netutil import bind_sockets
+from tornado.routing import Rule
 from tornado.web import Application, FallbackHandler, StaticFileHandler
 from tornado.wsgi import WSGIContainer
 
 from base.handlers import DjangoStaticFilesHandler, HelloHandler, RobotsHandler
+from base.servers.workers import LocalDocumentMatches, ServerStatusHandler, \
+    WorkerGroup, WorkerProxyWS, start_workers
+from base.servers.wsgi_pool import ThreadedWSGIHandler, WSGIPool
 
 from document.ws_views import DocumentWS
 
 
-def make_tornado_server():
-    wsgi_app = WSGIContainer(get_wsgi_application())
-    tornado_app = Application([
+def make_wsgi_handler(wsgi_threads):
+    """
+    Returns the handler for all requests that go to Django. With wsgi_threads,
+    the views are run in a pool of that many threads. Otherwise they are run
+    on the IOLoop.
+    """
+    if not wsgi_threads:
+        return ('.*', FallbackHandler, dict(
+            fallback=WSGIContainer(get_wsgi_application())
+        ))
+    pool = WSGIPool(
+        get_wsgi_application(),
+        wsgi_threads,
+        settings.WSGI_MAX_QUEUE,
+        settings.WSGI_SLOW_REQUEST
+    )
+    if settings.WSGI_STATS_INTERVAL:
+        PeriodicCallback(
+            pool.latency.report,
+            settings.WSGI_STATS_INTERVAL * 1000
+        ).start()
+    return ('.*', ThreadedWSGIHandler, dict(pool=pool))
+
+
+def make_document_handlers(workers):
+    """
+    The websocket connections of documents owned by other workers are passed
+    on to them.
+    """
+    if workers.count == 1:
+        return [('/ws/doc/(\w+)', DocumentWS)]
+    return [
+        Rule(LocalDocumentMatches('/ws/doc/(\w+)', workers), DocumentWS),
+        ('/ws/doc/(\w+)', WorkerProxyWS, dict(workers=workers)),
+    ]
+
+
+def make_tornado_app(wsgi_threads=None, workers=None):
+    if wsgi_threads is None:
+        wsgi_threads = settings.WSGI_THREADS
+    if workers is None:
+        workers = WorkerGroup()
+    return Application([
         (r'/static/(.*)', DjangoStaticFilesHandler, {'default_filename':
                                                      'none.img'}),
         (r'/media/(.*)', StaticFileHandler, {'path': settings.MEDIA_ROOT}),
         ('/hello-tornado', HelloHandler),
         ('/robots.txt', RobotsHandler),
-        ('/ws/doc/(\w+)', DocumentWS),
-        ('.*', FallbackHandler, dict(fallback=wsgi_app))
+        ('/server-status/', ServerStatusHandler, dict(workers=workers)),
+    ] + make_document_handlers(workers) + [
+        make_wsgi_handler(wsgi_threads)
     ])
 
-    return HTTPServer(tornado_app)
+
+def make_tornado_server(wsgi_threads=None, workers=None):
+    return HTTPServer(make_tornado_app(wsgi_threads, workers))
+
+
+def stop_on_signal(signum, frame):
+    io_loop = IOLoop.instance()
+    io_loop.add_callback_from_signal(io_loop.stop)
 
 
 def run(port):
-    make_tornado_server().listen(int(port))
-    IOLoop.instance().start()
+    # With several workers, they share the port. HTTP requests go to any of
+    # them.
+    sockets = bind_sockets(int(port))
+    if settings.SERVER_WORKERS > 1:
+        workers = start_workers(settings.SERVER_WORKERS)
+    else:
+        workers = WorkerGroup()
+    # Save what a previous server process could not, before any document is
+    # opened. Runs again whenever a crashed worker is restarted.
+    DocumentWS.replay_journal(workers)
+    make_tornado_server(workers=workers).add_sockets(sockets)
+    workers.listen()
+    # Open documents are written to the database in the background. Make sure
+    # that all of them are saved before the server process ends, whether it
+    # is stopped with a signal or it exits through the autoreloader.
+    signal.signal(signal.SIGTERM, stop_on_signal)
+    atexit.register(DocumentWS.saver.shutdown)
+    try:
+        IOLoop.instance().start()
+    finally:
+        DocumentWS.saver.shutdown()
@@ -0,0 +1,264 @@
+import hashlib
+import os
+from logging import info, warning
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from tornado import gen
+from tornado.escape import json_decode
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.netutil import bind_sockets
+from tornado.process import fork_processes
+from tornado.routing import PathMatches
+from tornado.web import Application, RequestHandler
+from tornado.websocket import WebSocketClosedError, websocket_connect
+
+from document.ws_views import DocumentWS
+from ws.base import BaseWebSocketHandler, get_session_user
+from ws.executor import run_in_db_thread
+
+# The request headers that are passed on to the worker that owns a document.
+PROXY_HEADERS = [
+    'Cookie',
+    'Authorization',
+    'Host',
+    'Origin',
+    'User-Agent',
+]
+
+
+def worker_for_document(document_id, count):
+    """
+    The worker that the websocket connections of a document go to, chosen by
+    rendezvous hashing, so that only the documents of a worker move if the
+    number of workers is changed.
+    """
+    return max(range(count), key=lambda worker: hashlib.md5(
+        ('%d:%d' % (document_id, worker)).encode('ascii')
+    ).digest())
+
+
+class WorkerGroup(object):
+    """
+    The worker processes started by start_workers. Each worker has a private
+    port on localhost that the other workers pass websocket connections of
+    its documents to. A single process is a group of one without ports.
+    """
+
+    def __init__(self, count=1, task_id=0, sockets=None):
+        self.count = count
+        self.task_id = task_id
+        # The sockets of the private ports by worker.
+        self.sockets = sockets or []
+        self.ports = [
+            worker_sockets[0].getsockname()[1]
+            for worker_sockets in self.sockets
+        ]
+
+    def owns(self, document_id):
+        # New documents (0) are created by the worker the client connects to.
+        if self.count == 1 or document_id == 0:
+            return True
+        return worker_for_document(document_id, self.count) == self.task_id
+
+    def owner_port(self, document_id):
+        return self.ports[worker_for_document(document_id, self.count)]
+
+    def listen(self):
+        """
+        Serve the documents of this worker on its private port.
+        """
+        if not self.sockets:
+            return
+        HTTPServer(Application([
+            (r'/ws/doc/(\w+)', DocumentWS),
+            ('/worker-status', WorkerStatusHandler, dict(workers=self)),
+        ])).add_sockets(self.sockets[self.task_id])
+
+    def status(self):
+        return {
+            'worker': self.task_id,
+            'pid': os.getpid(),
+            'documents': [{
+                'id': document_id,
+                'owner': doc['owner'],
+                'participants': len(doc['participants']),
+                'remote_participants': sum(
+                    remote['count']
+                    for remote in doc['remote_participants'].values()
+                )
+            } for document_id, doc in DocumentWS.sessions.items()],
+            'broadcasts': dict(DocumentWS.broadcast_stats)
+        }
+
+
+def start_workers(count):
+    """
+    Forks count worker processes and returns the WorkerGroup in each of them.
+    The parent process waits for the workers and restarts those that crash.
+    Sockets that are to be shared by the workers have to be bound before.
+    """
+    if settings.WS_BROKER['BACKEND'] == 'ws.brokers.LocalBroker':
+        raise ImproperlyConfigured(
+            'SERVER_WORKERS > 1 needs a broker that is shared between '
+            'processes (see WS_BROKER).'
+        )
+    sockets = [bind_sockets(0, '127.0.0.1') for i in range(count)]
+    # The workers must not share the database connections of the parent.
+    connections.close_all()
+    parent_pid = os.getpid()
+    task_id = fork_processes(count)
+    info('Worker %d started (pid %d)', task_id, os.getpid())
+
+    def check_parent():
+        # Stop when the parent process is gone, as it restarts the workers
+        # and is the one that is stopped.
+        if os.getppid() != parent_pid:
+            IOLoop.current().stop()
+    PeriodicCallback(check_parent, 1000).start()
+    return WorkerGroup(count, task_id, sockets)
+
+
+class LocalDocumentMatches(PathMatches):
+    """
+    Matches the websocket URLs of the documents owned by this worker.
+    """
+
+    def __init__(self, path_pattern, workers):
+        super(LocalDocumentMatches, self).__init__(path_pattern)
+        self.workers = workers
+
+    def match(self, request):
+        result = super(LocalDocumentMatches, self).match(request)
+        if result is None:
+            return None
+        document_id = result['path_args'][0]
+        if document_id.isdigit() and not self.workers.owns(int(document_id)):
+            return None
+        return result
+
+
+class WorkerProxyWS(BaseWebSocketHandler):
+    """
+    Passes a websocket connection on to the worker that owns the document.
+    """
+
+    def initialize(self, workers):
+        self.workers = workers
+        self.upstream = None
+        self.pending = []
+
+    def get_compression_options(self):
+        return settings.WS_COMPRESSION
+
+    @gen.coroutine
+    def open(self, document_id):
+        headers = dict(
+            (name, self.request.headers[name])
+            for name in PROXY_HEADERS
+            if name in self.request.headers
+        )
+        request = HTTPRequest(
+            'ws://127.0.0.1:%d%s' % (
+                self.workers.owner_port(int(document_id)),
+                self.request.uri
+            ),
+            headers=headers
+        )
+        try:
+            self.upstream = yield websocket_connect(
+                request,
+                on_message_callback=self.on_upstream_message
+            )
+        except Exception:
+            warning('Cannot reach the worker of document %s', document_id)
+            self.close()
+            return
+        if self.ws_connection is None:
+            # The client has left in the meantime.
+            self.upstream.close()
+            return
+        for message in self.pending:
+            self.on_message(message)
+        self.pending = []
+
+    def on_message(self, message):
+        if self.upstream is None:
+            self.pending.append(message)
+            return
+        # Text messages are unicode, binary messages are bytes.
+        self.upstream.write_message(
+            message,
+            binary=isinstance(message, bytes)
+        )
+
+    def on_upstream_message(self, message):
+        if message is None:
+            # The worker has closed the connection.
+            self.close()
+            return
+        try:
+            self.write_message(message, binary=isinstance(message, bytes))
+        except WebSocketClosedError:
+            pass
+
+    def on_close(self):
+        if self.upstream is not None:
+            self.upstream.close()
+
+
+class WorkerStatusHandler(RequestHandler):
+
+    def initialize(self, workers):
+        self.workers = workers
+
+    def get(self):
+        self.write(self.workers.status())
+
+
+class ServerStatusHandler(RequestHandler):
+    """
+    Shows which worker has which documents open and how many participants are
+    connected to them, as well as how many bytes each worker has encoded for
+    broadcasts and how many it has sent. Only staff members who connect from
+    one of settings.SERVER_STATUS_IPS may see it.
+    """
+
+    def initialize(self, workers):
+        self.workers = workers
+
+    @gen.coroutine
+    def get(self):
+        if self.request.remote_ip not in settings.SERVER_STATUS_IPS:
+            self.set_status(403)
+            return
+        # Behind a reverse proxy on the same host, all requests come from
+        # localhost, so the address alone is not enough.
+        session_key = self.get_cookie(settings.SESSION_COOKIE_NAME)
+        user = None
+        if session_key:
+            user = yield run_in_db_thread(get_session_user, session_key)
+        if user is None or not user.is_staff:
+            self.set_status(403)
+            return
+        if not self.workers.ports:
+            self.write({'workers': [self.workers.status()]})
+            return
+        client = AsyncHTTPClient()
+        responses = yield [
+            client.fetch(
+                'http://127.0.0.1:%d/worker-status' % port,
+                raise_error=False,
+                request_timeout=5
+            ) for port in self.workers.ports
+        ]
+        statuses = []
+        for worker, response in enumerate(responses):
+            if response.code == 200:
+                statuses.append(json_decode(response.body))
+            else:
+                statuses.append({'worker': worker, 'error': response.code})
+        self.write({'workers': statuses})
@@ -0,0 +1,224 @@
+import threading
+import time
+from logging import info, warning, error
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from django.urls import resolve, Resolver404
+from django.utils import six
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.web import Finish, RequestHandler
+from tornado.wsgi import WSGIContainer
+
+# Responses are passed from the worker threads to the IOLoop in pieces of at
+# least this many bytes (or fewer at the end).
+STREAM_CHUNK_SIZE = 65536
+
+
+class ViewLatency(object):
+    """
+    The number of requests and the time spent per view, collected from all
+    worker threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = dict()
+
+    def record(self, view_name, wait, duration):
+        with self.lock:
+            stats = self.views.setdefault(view_name, [0, 0.0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += wait
+            stats[2] += duration
+            stats[3] = max(stats[3], duration)
+
+    def report(self):
+        """
+        Logs the requests per view since the last report, the views that took
+        the most time in total first.
+        """
+        with self.lock:
+            views = self.views
+            self.views = dict()
+        for view_name, (count, wait, duration, max_duration) in sorted(
+            views.items(),
+            key=lambda item: -item[1][2]
+        ):
+            info(
+                '%s: %d requests, %.1f ms average, %.1f ms max, '
+                '%.1f ms average wait for a thread',
+                view_name,
+                count,
+                duration * 1000 / count,
+                max_duration * 1000,
+                wait * 1000 / count
+            )
+
+
+class WSGIPool(object):
+    """
+    Runs a WSGI application in a pool of threads, so that slow requests do not
+    hold up the IOLoop and with it the websocket connections. At most
+    max_queue requests wait for a free thread, any further requests are
+    answered with 503.
+    """
+
+    def __init__(self, application, threads, max_queue, slow_request):
+        self.application = application
+        self.threads = threads
+        self.max_queue = max_queue
+        self.slow_request = slow_request
+        self.executor = ThreadPoolExecutor(threads)
+        # Requests that have been submitted to the executor and not finished.
+        # Only changed on the IOLoop.
+        self.active = 0
+        self.latency = ViewLatency()
+
+    @property
+    def queued(self):
+        return max(self.active - self.threads, 0)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+def view_name(path):
+    try:
+        return resolve(path).view_name
+    except Resolver404:
+        return 'unresolved'
+
+
+class ThreadedWSGIHandler(RequestHandler):
+    """
+    Passes all requests to the WSGI application of a WSGIPool and streams the
+    responses back.
+    """
+
+    def initialize(self, pool):
+        self.pool = pool
+        self.io_loop = IOLoop.current()
+        self.closed = False
+        self.headers_sent = False
+
+    def on_connection_close(self):
+        self.closed = True
+
+    @gen.coroutine
+    def prepare(self):
+        if self.pool.queued >= self.pool.max_queue:
+            self.set_status(503)
+            self.set_header('Retry-After', '1')
+            self.finish('The server is busy. Please try again.')
+            return
+        environ = WSGIContainer.environ(self.request)
+        self.pool.active += 1
+        try:
+            response, data = yield self.pool.executor.submit(
+                self.run_application,
+                environ,
+                time.time()
+            )
+        except Exception:
+            error('Error running %s', self.request.uri, exc_info=True)
+            if self.headers_sent:
+                # Part of the response has been sent already.
+                self.request.connection.close()
+            else:
+                self.set_status(500)
+                self.finish()
+        else:
+            # The rest of the response is sent here rather than from the
+            # worker thread, so that it is written before prepare returns.
+            self.send(response, data, None)
+        finally:
+            self.pool.active -= 1
+        if not self._finished:
+            # The client has left before the response was complete. There
+            # are no method handlers for Tornado to go on to.
+            raise Finish()
+
+    def run_application(self, environ, submitted):
+        # Runs in a worker thread. Large responses are passed on to the
+        # IOLoop in pieces while they are generated.
+        started = time.time()
+        response = dict()
+        chunks = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and self.headers_sent:
+                six.reraise(*exc_info)
+            response['status'] = status
+            response['headers'] = headers
+            return chunks.append
+
+        result = self.pool.application(environ, start_response)
+        try:
+            size = 0
+            for chunk in result:
+                if self.closed:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= STREAM_CHUNK_SIZE:
+                    # Wait until the data has been passed on to the client,
+                    # so that large responses are not buffered as a whole.
+                    flushed = Future()
+                    self.io_loop.add_callback(
+                        self.send,
+                        response,
+                        b''.join(chunks),
+                        flushed
+                    )
+                    flushed.result()
+                    del chunks[:]
+                    size = 0
+        finally:
+            # Closing the result ends the request for Django, which closes
+            # the database connection of the thread if necessary.
+            if hasattr(result, 'close'):
+                result.close()
+        duration = time.time() - started
+        name = view_name(environ['PATH_INFO'])
+        self.pool.latency.record(name, started - submitted, duration)
+        if duration > self.pool.slow_request:
+            warning(
+                'Slow request: %s %s (%s) took %.1f ms',
+                environ['REQUEST_METHOD'],
+                environ['PATH_INFO'],
+                name,
+                duration * 1000
+            )
+        # The status, the headers and the last part of the response.
+        return response, b''.join(chunks)
+
+    def send(self, response, data, flushed):
+        # Runs on the IOLoop. flushed is set once the data has been written or
+        # None if this is the end of the response.
+        if self.closed:
+            if flushed is not None:
+                flushed.set_result(None)
+            return
+        if not self.headers_sent:
+            self.headers_sent = True
+            status_code, reason = response['status'].split(' ', 1)
+            self.set_status(int(status_code), reason)
+            self.clear_header('Content-Type')
+            for name, value in response['headers']:
+                self.add_header(name, value)
+        if self.request.method != 'HEAD':
+            self.write(data)
+        if flushed is None:
+            self.finish()
+            return
+
+        def on_flush(future):
+            if isinstance(future.exception(), StreamClosedError):
+                self.closed = True
+            flushed.set_result(None)
+        self.io_loop.add_future(self.flush(), on_flush)
+
+    def log_exception(self, typ, value, tb):
+        error('Error serving %s', self.request.uri, exc_info=(typ, value, tb))
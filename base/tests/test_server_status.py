@@ -0,0 +1,74 @@
+from django.test import SimpleTestCase
+
+from base.servers.workers import WorkerGroup
+from document.ws_views import DocumentWS
+
+
+class FakeUser(object):
+
+    def __init__(self, id):
+        self.id = id
+
+
+class FakeUserInfo(object):
+
+    def __init__(self, user_id, access_rights):
+        self.user = FakeUser(user_id)
+        self.access_rights = access_rights
+
+
+class FakeParticipant(object):
+
+    def __init__(self, id, access_rights, binary=False):
+        self.id = id
+        self.user_info = FakeUserInfo(id, access_rights)
+        self.binary = binary
+        self.messages = []
+
+    def write_message(self, data, binary=False):
+        self.messages.append(data)
+
+
+class ServerStatusTest(SimpleTestCase):
+
+    def setUp(self):
+        self.sessions = DocumentWS.sessions
+        self.broadcast_stats = DocumentWS.broadcast_stats
+        self.participants = {
+            1: FakeParticipant(1, 'write'),
+            2: FakeParticipant(2, 'write'),
+            3: FakeParticipant(3, 'read-without-comments'),
+        }
+        DocumentWS.sessions = {
+            1: {
+                'owner': True,
+                'participants': self.participants,
+                'remote_participants': {}
+            }
+        }
+        DocumentWS.broadcast_stats = dict.fromkeys(self.broadcast_stats, 0)
+
+    def tearDown(self):
+        DocumentWS.sessions = self.sessions
+        DocumentWS.broadcast_stats = self.broadcast_stats
+
+    def test_broadcasts(self):
+        DocumentWS.deliver_updates({
+            'type': 'diff',
+            'diff': [],
+            'comments': [{'id': 1}]
+        }, 1)
+        # The two writers get the same payload, the reader one without the
+        # comments.
+        sent = [
+            len(participant.messages[0])
+            for participant in self.participants.values()
+        ]
+        status = WorkerGroup().status()
+        self.assertEqual(status['documents'][0]['participants'], 3)
+        self.assertEqual(status['broadcasts'], {
+            'payloads_encoded': 2,
+            'bytes_encoded': sent[0] + sent[2],
+            'messages_sent': 3,
+            'bytes_sent': sum(sent),
+        })
@@ -0,0 +1,221 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import Client, SimpleTestCase, TransactionTestCase, \
+    override_settings
+from tornado import gen
+from tornado.escape import json_decode
+from tornado.httpclient import HTTPRequest
+from tornado.httpserver import HTTPServer
+from tornado.routing import Rule
+from tornado.testing import AsyncHTTPTestCase, bind_unused_port, gen_test
+from tornado.web import Application, RequestHandler
+from tornado.websocket import WebSocketHandler, websocket_connect
+
+from base.servers.workers import LocalDocumentMatches, ServerStatusHandler, \
+    WorkerGroup, WorkerProxyWS, worker_for_document
+from ws import executor
+
+
+class WorkerForDocumentTest(SimpleTestCase):
+
+    def test_stable(self):
+        documents = range(1, 1001)
+        three = [worker_for_document(document, 3) for document in documents]
+        self.assertEqual(
+            three,
+            [worker_for_document(document, 3) for document in documents]
+        )
+        self.assertEqual(set(three), set([0, 1, 2]))
+        for worker in range(3):
+            self.assertGreater(three.count(worker), 250)
+        # With a fourth worker, documents only move to the new worker.
+        four = [worker_for_document(document, 4) for document in documents]
+        moved = [
+            (before, after) for before, after in zip(three, four)
+            if before != after
+        ]
+        self.assertTrue(all(after == 3 for before, after in moved))
+        self.assertGreater(len(moved), 150)
+        self.assertLess(len(moved), 350)
+
+    def test_owns(self):
+        groups = [WorkerGroup(3, task_id) for task_id in range(3)]
+        for document in range(1, 100):
+            self.assertEqual(
+                [group.owns(document) for group in groups].count(True),
+                1
+            )
+        # New documents are created by any worker.
+        self.assertTrue(all(group.owns(0) for group in groups))
+        self.assertTrue(WorkerGroup().owns(5))
+
+
+class NameHandler(RequestHandler):
+
+    def initialize(self, name):
+        self.name = name
+
+    def get(self, document_id):
+        self.write(self.name)
+
+
+class LocalDocumentMatchesTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.workers = WorkerGroup(2, 0)
+        return Application([
+            Rule(
+                LocalDocumentMatches('/ws/doc/(\w+)', self.workers),
+                NameHandler,
+                dict(name='local')
+            ),
+            ('/ws/doc/(\w+)', NameHandler, dict(name='proxy')),
+        ])
+
+    def test_routing(self):
+        for document in range(1, 20):
+            response = self.fetch('/ws/doc/%d' % document)
+            self.assertEqual(
+                response.body,
+                b'local' if self.workers.owns(document) else b'proxy'
+            )
+        # New documents and ids that are not numbers stay with this worker.
+        self.assertEqual(self.fetch('/ws/doc/0').body, b'local')
+        self.assertEqual(self.fetch('/ws/doc/new').body, b'local')
+
+
+class EchoWS(WebSocketHandler):
+    # Stands in for the DocumentWS of the worker that owns a document.
+
+    def initialize(self, test):
+        self.test = test
+
+    def open(self, document_id):
+        self.test.upstream_requests.append(self.request)
+
+    def on_message(self, message):
+        self.write_message(message, binary=isinstance(message, bytes))
+
+    def on_close(self):
+        self.test.upstream_closed.set_result(None)
+
+
+class WorkerProxyWSTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.upstream_requests = []
+        self.upstream_closed = gen.Future()
+        # Worker 0 is this process, worker 1 is served from its private port.
+        sockets = [[bind_unused_port()[0]] for worker in range(2)]
+        self.workers = WorkerGroup(2, 0, sockets)
+        HTTPServer(Application([
+            (r'/ws/doc/(\w+)', EchoWS, dict(test=self)),
+        ])).add_sockets(sockets[1])
+        return Application([
+            ('/ws/doc/(\w+)', WorkerProxyWS, dict(workers=self.workers)),
+        ])
+
+    def other_document(self):
+        return next(
+            document for document in range(1, 100)
+            if not self.workers.owns(document)
+        )
+
+    @gen_test
+    def test_proxy(self):
+        client = yield websocket_connect(HTTPRequest(
+            'ws://127.0.0.1:%d/ws/doc/%d?x=1' % (
+                self.get_http_port(),
+                self.other_document()
+            ),
+            headers={'Cookie': 'sessionid=abc', 'X-Other': 'no'}
+        ))
+        # Messages sent before the upstream connection is open are queued.
+        client.write_message(u'text \xe4')
+        client.write_message(b'\x00binary', binary=True)
+        reply = yield client.read_message()
+        self.assertEqual(reply, u'text \xe4')
+        reply = yield client.read_message()
+        self.assertEqual(reply, b'\x00binary')
+        [request] = self.upstream_requests
+        self.assertEqual(request.uri, '/ws/doc/%d?x=1' % self.other_document())
+        self.assertEqual(request.headers['Cookie'], 'sessionid=abc')
+        self.assertNotIn('X-Other', request.headers)
+        # Closing the client closes the upstream connection.
+        client.close()
+        yield self.upstream_closed
+
+    @gen_test
+    def test_worker_gone(self):
+        self.workers.ports[1] = bind_unused_port()[1]
+        client = yield websocket_connect(
+            'ws://127.0.0.1:%d/ws/doc/%d' % (
+                self.get_http_port(),
+                self.other_document()
+            )
+        )
+        message = yield client.read_message()
+        self.assertIsNone(message)
+
+
+def share_connection(connection):
+    connections[DEFAULT_DB_ALIAS] = connection
+
+
+@override_settings(WS_DB_THREADS=1)
+class ServerStatusTest(AsyncHTTPTestCase, TransactionTestCase):
+
+    def setUp(self):
+        super(ServerStatusTest, self).setUp()
+        # The session is looked up in the database thread, which uses the
+        # in-memory test database of this thread.
+        executor.executor = None
+        self.connection = connections[DEFAULT_DB_ALIAS]
+        self.connection.allow_thread_sharing = True
+        executor.run_in_db_thread(share_connection, self.connection).result()
+
+    def tearDown(self):
+        executor.executor.shutdown()
+        executor.executor = None
+        self.connection.allow_thread_sharing = False
+        super(ServerStatusTest, self).tearDown()
+
+    def get_app(self):
+        return Application([
+            ('/server-status/', ServerStatusHandler, dict(
+                workers=WorkerGroup()
+            )),
+        ])
+
+    def session_cookie(self, user):
+        client = Client()
+        client.force_login(user)
+        return '%s=%s' % (
+            settings.SESSION_COOKIE_NAME,
+            client.cookies[settings.SESSION_COOKIE_NAME].value
+        )
+
+    def status(self, cookie=None):
+        headers = {}
+        if cookie is not None:
+            headers['Cookie'] = cookie
+        return self.fetch('/server-status/', headers=headers)
+
+    def test_staff_only(self):
+        self.assertEqual(self.status().code, 403)
+        user = User.objects.create_user('user')
+        self.assertEqual(self.status(self.session_cookie(user)).code, 403)
+        staff = User.objects.create_user('staff')
+        staff.is_staff = True
+        staff.save()
+        response = self.status(self.session_cookie(staff))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json_decode(response.body)['workers'][0]['worker'], 0)
+
+    @override_settings(SERVER_STATUS_IPS=['192.0.2.1'])
+    def test_address(self):
+        staff = User.objects.create_user('staff')
+        staff.is_staff = True
+        staff.save()
+        self.assertEqual(self.status(self.session_cookie(staff)).code, 403)
@@ -0,0 +1,161 @@
+import logging
+import socket
+import threading
+
+from tornado import gen
+from tornado.iostream import IOStream
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application
+
+from base.servers.tornado_django_hybrid import make_tornado_app
+from base.servers.wsgi_pool import ThreadedWSGIHandler, WSGIPool
+
+
+class ErrorRecords(logging.Handler):
+
+    def __init__(self):
+        super(ErrorRecords, self).__init__(logging.ERROR)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class WSGIPoolTest(AsyncHTTPTestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.closed = threading.Event()
+        super(WSGIPoolTest, self).setUp()
+        self.errors = ErrorRecords()
+        logging.getLogger().addHandler(self.errors)
+
+    def tearDown(self):
+        logging.getLogger().removeHandler(self.errors)
+        self.release.set()
+        self.pool.shutdown()
+        super(WSGIPoolTest, self).tearDown()
+
+    def application(self, environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        if environ['PATH_INFO'] == '/stream':
+            return self.stream()
+        if environ['PATH_INFO'].startswith('/fast/'):
+            return [environ['PATH_INFO'].encode('utf-8')]
+        self.release.wait(5)
+        return [b'done']
+
+    def stream(self):
+        # An endless response, which ends when the client leaves.
+        try:
+            while True:
+                yield b'x' * 65536
+        finally:
+            self.closed.set()
+
+    def get_app(self):
+        self.pool = WSGIPool(self.application, 1, 1, 10)
+        return Application([('.*', ThreadedWSGIHandler, dict(pool=self.pool))])
+
+    @gen.coroutine
+    def drained(self):
+        for i in range(500):
+            if self.pool.active == 0:
+                break
+            yield gen.sleep(0.01)
+        self.assertEqual(self.pool.active, 0)
+
+    @gen_test
+    def test_queue(self):
+        client = self.http_client
+        # One request runs, one waits for the thread, the third is turned
+        # away.
+        running = client.fetch(self.get_url('/'), raise_error=False)
+        queued = client.fetch(self.get_url('/'), raise_error=False)
+        while self.pool.active < 2:
+            yield gen.sleep(0.01)
+        busy = yield client.fetch(self.get_url('/'), raise_error=False)
+        self.assertEqual(busy.code, 503)
+        self.assertEqual(busy.headers['Retry-After'], '1')
+        self.assertEqual(busy.body, b'The server is busy. Please try again.')
+        self.release.set()
+        responses = yield [running, queued]
+        self.assertEqual([response.code for response in responses], [200, 200])
+        self.assertEqual([response.body for response in responses],
+                         [b'done', b'done'])
+        yield self.drained()
+        # There is room again.
+        response = yield client.fetch(self.get_url('/'))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, b'done')
+
+    @gen_test
+    def test_fast_requests(self):
+        # The whole response of each request arrives, however quickly the
+        # worker thread is done with it.
+        self.pool.max_queue = 100
+        paths = ['/fast/%d' % index for index in range(100)]
+        responses = yield [
+            self.http_client.fetch(self.get_url(path)) for path in paths
+        ]
+        self.assertEqual(
+            [(response.code, response.body) for response in responses],
+            [(200, path.encode('utf-8')) for path in paths]
+        )
+        yield self.drained()
+        self.assertEqual(self.errors.records, [])
+
+    @gen_test
+    def test_large_response(self):
+        response = yield self.http_client.fetch(
+            self.get_url('/stream'),
+            streaming_callback=lambda chunk: None,
+            request_timeout=0.5,
+            raise_error=False
+        )
+        # The endless response is streamed until the client gives up.
+        self.assertEqual(response.code, 599)
+        yield self.drained()
+
+    @gen_test
+    def test_client_leaves(self):
+        stream = IOStream(socket.socket())
+        yield stream.connect(('127.0.0.1', self.get_http_port()))
+        yield stream.write(b'GET /stream HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        yield stream.read_bytes(200000, partial=True)
+        stream.close()
+        yield self.drained()
+        self.assertTrue(self.closed.is_set())
+        # The request ends without Tornado looking for a method handler.
+        yield gen.sleep(0.1)
+        self.assertEqual(self.errors.records, [])
+
+
+class DjangoPoolTest(AsyncHTTPTestCase):
+    """
+    Django requests through the thread pool of the server.
+    """
+
+    def get_app(self):
+        return make_tornado_app(wsgi_threads=8)
+
+    @gen_test
+    def test_requests(self):
+        expected = yield self.http_client.fetch(self.get_url('/jsi18n/'))
+        self.assertIn(b'django.gettext', expected.body)
+        responses = yield [
+            self.http_client.fetch(self.get_url('/jsi18n/'))
+            for i in range(50)
+        ] + [
+            self.http_client.fetch(
+                self.get_url('/'),
+                follow_redirects=False,
+                raise_error=False
+            )
+        ]
+        self.assertEqual(
+            [(response.code, response.body) for response in responses[:-1]],
+            [(200, expected.body)] * 50
+        )
+        # Anonymous users are sent to the login page.
+        self.assertEqual(responses[-1].code, 302)
@@ -0,0 +1,125 @@
+import json
+import threading
+from builtins import range
+from datetime import timedelta
+from logging import error
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from bibliography.helpers.bibtex_parser import split_bibtex, block_type, \
+    parse_string_definitions, parse_blocks
+from bibliography.helpers.entry_import import import_entries
+from bibliography.models import BibImportJob
+
+# Number of BibTeX entries that are parsed and imported together.
+IMPORT_CHUNK_SIZE = 500
+
+parser_pool = None
+job_runner = None
+# Views may start imports from several threads at once.
+job_runner_lock = threading.Lock()
+
+
+def get_parser_pool():
+    global parser_pool
+    if parser_pool is None:
+        parser_pool = ProcessPoolExecutor(settings.BIBTEX_IMPORT_PROCESSES)
+    return parser_pool
+
+
+def start_import(job, bibtex):
+    """
+    Runs the import job in a background thread of the server process. The
+    jobs of a process run one after the other.
+    """
+    global job_runner
+    with job_runner_lock:
+        if job_runner is None:
+            job_runner = ThreadPoolExecutor(1)
+    job_runner.submit(run_background_import, job, bibtex)
+
+
+def run_background_import(job, bibtex):
+    try:
+        if BibImportJob.objects.filter(id=job.id, status='queued').exists():
+            # Jobs that have waited too long have been given up on.
+            run_import(job, bibtex)
+    finally:
+        # The thread has its own database connection.
+        connection.close()
+
+
+def fail_stale_jobs(owner):
+    """
+    Marks the unfinished import jobs of owner as failed that have not made
+    progress for settings.BIBTEX_IMPORT_TIMEOUT seconds, for example because
+    the server process that ran them has ended.
+    """
+    now = timezone.now()
+    BibImportJob.objects.filter(
+        owner=owner,
+        status__in=['queued', 'running'],
+        updated__lt=now - timedelta(seconds=settings.BIBTEX_IMPORT_TIMEOUT)
+    ).update(status='failed', updated=now)
+
+
+def run_import(job, bibtex, progress=None):
+    """
+    Parses the BibTeX file contents bibtex in chunks in the parser processes
+    and imports the entries of each chunk into the bibliography of the owner
+    of the job. The progress is saved in the job after each chunk and passed
+    to progress if given.
+    """
+    job.status = 'running'
+    job.save()
+    try:
+        blocks = split_bibtex(bibtex)
+        macros = parse_string_definitions(blocks)
+        blocks = [
+            block for block in blocks
+            if block_type(block) not in ('string', 'comment', 'preamble')
+        ]
+        chunks = [
+            blocks[index:index + IMPORT_CHUNK_SIZE]
+            for index in range(0, len(blocks), IMPORT_CHUNK_SIZE)
+        ]
+        job.total = len(blocks)
+        job.save()
+        entry_ids = []
+        seen_entry_ids = set()
+        errors = []
+        warnings = []
+        results = get_parser_pool().map(
+            parse_blocks,
+            chunks,
+            [macros] * len(chunks)
+        )
+        for chunk, (entries, chunk_errors, chunk_warnings) in zip(
+            chunks,
+            results
+        ):
+            id_translations = import_entries(
+                job.owner_id,
+                list(enumerate(entries))
+            )
+            for b_id, entry_id in id_translations:
+                if entry_id not in seen_entry_ids:
+                    seen_entry_ids.add(entry_id)
+                    entry_ids.append(entry_id)
+            errors += chunk_errors
+            warnings += chunk_warnings
+            job.processed += len(chunk)
+            job.save()
+            if progress:
+                progress(job)
+        job.entry_ids = json.dumps(entry_ids)
+        job.errors = json.dumps(errors)
+        job.warnings = json.dumps(warnings)
+        job.status = 'done'
+    except Exception:
+        error('BibTeX import %d failed', job.id, exc_info=True)
+        job.status = 'failed'
+    job.save()
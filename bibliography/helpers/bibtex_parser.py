@@ -0,0 +1,719 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import re
+import unicodedata
+
+# Parses BibTeX/BibLaTeX files into the format of Entry, following the
+# conventions of the parser used in the browser (biblatex-csl-converter):
+# rich text values are lists of text nodes with marks, names are dicts of
+# such lists, dates are EDTF strings.
+
+BIB_TYPES = [
+    'article', 'book', 'mvbook', 'inbook', 'bookinbook', 'suppbook',
+    'booklet', 'collection', 'mvcollection', 'incollection',
+    'suppcollection', 'manual', 'misc', 'online', 'patent', 'periodical',
+    'suppperiodical', 'proceedings', 'mvproceedings', 'inproceedings',
+    'reference', 'mvreference', 'inreference', 'report', 'thesis',
+    'unpublished'
+]
+
+# BibTeX entry types that are mapped to a BibLaTeX type and the value of the
+# type field, if any.
+BIB_TYPE_ALIASES = {
+    'conference': ('inproceedings', None),
+    'electronic': ('online', None),
+    'www': ('online', None),
+    'mastersthesis': ('thesis', 'mathesis'),
+    'phdthesis': ('thesis', 'phdthesis'),
+    'techreport': ('report', 'techreport'),
+}
+
+FIELD_TYPES = {}
+
+for field_type, field_names in [
+    ('f_date', ['date', 'urldate', 'eventdate', 'origdate']),
+    ('l_name', [
+        'afterword', 'annotator', 'author', 'bookauthor', 'commentator',
+        'editor', 'editora', 'editorb', 'editorc', 'foreword', 'holder',
+        'introduction', 'shortauthor', 'shorteditor', 'translator'
+    ]),
+    ('f_key', [
+        'authortype', 'bookpagination', 'editortype', 'editoratype',
+        'editorbtype', 'editorctype', 'origlanguage', 'pagination',
+        'pubstate', 'type'
+    ]),
+    ('l_range', ['pages']),
+    ('l_key', ['language']),
+    ('f_literal', [
+        'abstract', 'addendum', 'annotation', 'chapter', 'eid',
+        'entrysubtype', 'eprinttype', 'howpublished', 'isan', 'isbn', 'ismn',
+        'isrn', 'issn', 'issue', 'iswc', 'label', 'library', 'nameaddon',
+        'note', 'number', 'pagetotal', 'part', 'series', 'shorthand',
+        'shorthandintro', 'shortjournal', 'shortseries', 'venue', 'version',
+        'volume', 'volumes', 'eprintclass'
+    ]),
+    ('f_title', [
+        'booksubtitle', 'booktitle', 'booktitleaddon', 'eventtitle',
+        'indextitle', 'issuesubtitle', 'issuetitle', 'journalsubtitle',
+        'journaltitle', 'mainsubtitle', 'maintitle', 'maintitleaddon',
+        'origtitle', 'reprinttitle', 'shorttitle', 'subtitle', 'title',
+        'titleaddon'
+    ]),
+    ('l_literal', [
+        'institution', 'location', 'organization', 'origlocation',
+        'origpublisher', 'publisher'
+    ]),
+    ('f_integer', ['edition']),
+    ('f_verbatim', ['doi', 'eprint', 'file']),
+    ('f_uri', ['url']),
+    ('l_tag', ['keywords']),
+]:
+    for field_name in field_names:
+        FIELD_TYPES[field_name] = field_type
+
+# BibTeX field names that are mapped to BibLaTeX field names.
+FIELD_ALIASES = {
+    'address': 'location',
+    'annote': 'annotation',
+    'archiveprefix': 'eprinttype',
+    'journal': 'journaltitle',
+    'primaryclass': 'eprintclass',
+    'school': 'institution',
+}
+
+MONTHS = {
+    'jan': '01', 'feb': '02', 'mar': '03', 'apr': '04', 'may': '05',
+    'jun': '06', 'jul': '07', 'aug': '08', 'sep': '09', 'oct': '10',
+    'nov': '11', 'dec': '12'
+}
+
+# LaTeX commands that stand for a character.
+LATEX_SYMBOLS = {
+    'ss': 'ß', 'o': 'ø', 'O': 'Ø', 'ae': 'æ', 'AE': 'Æ', 'oe': 'œ',
+    'OE': 'Œ', 'aa': 'å', 'AA': 'Å', 'l': 'ł', 'L': 'Ł', 'i': 'ı',
+    'j': 'ȷ', 'dh': 'ð', 'DH': 'Ð', 'th': 'þ', 'TH': 'Þ',
+    'textendash': '–', 'textemdash': '—', 'ldots': '…', 'dots': '…',
+    'textquoteleft': '‘', 'textquoteright': '’', 'textquotedblleft': '“',
+    'textquotedblright': '”', 'S': '§', 'P': '¶', 'copyright': '©',
+    'textregistered': '®', 'texttrademark': '™', 'pounds': '£',
+    'euro': '€', 'textdegree': '°', 'LaTeX': 'LaTeX', 'TeX': 'TeX',
+}
+
+# LaTeX accent commands and the combining characters they stand for.
+LATEX_ACCENTS = {
+    "'": '́', '`': '̀', '^': '̂', '"': '̈',
+    '~': '̃', '=': '̄', '.': '̇', 'u': '̆',
+    'v': '̌', 'H': '̋', 'c': '̧', 'k': '̨',
+    'r': '̊', 'd': '̣', 'b': '̱',
+}
+
+# LaTeX commands that mark up their argument.
+LATEX_MARKS = {
+    'emph': 'em', 'textit': 'em', 'textsl': 'em', 'textbf': 'strong',
+    'textsc': 'smallcaps', 'textsuperscript': 'sup', 'textsubscript': 'sub',
+    'enquote': 'enquote', 'url': 'url',
+}
+
+# LaTeX commands that mark up the rest of the group they are in.
+LATEX_SWITCHES = {
+    'it': 'em', 'em': 'em', 'sl': 'em', 'bf': 'strong', 'sc': 'smallcaps',
+}
+
+# The mark of text in braces in titles.
+NOCASE_MARK = {'type': 'nocase'}
+
+# Characters that are written with a backslash in LaTeX.
+LATEX_ESCAPES = '&%$#_{}'
+
+EDTF_DATE = re.compile(
+    r'^(-?[\du]{4}(-[\du]{2}(-[\du]{2})?)?[?~]?)?'
+    r'(/(-?[\du]{4}(-[\du]{2}(-[\du]{2})?)?[?~]?)?)?$'
+)
+
+NAME_SEPARATOR = re.compile(r'\s+and\s+', re.IGNORECASE)
+
+BLOCK_START = re.compile(r'@\s*([A-Za-z]+)\s*([{(])')
+
+NAME = re.compile(r'[^\s,={}"#()]+')
+
+LATEX_COMMAND = re.compile(r'\\([A-Za-z]+|.)')
+
+
+class BibTeXError(Exception):
+    pass
+
+
+def split_bibtex(bibtex):
+    """
+    Splits the contents of a .bib file into the texts of its blocks
+    (@type{...} or @type(...)). Text between the blocks is a comment in BibTeX
+    and ignored.
+    """
+    blocks = []
+    position = bibtex.find('@')
+    while position > -1:
+        opening = BLOCK_START.match(bibtex, position)
+        if opening is None:
+            position = bibtex.find('@', position + 1)
+            continue
+        closing_char = '}' if opening.group(2) == '{' else ')'
+        depth = 0
+        index = opening.end()
+        end = -1
+        while index < len(bibtex):
+            char = bibtex[index]
+            if char == '{':
+                depth += 1
+            elif char == '}':
+                if depth == 0 and closing_char == '}':
+                    end = index
+                    break
+                depth -= 1
+            elif char == ')' and depth == 0 and closing_char == ')':
+                end = index
+                break
+            index += 1
+        if end == -1:
+            # Unclosed block, it ends where the next block starts.
+            end = bibtex.find('\n@', opening.end())
+            if end == -1:
+                end = len(bibtex) - 1
+        blocks.append(bibtex[position:end + 1])
+        position = bibtex.find('@', end + 1)
+    return blocks
+
+
+def block_type(block):
+    return BLOCK_START.match(block).group(1).lower()
+
+
+class BlockParser(object):
+    """
+    Parses the inside of a block: the key and the fields of an entry or the
+    definition of a @string.
+    """
+
+    def __init__(self, block, macros):
+        self.macros = macros
+        self.text = block[BLOCK_START.match(block).end():]
+        if self.text.endswith('}') or self.text.endswith(')'):
+            self.text = self.text[:-1]
+        self.position = 0
+        self.key = None
+
+    def skip_whitespace(self):
+        while (
+            self.position < len(self.text) and
+            self.text[self.position].isspace()
+        ):
+            self.position += 1
+
+    def at_end(self):
+        self.skip_whitespace()
+        return self.position >= len(self.text)
+
+    def read_name(self):
+        self.skip_whitespace()
+        match = NAME.match(self.text, self.position)
+        if match is None:
+            raise BibTeXError('expected_name')
+        self.position = match.end()
+        return match.group(0)
+
+    def expect(self, char):
+        self.skip_whitespace()
+        if not self.text.startswith(char, self.position):
+            raise BibTeXError('expected_%s' % {
+                ',': 'comma',
+                '=': 'equation_sign'
+            }.get(char, 'character'))
+        self.position += 1
+
+    def read_braced(self):
+        # Starts after the opening brace.
+        depth = 0
+        start = self.position
+        while self.position < len(self.text):
+            char = self.text[self.position]
+            if char == '\\':
+                self.position += 2
+                continue
+            if char == '{':
+                depth += 1
+            elif char == '}':
+                if depth == 0:
+                    self.position += 1
+                    return self.text[start:self.position - 1]
+                depth -= 1
+            self.position += 1
+        raise BibTeXError('unclosed_brace')
+
+    def read_quoted(self):
+        # Starts after the opening quote. Quotes within braces do not end the
+        # value.
+        depth = 0
+        start = self.position
+        while self.position < len(self.text):
+            char = self.text[self.position]
+            if char == '\\':
+                self.position += 2
+                continue
+            if char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+            elif char == '"' and depth == 0:
+                self.position += 1
+                return self.text[start:self.position - 1]
+            self.position += 1
+        raise BibTeXError('unclosed_quote')
+
+    def read_value(self):
+        parts = []
+        while True:
+            self.skip_whitespace()
+            char = self.text[self.position:self.position + 1]
+            if char == '{':
+                self.position += 1
+                parts.append(self.read_braced())
+            elif char == '"':
+                self.position += 1
+                parts.append(self.read_quoted())
+            else:
+                name = self.read_name()
+                if name.isdigit():
+                    parts.append(name)
+                elif name.lower() in self.macros:
+                    parts.append(self.macros[name.lower()])
+                elif name.lower() in MONTHS:
+                    parts.append(MONTHS[name.lower()])
+                else:
+                    raise BibTeXError('undefined_variable')
+            self.skip_whitespace()
+            if self.text.startswith('#', self.position):
+                self.position += 1
+            else:
+                return ''.join(parts)
+
+    def read_string_definition(self):
+        name = self.read_name()
+        self.expect('=')
+        return name.lower(), self.read_value()
+
+    def read_entry(self):
+        self.key = self.read_name()
+        fields = []
+        while not self.at_end():
+            self.expect(',')
+            if self.at_end():
+                # Trailing comma.
+                break
+            name = self.read_name().lower()
+            self.expect('=')
+            fields.append((name, self.read_value()))
+        return self.key, fields
+
+
+def add_node(nodes, text, marks):
+    if len(text) == 0:
+        return
+    if len(nodes) > 0 and nodes[-1].get('marks', []) == marks:
+        nodes[-1]['text'] += text
+        return
+    node = {'type': 'text', 'text': text}
+    if len(marks) > 0:
+        node['marks'] = list(marks)
+    nodes.append(node)
+
+
+def latex_to_nodes(latex, title=False):
+    """
+    Converts a LaTeX value to a list of text nodes. In titles, text in braces
+    is marked as nocase, so that its case is kept by citation styles.
+    """
+    nodes = []
+    convert_latex(latex, [], nodes, title)
+    if len(nodes) > 0:
+        nodes[0]['text'] = nodes[0]['text'].lstrip()
+        nodes[-1]['text'] = nodes[-1]['text'].rstrip()
+    for node in nodes:
+        node['text'] = unicodedata.normalize('NFC', node['text'])
+    return [node for node in nodes if node['text'] != '']
+
+
+def read_group(latex, position):
+    # Returns the argument of a command starting at position (a braced group
+    # or a single character) and the position after it.
+    while position < len(latex) and latex[position] == ' ':
+        position += 1
+    if position >= len(latex):
+        return '', position
+    if latex[position] != '{':
+        return latex[position], position + 1
+    depth = 0
+    start = position + 1
+    while position < len(latex):
+        char = latex[position]
+        if char == '\\':
+            position += 2
+            continue
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return latex[start:position], position + 1
+        position += 1
+    return latex[start:], position
+
+
+def convert_latex(latex, marks, nodes, title=False):
+    text = ''
+    position = 0
+    while position < len(latex):
+        char = latex[position]
+        if char == '\\':
+            add_node(nodes, text, marks)
+            text = ''
+            command = LATEX_COMMAND.match(latex, position)
+            if command is None:
+                break
+            name = command.group(1)
+            position = command.end()
+            if name.isalpha():
+                # Spaces after a command name are not part of the text.
+                while latex[position:position + 1] == ' ':
+                    position += 1
+            if name in LATEX_ACCENTS:
+                argument, position = read_group(latex, position)
+                if argument in ('\\i', '\\j'):
+                    # For example \'{\i}, the accent replaces the dot.
+                    argument = argument[1:]
+                elif argument.startswith('\\'):
+                    argument = LATEX_SYMBOLS.get(argument[1:], argument[1:])
+                text += argument[:1] + LATEX_ACCENTS[name] + argument[1:]
+            elif name in LATEX_SYMBOLS:
+                text += LATEX_SYMBOLS[name]
+                if latex[position:position + 2] == '{}':
+                    position += 2
+            elif name in LATEX_ESCAPES:
+                text += name
+            elif name == '\\':
+                text += ' '
+            elif name in LATEX_MARKS or name in LATEX_SWITCHES:
+                if name in LATEX_MARKS:
+                    mark = {'type': LATEX_MARKS[name]}
+                    argument, position = read_group(latex, position)
+                else:
+                    mark = {'type': LATEX_SWITCHES[name]}
+                    argument = latex[position:]
+                    position = len(latex)
+                convert_latex(
+                    argument,
+                    marks if mark in marks else marks + [mark],
+                    nodes,
+                    title
+                )
+            elif name.isalpha():
+                # Unknown command: keep its argument.
+                if latex[position:position + 1] == '{':
+                    argument, position = read_group(latex, position)
+                    convert_latex(argument, marks, nodes, title)
+            else:
+                text += name
+        elif char == '{':
+            add_node(nodes, text, marks)
+            text = ''
+            argument, position = read_group(latex, position)
+            if title and NOCASE_MARK not in marks:
+                convert_latex(argument, marks + [NOCASE_MARK], nodes, title)
+            else:
+                convert_latex(argument, marks, nodes, title)
+        elif char == '}':
+            position += 1
+        elif char == '$':
+            # Math is kept as it is.
+            end = latex.find('$', position + 1)
+            if end == -1:
+                end = len(latex)
+            text += latex[position + 1:end]
+            position = end + 1
+        elif char == '~':
+            text += ' '
+            position += 1
+        elif latex.startswith('---', position):
+            text += '—'
+            position += 3
+        elif latex.startswith('--', position):
+            text += '–'
+            position += 2
+        elif char.isspace():
+            if not text.endswith(' '):
+                text += ' '
+            position += 1
+        else:
+            text += char
+            position += 1
+    add_node(nodes, text, marks)
+
+
+def strip_value(value):
+    return re.sub(r'\s+', ' ', value).strip()
+
+
+def split_top_level(value, separator):
+    # Splits value at separator (a compiled regex) outside of braces.
+    parts = []
+    depth = 0
+    start = 0
+    position = 0
+    while position < len(value):
+        char = value[position]
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+        elif depth == 0:
+            match = separator.match(value, position)
+            if match is not None and match.end() > position:
+                parts.append(value[start:position])
+                start = position = match.end()
+                continue
+        position += 1
+    parts.append(value[start:])
+    return [part for part in parts if part.strip() != '']
+
+
+def split_name_words(name):
+    return split_top_level(name, re.compile(r'\s+'))
+
+
+def is_lowercase_word(word):
+    # von parts of names start with a lowercase letter. Words in braces are
+    # never von parts.
+    if word.startswith('{'):
+        return False
+    letters = re.sub(r'\\[A-Za-z]+|\\.|[^\w]', '', word, flags=re.UNICODE)
+    return len(letters) > 0 and letters[0].islower()
+
+
+def parse_name(name):
+    name = strip_value(name)
+    if name.startswith('{') and name.endswith('}') and \
+            split_name_words(name) == [name]:
+        # A name in braces, like an organization, is not split.
+        return {'literal': latex_to_nodes(name[1:-1])}
+    parts = [part.strip() for part in split_top_level(
+        name, re.compile(r','))]
+    given = []
+    prefix = []
+    suffix = []
+    if len(parts) == 1:
+        words = split_name_words(parts[0])
+        if len(words) == 1:
+            return {'literal': latex_to_nodes(words[0])}
+        # First von Last
+        family_start = len(words) - 1
+        for index, word in enumerate(words[:-1]):
+            if is_lowercase_word(word):
+                von_end = index
+                while von_end + 1 < len(words) - 1 and is_lowercase_word(
+                        words[von_end + 1]):
+                    von_end += 1
+                given = words[:index]
+                prefix = words[index:von_end + 1]
+                family_start = von_end + 1
+                break
+        else:
+            given = words[:-1]
+        family = words[family_start:]
+    else:
+        # von Last, First or von Last, Jr, First
+        words = split_name_words(parts[0])
+        index = 0
+        while index < len(words) - 1 and is_lowercase_word(words[index]):
+            index += 1
+        prefix = words[:index]
+        family = words[index:]
+        if len(parts) > 2:
+            suffix = split_name_words(parts[1])
+            given = split_name_words(parts[2])
+        else:
+            given = split_name_words(parts[1])
+    name_value = {'family': latex_to_nodes(' '.join(family))}
+    if len(given) > 0:
+        name_value['given'] = latex_to_nodes(' '.join(given))
+    if len(prefix) > 0:
+        name_value['prefix'] = latex_to_nodes(' '.join(prefix))
+    if len(suffix) > 0:
+        name_value['suffix'] = latex_to_nodes(' '.join(suffix))
+    return name_value
+
+
+def parse_date(value):
+    value = strip_value(value).replace(' ', '')
+    if EDTF_DATE.match(value) is None or value == '':
+        return None
+    return value
+
+
+def parse_range(value):
+    ranges = []
+    for range_item in split_top_level(value, re.compile(r',')):
+        range_parts = [
+            part for part in re.split(r'-+|–|—', range_item)
+            if part.strip() != ''
+        ]
+        if len(range_parts) > 1:
+            ranges.append([
+                latex_to_nodes(strip_value(range_parts[0])),
+                latex_to_nodes(strip_value(range_parts[-1]))
+            ])
+        elif len(range_parts) == 1:
+            ranges.append([latex_to_nodes(strip_value(range_parts[0]))])
+    return ranges
+
+
+def convert_field(field_type, value):
+    if field_type == 'f_date':
+        return parse_date(value)
+    elif field_type == 'l_name':
+        return [
+            parse_name(name) for name in split_top_level(
+                strip_value(value), NAME_SEPARATOR)
+            if strip_value(name).lower() != 'others'
+        ]
+    elif field_type == 'f_title':
+        return latex_to_nodes(strip_value(value), True)
+    elif field_type in ('f_literal', 'f_key', 'f_integer'):
+        return latex_to_nodes(strip_value(value))
+    elif field_type in ('l_literal', 'l_key'):
+        return [
+            latex_to_nodes(strip_value(item)) for item in split_top_level(
+                strip_value(value), NAME_SEPARATOR)
+        ]
+    elif field_type == 'l_range':
+        return parse_range(value)
+    elif field_type == 'l_tag':
+        return [
+            strip_value(tag) for tag in value.split(',')
+            if strip_value(tag) != ''
+        ]
+    # f_verbatim, f_uri
+    return strip_value(value)
+
+
+def convert_entry(key, bib_type, raw_fields, warnings):
+    if bib_type in BIB_TYPE_ALIASES:
+        bib_type, type_field = BIB_TYPE_ALIASES[bib_type]
+        if type_field is not None:
+            raw_fields.append(('type', type_field))
+    elif bib_type not in BIB_TYPES:
+        warnings.append({
+            'type': 'unknown_type',
+            'type_name': bib_type,
+            'entry': key
+        })
+        bib_type = 'misc'
+    fields = dict()
+    year = None
+    month = None
+    for field_name, value in raw_fields:
+        field_name = FIELD_ALIASES.get(field_name, field_name)
+        if field_name == 'year':
+            year = strip_value(value)
+            continue
+        elif field_name == 'month':
+            month = strip_value(value)
+            continue
+        elif field_name not in FIELD_TYPES:
+            warnings.append({
+                'type': 'unknown_field',
+                'field_name': field_name,
+                'entry': key
+            })
+            continue
+        converted = convert_field(FIELD_TYPES[field_name], value)
+        if converted is None:
+            warnings.append({
+                'type': 'unknown_date',
+                'field_name': field_name,
+                'entry': key
+            })
+            continue
+        fields[field_name] = converted
+    if 'date' not in fields and year is not None:
+        date = year
+        if month is not None:
+            month = MONTHS.get(month[:3].lower(), month)
+            if month.isdigit():
+                date += '-' + month.zfill(2)
+        fields['date'] = parse_date(date)
+        if fields['date'] is None:
+            del fields['date']
+            warnings.append({
+                'type': 'unknown_date',
+                'field_name': 'year',
+                'entry': key
+            })
+    # The same defaults as those of the import in the browser.
+    if 'title' not in fields:
+        fields['title'] = []
+    if 'date' not in fields:
+        fields['date'] = 'uuuu'
+    if 'author' not in fields and 'editor' not in fields:
+        fields['author'] = [{'literal': []}]
+    return {
+        'entry_key': key,
+        'bib_type': bib_type,
+        'entry_cat': '[]',
+        # Encoded like JSON.stringify does in the browser.
+        'fields': json.dumps(
+            fields,
+            ensure_ascii=False,
+            separators=(',', ':')
+        )
+    }
+
+
+def parse_string_definitions(blocks):
+    """
+    Returns the variables defined with @string in blocks.
+    """
+    macros = dict()
+    for block in blocks:
+        if block_type(block) == 'string':
+            try:
+                name, value = BlockParser(
+                    block, macros).read_string_definition()
+            except BibTeXError:
+                continue
+            macros[name] = value
+    return macros
+
+
+def parse_blocks(blocks, macros):
+    """
+    Parses the entries in blocks. Returns the entries in the format of
+    Entry, the errors and the warnings.
+    """
+    entries = []
+    errors = []
+    warnings = []
+    for block in blocks:
+        bib_type = block_type(block)
+        if bib_type in ('string', 'comment', 'preamble'):
+            continue
+        parser = BlockParser(block, macros)
+        try:
+            key, raw_fields = parser.read_entry()
+        except BibTeXError as error:
+            error_value = {'type': error.args[0]}
+            if parser.key is not None:
+                error_value['key'] = parser.key
+            errors.append(error_value)
+            continue
+        entries.append(convert_entry(key, bib_type, raw_fields, warnings))
+    return entries, errors, warnings
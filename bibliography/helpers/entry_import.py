@@ -0,0 +1,73 @@
+from builtins import range
+from collections import OrderedDict
+
+from django.db import transaction
+
+from bibliography.models import Entry, EntryChange, EntrySearchIndex, \
+    entry_hash
+
+# Number of entries that are looked up and inserted together.
+IMPORT_BATCH_SIZE = 500
+
+
+def import_entries(owner_id, bibs, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Adds bibliography entries to the bibliography of a user. bibs is a list
+    of (client id, entry) pairs, the entries being dicts with the keys
+    entry_key, bib_type, entry_cat and fields. Entries that the user has
+    already are not added again. Returns a list of [client id, entry id]
+    pairs.
+
+    Duplicates are found through the content hash of the entries, with one
+    query per batch, and the new entries of a batch are inserted together.
+    """
+    id_translations = []
+    with transaction.atomic():
+        for index in range(0, len(bibs), batch_size):
+            id_translations += import_batch(
+                owner_id,
+                bibs[index:index + batch_size]
+            )
+    return id_translations
+
+
+def import_batch(owner_id, bibs):
+    hashes = [
+        entry_hash(
+            bib['entry_key'],
+            bib['bib_type'],
+            bib['entry_cat'],
+            bib['fields']
+        ) for b_id, bib in bibs
+    ]
+    entry_ids = dict(Entry.objects.filter(
+        entry_owner_id=owner_id,
+        content_hash__in=set(hashes)
+    ).values_list('content_hash', 'id'))
+    new_entries = OrderedDict()
+    for (b_id, bib), content_hash in zip(bibs, hashes):
+        if content_hash in entry_ids or content_hash in new_entries:
+            continue
+        new_entries[content_hash] = Entry(
+            entry_owner_id=owner_id,
+            entry_key=bib['entry_key'],
+            bib_type=bib['bib_type'],
+            entry_cat=bib['entry_cat'],
+            fields=bib['fields'],
+            content_hash=content_hash
+        )
+    if len(new_entries) > 0:
+        Entry.objects.bulk_create(new_entries.values())
+        # Not all databases return the ids of inserted rows.
+        created_entries = list(Entry.objects.filter(
+            entry_owner_id=owner_id,
+            content_hash__in=list(new_entries.keys())
+        ))
+        EntrySearchIndex.update_entries(created_entries)
+        EntryChange.record(owner_id, [entry.id for entry in created_entries])
+        for entry in created_entries:
+            entry_ids[entry.content_hash] = entry.id
+    return [
+        [b_id, entry_ids[content_hash]]
+        for (b_id, bib), content_hash in zip(bibs, hashes)
+    ]
@@ -0,0 +1,69 @@
+import re
+
+from django.db import connection
+
+# The orders the entries can be sorted in. The id keeps the order of entries
+# with the same values stable between pages.
+SORT_ORDERS = {
+    'author': ['search_index__author', 'search_index__year', 'id'],
+    '-author': ['-search_index__author', '-search_index__year', '-id'],
+    'title': ['search_index__title', 'id'],
+    '-title': ['-search_index__title', '-id'],
+    'year': ['search_index__year', 'search_index__author', 'id'],
+    '-year': ['-search_index__year', 'search_index__author', '-id'],
+    'doi': ['search_index__doi', 'id'],
+    '-doi': ['-search_index__doi', '-id'],
+}
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+# Whether the FTS5 table exists, which the migration only creates if SQLite
+# supports it.
+sqlite_full_text_index = None
+
+
+def has_sqlite_full_text_index():
+    global sqlite_full_text_index
+    if sqlite_full_text_index is None:
+        sqlite_full_text_index = (
+            'bibliography_entrysearch_fts' in
+            connection.introspection.table_names()
+        )
+    return sqlite_full_text_index
+
+
+def filter_by_text(entries, query):
+    """
+    Restricts a queryset of entries to those whose search index text
+    contains all the words of query, or words that start with them. The full
+    text index created in the migrations is used on SQLite (FTS5, if it is
+    available) and PostgreSQL (tsvector), other databases search with LIKE.
+    """
+    words = WORD.findall(query)
+    if len(words) == 0:
+        return entries
+    if connection.vendor == 'sqlite' and has_sqlite_full_text_index():
+        return entries.extra(
+            where=[
+                'bibliography_entry.id IN (SELECT rowid FROM '
+                'bibliography_entrysearch_fts WHERE '
+                'bibliography_entrysearch_fts MATCH %s)'
+            ],
+            params=[' '.join('"%s"*' % word for word in words)]
+        )
+    elif connection.vendor == 'postgresql':
+        return entries.extra(
+            where=[
+                'bibliography_entry.id IN (SELECT entry_id FROM '
+                'bibliography_entrysearchindex WHERE '
+                "to_tsvector('simple', text) @@ to_tsquery('simple', %s))"
+            ],
+            params=[' & '.join('%s:*' % word for word in words)]
+        )
+    for word in words:
+        entries = entries.filter(search_index__text__icontains=word)
+    return entries
+
+
+def sort_entries(entries, sort):
+    return entries.order_by(*SORT_ORDERS.get(sort, SORT_ORDERS['author']))
@@ -0,0 +1,103 @@
+import json
+from collections import deque
+from timeit import default_timer
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from bibliography.helpers.entry_import import import_entries
+from bibliography.models import Entry
+
+
+class Rollback(Exception):
+    pass
+
+
+def mock_bibs(count):
+    bibs = []
+    for index in range(count):
+        bibs.append((str(index), {
+            'entry_key': 'Author%d' % index,
+            'bib_type': 'article',
+            'entry_cat': '[]',
+            'fields': json.dumps({
+                'title': [{'type': 'text', 'text': 'Title %d' % index}],
+                'author': [{'family': [{'type': 'text', 'text': 'Author'}]}],
+                'date': '2017',
+                'journaltitle': [{'type': 'text', 'text': 'Journal'}],
+            })
+        }))
+    return bibs
+
+
+def import_entries_one_by_one(owner_id, bibs):
+    # The import as it was done before, for comparison.
+    id_translations = []
+    for b_id, bib in bibs:
+        inserting_obj = {
+            'entry_owner_id': owner_id,
+            'entry_key': bib['entry_key'],
+            'bib_type': bib['bib_type'],
+            'entry_cat': bib['entry_cat'],
+            'fields': bib['fields']
+        }
+        similar = Entry.objects.filter(**inserting_obj)
+        if len(similar) == 0:
+            the_entry = Entry(**inserting_obj)
+            the_entry.save()
+            id_translations.append([b_id, the_entry.id])
+        else:
+            id_translations.append([b_id, similar[0].id])
+    return id_translations
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the time and number of queries needed to import bibliography '
+        'entries one by one and in batches. Every import is run twice, the '
+        'second time all entries are duplicates. The entries are removed '
+        'afterward.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--entries',
+            type=int,
+            default=5000,
+            help='Number of imported entries.'
+        )
+
+    def handle(self, *args, **options):
+        bibs = mock_bibs(options['entries'])
+        # Django only logs the last 9000 queries by default.
+        connection.queries_log = deque()
+        importers = [
+            ('one by one', import_entries_one_by_one),
+            ('batched', import_entries),
+        ]
+        self.stdout.write('%-12s %-10s %10s %14s %10s' % (
+            'import', 'entries', 'queries', 'entries/s', 'seconds'))
+        for importer_name, importer in importers:
+            try:
+                with transaction.atomic():
+                    owner = User.objects.create(username='benchmark_owner')
+                    for run_name in ('new', 'duplicate'):
+                        connection.queries_log.clear()
+                        with CaptureQueriesContext(connection) as queries:
+                            start = default_timer()
+                            importer(owner.id, bibs)
+                            duration = default_timer() - start
+                        self.stdout.write(
+                            '%-12s %-10s %10d %14.0f %10.2f' % (
+                                importer_name,
+                                run_name,
+                                len(queries),
+                                len(bibs) / duration,
+                                duration
+                            )
+                        )
+                    raise Rollback
+            except Rollback:
+                pass
@@ -0,0 +1,40 @@
+import io
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from bibliography.helpers.bibtex_import import run_import
+from bibliography.models import BibImportJob
+
+
+class Command(BaseCommand):
+    help = 'Import a BibTeX file into the bibliography of a user.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('bibtex_file')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError('No such user: %s' % options['username'])
+        with io.open(
+            options['bibtex_file'],
+            encoding='utf-8',
+            errors='replace'
+        ) as bibtex_file:
+            bibtex = bibtex_file.read()
+        job = BibImportJob.objects.create(owner=user)
+
+        def progress(job):
+            self.stdout.write('%d/%d entries' % (job.processed, job.total))
+        run_import(job, bibtex, progress)
+        if job.status != 'done':
+            raise CommandError('The import failed.')
+        self.stdout.write('Imported %d entries, %d errors, %d warnings' % (
+            len(json.loads(job.entry_ids)),
+            len(json.loads(job.errors)),
+            len(json.loads(job.warnings))
+        ))
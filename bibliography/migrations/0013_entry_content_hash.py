@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 21:49
+from __future__ import unicode_literals
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def set_content_hash(apps, schema_editor):
+    # We can't import the model directly as it may be a newer
+    # version than this migration expects. We use the historical version.
+    Entry = apps.get_model("bibliography", "Entry")
+    for entry in Entry.objects.all().iterator():
+        entry.content_hash = hashlib.sha256(json.dumps([
+            entry.entry_key,
+            entry.bib_type,
+            entry.entry_cat,
+            entry.fields
+        ]).encode('utf-8')).hexdigest()
+        entry.save(update_fields=['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('bibliography', '0012_entrychange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entry',
+            name='content_hash',
+            field=models.CharField(default=b'', max_length=64),
+        ),
+        migrations.RunPython(set_content_hash, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='entry',
+            index_together=set([('entry_owner', 'content_hash')]),
+        ),
+    ]
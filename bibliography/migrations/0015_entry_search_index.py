@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 21:58
+from __future__ import unicode_literals
+
+import json
+
+from django.conf import settings
+from django.db import migrations, models, transaction, DatabaseError
+import django.db.models.deletion
+
+
+# The search values as computed when this migration was written. Later
+# changes to bibliography.models do not apply to it.
+def nodes_text(nodes):
+    # The text of a list of text nodes.
+    if not isinstance(nodes, list):
+        return u''
+    return u''.join(
+        node.get('text', u'') for node in nodes if isinstance(node, dict)
+    )
+
+
+def name_text(name):
+    if not isinstance(name, dict):
+        return u''
+    if 'literal' in name:
+        return nodes_text(name['literal'])
+    return u' '.join(part for part in [
+        nodes_text(name.get('prefix')),
+        nodes_text(name.get('family')),
+        nodes_text(name.get('given'))
+    ] if part != u'')
+
+
+def search_values(entry_key, fields):
+    """
+    Returns the values of EntrySearchIndex for an entry, given its key and its
+    fields (as JSON).
+    """
+    try:
+        fields = json.loads(fields)
+    except ValueError:
+        fields = dict()
+    names = fields.get('author') or fields.get('editor') or []
+    if not isinstance(names, list):
+        names = []
+    names = [name_text(name) for name in names]
+    title = nodes_text(fields.get('title'))
+    date = fields.get('date')
+    year = None
+    if isinstance(date, type(u'')) and date[:4].isdigit():
+        year = int(date[:4])
+    doi = fields.get('doi')
+    if not isinstance(doi, type(u'')):
+        doi = u''
+    text = [entry_key, title, doi] + names
+    for field_name in ['booktitle', 'journaltitle', 'subtitle']:
+        text.append(nodes_text(fields.get(field_name)))
+    for field_name in ['publisher', 'institution', 'organization']:
+        for item in fields.get(field_name) or []:
+            text.append(nodes_text(item))
+    keywords = fields.get('keywords') or []
+    if isinstance(keywords, list):
+        text += [keyword for keyword in keywords if isinstance(
+            keyword, type(u''))]
+    if year is not None:
+        text.append(u'%d' % year)
+    return {
+        'author': (names[0] if len(names) > 0 else u'')[:255].lower(),
+        'title': title[:255].lower(),
+        'year': year,
+        'doi': doi[:255].lower(),
+        'text': u' '.join(part for part in text if part != u'')
+    }
+
+
+SQLITE_FULL_TEXT_INDEX = [
+    # An external content FTS5 table that indexes the text column of the
+    # search index. Triggers keep it in sync.
+    "CREATE VIRTUAL TABLE bibliography_entrysearch_fts USING fts5("
+    "text, content='bibliography_entrysearchindex', content_rowid='entry_id')",
+    "CREATE TRIGGER bibliography_entrysearch_fts_insert AFTER INSERT ON "
+    "bibliography_entrysearchindex BEGIN "
+    "INSERT INTO bibliography_entrysearch_fts(rowid, text) "
+    "VALUES (new.entry_id, new.text); END",
+    "CREATE TRIGGER bibliography_entrysearch_fts_delete AFTER DELETE ON "
+    "bibliography_entrysearchindex BEGIN "
+    "INSERT INTO bibliography_entrysearch_fts"
+    "(bibliography_entrysearch_fts, rowid, text) "
+    "VALUES ('delete', old.entry_id, old.text); END",
+    "CREATE TRIGGER bibliography_entrysearch_fts_update AFTER UPDATE ON "
+    "bibliography_entrysearchindex BEGIN "
+    "INSERT INTO bibliography_entrysearch_fts"
+    "(bibliography_entrysearch_fts, rowid, text) "
+    "VALUES ('delete', old.entry_id, old.text); "
+    "INSERT INTO bibliography_entrysearch_fts(rowid, text) "
+    "VALUES (new.entry_id, new.text); END",
+]
+
+SQLITE_DROP_FULL_TEXT_INDEX = [
+    "DROP TRIGGER IF EXISTS bibliography_entrysearch_fts_insert",
+    "DROP TRIGGER IF EXISTS bibliography_entrysearch_fts_delete",
+    "DROP TRIGGER IF EXISTS bibliography_entrysearch_fts_update",
+    "DROP TABLE IF EXISTS bibliography_entrysearch_fts",
+]
+
+POSTGRESQL_FULL_TEXT_INDEX = [
+    "CREATE INDEX bibliography_entrysearchindex_text_fts ON "
+    "bibliography_entrysearchindex "
+    "USING gin(to_tsvector('simple', text))",
+]
+
+POSTGRESQL_DROP_FULL_TEXT_INDEX = [
+    "DROP INDEX IF EXISTS bibliography_entrysearchindex_text_fts",
+]
+
+
+def run_statements(schema_editor, statements):
+    statements = statements.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def sqlite_has_fts5(schema_editor):
+    # SQLite before 3.9 and builds without the extension have no FTS5.
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE temp.bibliography_fts5_check "
+                "USING fts5(text)"
+            )
+            schema_editor.execute("DROP TABLE temp.bibliography_fts5_check")
+    except DatabaseError:
+        return False
+    return True
+
+
+def create_full_text_index(apps, schema_editor):
+    # Other databases, and SQLite without FTS5, search with LIKE (see
+    # bibliography.helpers.search).
+    if (
+        schema_editor.connection.vendor == 'sqlite' and
+        not sqlite_has_fts5(schema_editor)
+    ):
+        return
+    run_statements(schema_editor, {
+        'sqlite': SQLITE_FULL_TEXT_INDEX,
+        'postgresql': POSTGRESQL_FULL_TEXT_INDEX
+    })
+
+
+def drop_full_text_index(apps, schema_editor):
+    run_statements(schema_editor, {
+        'sqlite': SQLITE_DROP_FULL_TEXT_INDEX,
+        'postgresql': POSTGRESQL_DROP_FULL_TEXT_INDEX
+    })
+
+
+def fill_search_index(apps, schema_editor):
+    # We can't import the model directly as it may be a newer
+    # version than this migration expects. We use the historical version.
+    Entry = apps.get_model("bibliography", "Entry")
+    EntryCategory = apps.get_model("bibliography", "EntryCategory")
+    EntrySearchIndex = apps.get_model("bibliography", "EntrySearchIndex")
+    Membership = Entry.categories.through
+    category_ids = set(EntryCategory.objects.values_list('id', flat=True))
+    for entry in Entry.objects.all().iterator():
+        EntrySearchIndex.objects.create(
+            entry_id=entry.id,
+            owner_id=entry.entry_owner_id,
+            **search_values(entry.entry_key, entry.fields)
+        )
+        try:
+            entry_cat = json.loads(entry.entry_cat)
+        except ValueError:
+            entry_cat = []
+        for category_id in set(entry_cat):
+            if category_id in category_ids:
+                Membership.objects.create(
+                    entry_id=entry.id,
+                    entrycategory_id=category_id
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('bibliography', '0014_bibimportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntrySearchIndex',
+            fields=[
+                ('entry', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_index', serialize=False, to='bibliography.Entry')),
+                ('author', models.CharField(default=b'', max_length=255)),
+                ('title', models.CharField(default=b'', max_length=255)),
+                ('year', models.IntegerField(null=True)),
+                ('doi', models.CharField(default=b'', max_length=255)),
+                ('text', models.TextField(default=b'')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='categories',
+            field=models.ManyToManyField(blank=True, related_name='entries', to='bibliography.EntryCategory'),
+        ),
+        migrations.AlterIndexTogether(
+            name='entrysearchindex',
+            index_together=set([('owner', 'doi'), ('owner', 'year'), ('owner', 'title'), ('owner', 'author')]),
+        ),
+        migrations.RunPython(create_full_text_index, drop_full_text_index),
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,80 @@
+import hashlib
+import json
+
 from django.db import models
 from django.contrib.auth.models import User
 
+from user.models import LibraryVersion
+
+
+def entry_hash(entry_key, bib_type, entry_cat, fields):
+    return hashlib.sha256(json.dumps(
+        [entry_key, bib_type, entry_cat, fields]
+    ).encode('utf-8')).hexdigest()
+
+
+def nodes_text(nodes):
+    # The text of a list of text nodes.
+    if not isinstance(nodes, list):
+        return u''
+    return u''.join(
+        node.get('text', u'') for node in nodes if isinstance(node, dict)
+    )
+
+
+def name_text(name):
+    if not isinstance(name, dict):
+        return u''
+    if 'literal' in name:
+        return nodes_text(name['literal'])
+    return u' '.join(part for part in [
+        nodes_text(name.get('prefix')),
+        nodes_text(name.get('family')),
+        nodes_text(name.get('given'))
+    ] if part != u'')
+
+
+def search_values(entry_key, fields):
+    """
+    Returns the values of EntrySearchIndex for an entry, given its key and its
+    fields (as JSON).
+    """
+    try:
+        fields = json.loads(fields)
+    except ValueError:
+        fields = dict()
+    names = fields.get('author') or fields.get('editor') or []
+    if not isinstance(names, list):
+        names = []
+    names = [name_text(name) for name in names]
+    title = nodes_text(fields.get('title'))
+    date = fields.get('date')
+    year = None
+    if isinstance(date, type(u'')) and date[:4].isdigit():
+        year = int(date[:4])
+    doi = fields.get('doi')
+    if not isinstance(doi, type(u'')):
+        doi = u''
+    text = [entry_key, title, doi] + names
+    for field_name in ['booktitle', 'journaltitle', 'subtitle']:
+        text.append(nodes_text(fields.get(field_name)))
+    for field_name in ['publisher', 'institution', 'organization']:
+        for item in fields.get(field_name) or []:
+            text.append(nodes_text(item))
+    keywords = fields.get('keywords') or []
+    if isinstance(keywords, list):
+        text += [keyword for keyword in keywords if isinstance(
+            keyword, type(u''))]
+    if year is not None:
+        text.append(u'%d' % year)
+    return {
+        'author': (names[0] if len(names) > 0 else u'')[:255].lower(),
+        'title': title[:255].lower(),
+        'year': year,
+        'doi': doi[:255].lower(),
+        'text': u' '.join(part for part in text if part != u'')
+    }
+
 
 class EntryCategory(models.Model):
     category_title = models.CharField(max_length=100)
@@ -22,6 +96,169 @@ class Entry(models.Model):
     last_modified = models.DateTimeField(auto_now=True)
     bib_type = models.CharField(max_length=30, default='')
     fields = models.TextField(default='{}')  # json object with all the fields
+    # Hash of the four fields above, used to find duplicates.
+    content_hash = models.CharField(max_length=64, default='')
+    # The categories in entry_cat, kept in sync by EntrySearchIndex.
+    categories = models.ManyToManyField(
+        EntryCategory,
+        blank=True,
+        related_name='entries'
+    )
+
+    class Meta:
+        index_together = (('entry_owner', 'content_hash'),)
 
     def __unicode__(self):
         return self.entry_key
+
+    def save(self, *args, **kwargs):
+        self.content_hash = entry_hash(
+            self.entry_key,
+            self.bib_type,
+            self.entry_cat,
+            self.fields
+        )
+        super(Entry, self).save(*args, **kwargs)
+        EntrySearchIndex.update_entries([self])
+
+
+class EntrySearchIndex(models.Model):
+    # The values of an entry that it can be searched and sorted by. author and
+    # title are lower case for sorting. text is all the searchable text of the
+    # entry, which is indexed for full text search (see
+    # bibliography.helpers.search).
+    entry = models.OneToOneField(
+        Entry,
+        primary_key=True,
+        related_name='search_index'
+    )
+    owner = models.ForeignKey(User)
+    author = models.CharField(max_length=255, default='')
+    title = models.CharField(max_length=255, default='')
+    year = models.IntegerField(null=True)
+    doi = models.CharField(max_length=255, default='')
+    text = models.TextField(default='')
+
+    class Meta:
+        index_together = (
+            ('owner', 'author'),
+            ('owner', 'title'),
+            ('owner', 'year'),
+            ('owner', 'doi'),
+        )
+
+    def __unicode__(self):
+        return self.title
+
+    @classmethod
+    def update_entries(cls, entries):
+        """
+        Update the search index and the categories of saved entries.
+        """
+        entries = list(entries)
+        if len(entries) == 0:
+            return
+        entry_ids = [entry.id for entry in entries]
+        cls.objects.filter(entry_id__in=entry_ids).delete()
+        cls.objects.bulk_create([
+            cls(
+                entry_id=entry.id,
+                owner_id=entry.entry_owner_id,
+                **search_values(entry.entry_key, entry.fields)
+            ) for entry in entries
+        ])
+        Membership = Entry.categories.through
+        Membership.objects.filter(entry_id__in=entry_ids).delete()
+        memberships = []
+        for entry in entries:
+            try:
+                category_ids = json.loads(entry.entry_cat)
+            except ValueError:
+                category_ids = []
+            memberships += [
+                Membership(entry_id=entry.id, entrycategory_id=category_id)
+                for category_id in set(category_ids)
+                if isinstance(category_id, int)
+            ]
+        # Categories that have been deleted are left out.
+        existing_category_ids = set(EntryCategory.objects.filter(
+            id__in=[
+                membership.entrycategory_id for membership in memberships
+            ]
+        ).values_list('id', flat=True))
+        Membership.objects.bulk_create([
+            membership for membership in memberships
+            if membership.entrycategory_id in existing_category_ids
+        ])
+
+
+class EntryChange(models.Model):
+    # The journal of changes to the bibliography entries of a user. The ids
+    # serve as sequence numbers: clients that have stored the entries ask for
+    # the changes with an id higher than the last one they have seen. Only
+    # the latest change of each entry is kept, so the journal grows with the
+    # number of entries and deletions, not with the number of edits.
+    owner = models.ForeignKey(User)
+    entry_id = models.PositiveIntegerField()
+    deleted = models.BooleanField(default=False)
+
+    class Meta:
+        index_together = (('owner', 'entry_id'),)
+
+    def __unicode__(self):
+        return '%(owner_id)d: %(entry_id)d' % {
+            'owner_id': self.owner_id,
+            'entry_id': self.entry_id
+        }
+
+    @classmethod
+    def record(cls, owner_id, entry_ids, deleted=False):
+        """
+        Record that the given entries of a user have been saved or deleted.
+        """
+        entry_ids = list(entry_ids)
+        if len(entry_ids) == 0:
+            return
+        for index in range(0, len(entry_ids), 100):
+            cls.objects.filter(
+                owner_id=owner_id,
+                entry_id__in=entry_ids[index:index + 100]
+            ).delete()
+        cls.objects.bulk_create([
+            cls(owner_id=owner_id, entry_id=entry_id, deleted=deleted)
+            for entry_id in entry_ids
+        ])
+        LibraryVersion.bump(owner_id, 'bibliography')
+
+
+IMPORT_JOB_STATUS_CHOICES = (
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+)
+
+
+class BibImportJob(models.Model):
+    # The import of a BibTeX file into the bibliography of a user, which runs
+    # in the background. total is the number of entries in the file and
+    # processed the number of those that have been imported so far.
+    owner = models.ForeignKey(User)
+    status = models.CharField(
+        max_length=10,
+        choices=IMPORT_JOB_STATUS_CHOICES,
+        default='queued'
+    )
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    entry_ids = models.TextField(default='[]')  # json list of imported ids
+    errors = models.TextField(default='[]')  # json list of parser errors
+    warnings = models.TextField(default='[]')  # json list of parser warnings
+    added = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return '%(owner_id)d: %(status)s' % {
+            'owner_id': self.owner_id,
+            'status': self.status
+        }
@@ -1,6 +1,6 @@
 import {activateWait, deactivateWait, addAlert, csrfToken} from "../common/common"
 
-const FW_LOCALSTORAGE_VERSION = "1.0"
+const FW_LOCALSTORAGE_VERSION = "1.1"
 
 export class BibliographyDB {
     constructor(docOwnerId, useLocalStorage, oldDB, oldCats) {
@@ -26,29 +26,23 @@ export class BibliographyDB {
 
     getDB(callback) {
 
-        let lastModified = -1, numberOfEntries = -1
+        let data = {
+            'owner_id': this.docOwnerId
+        }
 
         if (this.useLocalStorage) {
-            let lastModified = parseInt(window.localStorage.getItem('last_modified_biblist')),
-                numberOfEntries = parseInt(window.localStorage.getItem('number_of_entries')),
+            let seq = parseInt(window.localStorage.getItem('biblist_seq')),
                 localStorageVersion = window.localStorage.getItem('version'),
                 localStorageOwnerId = parseInt(window.localStorage.getItem('owner_id'))
 
-            // A dictionary to look up bib fields by their fw type name.
-            // Needed for translation to CSL and Biblatex.
-            //Fill BibDB
-
-            if (_.isNaN(lastModified)) {
-                lastModified = -1
-            }
-
-            if (_.isNaN(numberOfEntries)) {
-                numberOfEntries = -1
-            }
-
-            if (localStorageVersion != FW_LOCALSTORAGE_VERSION || localStorageOwnerId != this.docOwnerId) {
-                lastModified = -1
-                numberOfEntries = -1
+            if (
+                !_.isNaN(seq) &&
+                localStorageVersion == FW_LOCALSTORAGE_VERSION &&
+                localStorageOwnerId == this.docOwnerId &&
+                window.localStorage.getItem('biblist') !== null
+            ) {
+                // Only ask for the changes since the stored list was loaded.
+                data['seq'] = seq
             }
         }
 
@@ -56,18 +50,23 @@ export class BibliographyDB {
         activateWait()
 
         jQuery.ajax({
-            url: '/bibliography/biblist/',
-            data: {
-                'owner_id': this.docOwnerId,
-                'last_modified': lastModified,
-                'number_of_entries': numberOfEntries,
-            },
+            url: '/bibliography/biblist/stream/',
+            data,
             type: 'POST',
-            dataType: 'json',
+            dataType: 'text',
             crossDomain: false, // obviates need for sameOrigin test
             beforeSend: (xhr, settings) =>
                 xhr.setRequestHeader("X-CSRFToken", csrfToken),
-            success: (response, textStatus, jqXHR) => {
+            success: (responseText, textStatus, jqXHR) => {
+                // The response is newline delimited JSON. The first line
+                // holds everything but the entries, which follow one per line.
+                let lines = responseText.split('\n').filter(line => line.length)
+                let response = JSON.parse(lines[0])
+                if (response.bibList) {
+                    response.bibList = lines.slice(1).map(line => JSON.parse(line))
+                } else {
+                    response.bibList = []
+                }
                 this.lastLoadTimes.push(Date.now())
                 this.lastLoadTimes = this.lastLoadTimes.slice(Math.max(this.lastLoadTimes.length - 10, 0))
                 let newBibCats = response.bibCategories
@@ -75,25 +74,28 @@ export class BibliographyDB {
                     this.cats.push(bibCat)
                 })
 
-                let bibList = []
+                let bibList = response.bibList
 
                 if (this.useLocalStorage) {
-                    if (response.hasOwnProperty('bibList')) {
-                        bibList = response.bibList
-                        try {
-                            window.localStorage.setItem('biblist', JSON.stringify(response.bibList))
-                            window.localStorage.setItem('last_modified_biblist', response.last_modified)
-                            window.localStorage.setItem('number_of_entries', response.number_of_entries)
-                            window.localStorage.setItem('owner_id', response.docOwnerId)
-                            window.localStorage.setItem('version', FW_LOCALSTORAGE_VERSION)
-                        } catch (error) {
-                            // The local storage was likely too small
-                        }
-                    } else {
-                        bibList = JSON.parse(window.localStorage.getItem('biblist'))
+                    if (response.hasOwnProperty('deleted')) {
+                        // The response only holds the changes since the
+                        // stored list was loaded.
+                        let changedIds = {}
+                        response.bibList.forEach(item => changedIds[item.id] = true)
+                        response.deleted.forEach(id => changedIds[id] = true)
+                        bibList = JSON.parse(
+                            window.localStorage.getItem('biblist')
+                        ).filter(item => !changedIds[item.id]).concat(response.bibList)
+                    }
+                    try {
+                        window.localStorage.setItem('biblist', JSON.stringify(bibList))
+                        window.localStorage.setItem('biblist_seq', response.seq)
+                        window.localStorage.setItem('owner_id', this.docOwnerId)
+                        window.localStorage.setItem('version', FW_LOCALSTORAGE_VERSION)
+                    } catch (error) {
+                        // The local storage was likely too small
+                        window.localStorage.removeItem('biblist')
                     }
-                } else {
-                    bibList = response.bibList
                 }
                 let newBibPks = []
                 for (let i = 0; i < bibList.length; i++) {
@@ -1,7 +1,10 @@
-import {BibLatexParser} from "biblatex-csl-converter"
 import {importBibTemplate} from "./templates"
 import {activateWait, deactivateWait, addAlert, csrfToken} from "../../common/common"
 
+// The server gives up on imports that make no progress for 10 minutes, so
+// the status is not checked for much longer than that without progress.
+const MAX_STATUS_CHECKS = 330
+
 /** First step of the BibTeX file import. Creates a dialog box to specify upload file.
  */
 
@@ -10,8 +13,9 @@ export class BibLatexFileImporter {
     constructor(bibDB, callback) {
         this.bibDB = bibDB
         this.callback = callback
+        this.processed = 0
+        this.statusChecks = 0
         this.openDialog()
-        this.tmpDB = false
     }
 
     openDialog() {
@@ -25,15 +29,12 @@ export class BibLatexFileImporter {
                 return false
             }
             bibFile = bibFile[0]
-            if (10485760 < bibFile.size) {
+            if (52428800 < bibFile.size) {
                 console.warn('file too big')
                 return false
             }
             activateWait()
-            let reader = new window.FileReader()
-            reader.onerror = error => console.error('error', error.target.error.code)
-            reader.onload = event => that.processFile(event.target.result)
-            reader.readAsText(bibFile)
+            that.uploadFile(bibFile)
             jQuery(this).dialog('close')
         }
         diaButtons[gettext('Cancel')] = function () {
@@ -63,93 +64,116 @@ export class BibLatexFileImporter {
         })
     }
 
-    /** Second step of the BibTeX file import. Takes a BibTeX file object,
-     * processes client side and cuts into chunks to be uploaded to the server.
+    /** Second step of the BibTeX file import. Uploads the BibTeX file to
+     * the server, which parses and imports it in the background.
      */
-    processFile(fileContents) {
-        let bibData = new BibLatexParser(fileContents)
-        this.tmpDB = bibData.output
-        this.bibKeys = Object.keys(this.tmpDB)
-        if (_.isEmpty(this.bibKeys)) {
-            deactivateWait()
-            addAlert('error', gettext('No bibliography entries could be found in import file.'))
-            return
-        } else {
-            this.bibKeys.forEach((bibKey) => {
-                let bibEntry = this.tmpDB[bibKey]
-                // We add an empty category list for all newly imported bib entries.
-                bibEntry.entry_cat = []
-                // If the entry has no title, add an empty title
-                if (!bibEntry.fields.title) {
-                    bibEntry.fields.title = []
-                }
-                // If the entry has no date, add an uncertain date
-                if (!bibEntry.fields.date) {
-                    bibEntry.fields.date = 'uuuu'
-                }
-                // If the entry has no editor or author, add empty author
-                if (!bibEntry.fields.author && !bibEntry.fields.editor) {
-                    bibEntry.fields.author = [{'literal': []}]
-                }
-            })
-            bibData.errors.forEach(error => {
-                let errorMsg = gettext('An error occured while reading the bibtex file')
-                errorMsg += `, error_code: ${error.type}`
-                if (error.key) {
-                    errorMsg += `, key: ${error.key}`
-                }
-                addAlert('error', errorMsg)
-            })
-            bibData.warnings.forEach(warning => {
-                let warningMsg
-                switch (warning.type) {
-                    case 'unknown_field':
-                        warningMsg = warning.field_name + gettext(' of ') +
-                            warning.entry +
-                            gettext(' cannot not be saved. Fidus Writer does not support the field.')
-                        break
-                    case 'unknown_type':
-                        warningMsg = warning.type_name + gettext(' of ') +
-                            warning.entry +
-                            gettext(' is saved as "misc". Fidus Writer does not support the entry type.')
-                        break
-                    case 'unknown_date':
-                        warningMsg = warning.field_name + gettext(' of ') +
-                            warning.entry +
-                            gettext(' not a valid EDTF string.')
-                        break
-                    default:
-                        warningMsg = gettext('An warning occured while reading the bibtex file')
-                        warningMsg += `, warning_code: ${warning.type}`
-                        if (warning.key) {
-                            warningMsg += `, key: ${warning.key}`
-                        }
-                }
-                addAlert('warning', warningMsg)
-            })
-            this.totalChunks = Math.ceil(this.bibKeys.length / 50)
-            this.currentChunkNumber = 0
-            this.processChunk()
-        }
+    uploadFile(bibFile) {
+        let formData = new window.FormData()
+        formData.append('file', bibFile)
+        jQuery.ajax({
+            url: '/bibliography/import/',
+            data: formData,
+            type: 'POST',
+            dataType: 'json',
+            processData: false,
+            contentType: false,
+            crossDomain: false, // obviates need for sameOrigin test
+            beforeSend: (xhr, settings) =>
+                xhr.setRequestHeader("X-CSRFToken", csrfToken),
+            success: (response, textStatus, jqXHR) =>
+                this.checkStatus(response.job_id),
+            error: (jqXHR, textStatus, errorThrown) => {
+                deactivateWait()
+                addAlert('error', gettext('The BibTeX file could not be uploaded.'))
+            }
+        })
+    }
 
+    /** Third step of the BibTeX file import. Asks the server for the progress
+     * of the import until it is done and then adds the imported entries.
+     */
+    checkStatus(jobId) {
+        jQuery.ajax({
+            url: '/bibliography/import_status/',
+            data: {
+                'job_id': jobId
+            },
+            type: 'POST',
+            dataType: 'json',
+            crossDomain: false, // obviates need for sameOrigin test
+            beforeSend: (xhr, settings) =>
+                xhr.setRequestHeader("X-CSRFToken", csrfToken),
+            success: (response, textStatus, jqXHR) => {
+                if (response.status === 'done') {
+                    this.importDone(response)
+                } else if (response.status === 'failed') {
+                    deactivateWait()
+                    addAlert('error', gettext('The BibTeX file could not be imported.'))
+                } else {
+                    if (response.processed > this.processed) {
+                        this.processed = response.processed
+                        this.statusChecks = 0
+                        addAlert('info', `${gettext('Importing')}: ${response.processed}/${response.total}`)
+                    }
+                    this.statusChecks++
+                    if (this.statusChecks > MAX_STATUS_CHECKS) {
+                        deactivateWait()
+                        addAlert('error', gettext('The BibTeX file could not be imported.'))
+                        return
+                    }
+                    window.setTimeout(() => this.checkStatus(jobId), 2000)
+                }
+            },
+            error: (jqXHR, textStatus, errorThrown) => {
+                deactivateWait()
+                addAlert('error', jqXHR.responseText)
+            }
+        })
     }
 
-    processChunk() {
-        if (this.currentChunkNumber < this.totalChunks) {
-            let fromNumber = this.currentChunkNumber * 50
-            let toNumber = fromNumber + 50
-            let currentChunk = {}
-            this.bibKeys.slice(fromNumber, toNumber).forEach((bibKey)=>{
-                currentChunk[bibKey] = this.tmpDB[bibKey]
-            })
-            this.bibDB.saveBibEntries(currentChunk, true, ids => {
-                this.callback(ids)
-                this.currentChunkNumber++
-                this.processChunk()
-            })
-        } else {
-            deactivateWait()
+    importDone(response) {
+        deactivateWait()
+        if (_.isEmpty(response.bibList) && _.isEmpty(response.errors)) {
+            addAlert('error', gettext('No bibliography entries could be found in import file.'))
+            return
         }
+        response.errors.forEach(error => {
+            let errorMsg = gettext('An error occured while reading the bibtex file')
+            errorMsg += `, error_code: ${error.type}`
+            if (error.key) {
+                errorMsg += `, key: ${error.key}`
+            }
+            addAlert('error', errorMsg)
+        })
+        response.warnings.forEach(warning => {
+            let warningMsg
+            switch (warning.type) {
+                case 'unknown_field':
+                    warningMsg = warning.field_name + gettext(' of ') +
+                        warning.entry +
+                        gettext(' cannot not be saved. Fidus Writer does not support the field.')
+                    break
+                case 'unknown_type':
+                    warningMsg = warning.type_name + gettext(' of ') +
+                        warning.entry +
+                        gettext(' is saved as "misc". Fidus Writer does not support the entry type.')
+                    break
+                case 'unknown_date':
+                    warningMsg = warning.field_name + gettext(' of ') +
+                        warning.entry +
+                        gettext(' not a valid EDTF string.')
+                    break
+                default:
+                    warningMsg = gettext('An warning occured while reading the bibtex file')
+                    warningMsg += `, warning_code: ${warning.type}`
+                    if (warning.key) {
+                        warningMsg += `, key: ${warning.key}`
+                    }
+            }
+            addAlert('warning', warningMsg)
+        })
+        let ids = response.bibList.map(item => this.bibDB.serverBibItemToBibDB(item))
+        this.callback(ids)
     }
 
 }
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+from django.test import SimpleTestCase
+
+from bibliography.helpers.bibtex_parser import parse_blocks, \
+    parse_string_definitions, split_bibtex
+
+
+def text(value, *marks):
+    node = {'type': 'text', 'text': value}
+    if len(marks) > 0:
+        node['marks'] = [{'type': mark} for mark in marks]
+    return node
+
+
+def parse(bibtex):
+    blocks = split_bibtex(bibtex)
+    entries, errors, warnings = parse_blocks(
+        blocks,
+        parse_string_definitions(blocks)
+    )
+    return dict(
+        (entry['entry_key'], (entry['bib_type'], json.loads(entry['fields'])))
+        for entry in entries
+    ), errors, warnings
+
+
+# The expected values are those of the import in the browser
+# (biblatex-csl-converter), including the defaults that it added for missing
+# titles, dates and authors.
+class BibTeXParserTest(SimpleTestCase):
+
+    def test_nested_braces(self):
+        entries, errors, warnings = parse(
+            '@article{nested,\n'
+            '  title = {The {DNA} of {{Nested {B}races}}},\n'
+            '  subtitle = {{\\emph{In} Situ}},\n'
+            '  note = {A {note} with \\textbf{bold {text}}},\n'
+            '  author = {{Barnes and Noble} and van der Berg, Jr, Anna},\n'
+            '}\n'
+        )
+        self.assertEqual(errors, [])
+        bib_type, fields = entries['nested']
+        self.assertEqual(bib_type, 'article')
+        # Text in braces keeps its case in titles.
+        self.assertEqual(fields['title'], [
+            text('The '),
+            text('DNA', 'nocase'),
+            text(' of '),
+            text('Nested Braces', 'nocase'),
+        ])
+        self.assertEqual(fields['subtitle'], [
+            text('In', 'nocase', 'em'),
+            text(' Situ', 'nocase'),
+        ])
+        self.assertEqual(fields['note'], [
+            text('A note with '),
+            text('bold text', 'strong'),
+        ])
+        self.assertEqual(fields['author'], [
+            {'literal': [text('Barnes and Noble')]},
+            {
+                'family': [text('Berg')],
+                'given': [text('Anna')],
+                'prefix': [text('van der')],
+                'suffix': [text('Jr')]
+            },
+        ])
+        self.assertEqual(fields['date'], 'uuuu')
+
+    def test_string_macros(self):
+        entries, errors, warnings = parse(
+            '@string{jnl = "Journal of Braces"}\n'
+            '@STRING(pub = {Big} # " " # {Publisher})\n'
+            '@string{both = jnl # { and } # pub}\n'
+            '@article{macros,\n'
+            '  journal = jnl # ", " # {Series} # 2,\n'
+            '  publisher = pub,\n'
+            '  note = both,\n'
+            '  year = 2017, month = MAR,\n'
+            '}\n'
+        )
+        self.assertEqual(errors, [])
+        fields = entries['macros'][1]
+        self.assertEqual(
+            fields['journaltitle'],
+            [text('Journal of Braces, Series2')]
+        )
+        self.assertEqual(fields['publisher'], [[text('Big Publisher')]])
+        self.assertEqual(
+            fields['note'],
+            [text('Journal of Braces and Big Publisher')]
+        )
+        self.assertEqual(fields['date'], '2017-03')
+        self.assertEqual(fields['title'], [])
+        self.assertEqual(fields['author'], [{'literal': []}])
+
+    def test_comments_and_preamble(self):
+        entries, errors, warnings = parse(
+            'Text outside of blocks is a comment @ too.\n'
+            '@comment{@article{commented, title = {Not imported}}}\n'
+            '@preamble{"\\newcommand{\\noopsort}[1]{}"}\n'
+            '@book(paren, title = "Quoted", date = {2001-02/2003})\n'
+        )
+        self.assertEqual(list(entries.keys()), ['paren'])
+        self.assertEqual(entries['paren'], ('book', {
+            'title': [text('Quoted')],
+            'date': '2001-02/2003',
+            'author': [{'literal': []}],
+        }))
+        self.assertEqual(errors, [])
+        self.assertEqual(warnings, [])
+
+    def test_malformed_entries(self):
+        entries, errors, warnings = parse(
+            '@misc{undefined, title = {x}, author = undefinedmacro}\n'
+            '@article{nocomma title = {x}}\n'
+            '@article{noequals, title {x}}\n'
+            '@article{unclosed, title = "x}\n'
+            '@article{open, title = {Open}\n'
+            '@online{good, title = {Good}, lastchecked = {today},\n'
+            '  year = {around 2000}}\n'
+            '@webpage{unknown, title = {Web}}\n'
+        )
+        self.assertEqual(errors, [
+            {'type': 'undefined_variable', 'key': 'undefined'},
+            {'type': 'expected_comma', 'key': 'nocomma'},
+            {'type': 'expected_equation_sign', 'key': 'noequals'},
+            {'type': 'unclosed_quote', 'key': 'unclosed'},
+        ])
+        # A broken entry does not keep the next ones from being imported. An
+        # entry without its closing brace ends where the next one starts.
+        self.assertEqual(
+            sorted(entries.keys()),
+            ['good', 'open', 'unknown']
+        )
+        self.assertEqual(entries['open'][1]['title'], [text('Open')])
+        self.assertEqual(entries['unknown'][0], 'misc')
+        self.assertEqual(warnings, [
+            {'type': 'unknown_field', 'field_name': 'lastchecked',
+             'entry': 'good'},
+            {'type': 'unknown_date', 'field_name': 'year', 'entry': 'good'},
+            {'type': 'unknown_type', 'type_name': 'webpage',
+             'entry': 'unknown'},
+        ])
+
+    def test_non_ascii(self):
+        entries, errors, warnings = parse(
+            '@inproceedings{utf,\n'
+            '  title = {Über Ärger — naïve café},\n'
+            '  author = {Łukasz Żółć and M{\\"u}ller, J\\"{o}rg and '
+            'Jos\\\'{\\i} \\~Nu\\~nez},\n'
+            '  address = {Zürich and Kraków},\n'
+            '}\n'
+        )
+        self.assertEqual(errors, [])
+        fields = entries['utf'][1]
+        self.assertEqual(fields['title'], [text('Über Ärger — naïve café')])
+        # LaTeX accents result in the same (composed) characters.
+        self.assertEqual(fields['author'], [
+            {'family': [text('Żółć')], 'given': [text('Łukasz')]},
+            {'family': [text('Müller')], 'given': [text('Jörg')]},
+            {'family': [text('Ñuñez')], 'given': [text('Josí')]},
+        ])
+        self.assertEqual(
+            fields['location'],
+            [[text('Zürich')], [text('Kraków')]]
+        )
+        # The fields are stored like JSON.stringify encodes them.
+        blocks = split_bibtex('@misc{utf, title = {Zürich}}')
+        self.assertIn(
+            '"text":"Zürich"',
+            parse_blocks(blocks, {})[0][0]['fields']
+        )
@@ -0,0 +1,107 @@
+import json
+
+from django.contrib.auth.models import User
+from django.test import Client, TestCase
+
+from bibliography.models import Entry, EntryChange
+from user.models import LibraryVersion
+
+
+def bib(entry_key, title):
+    return {
+        'entry_key': entry_key,
+        'bib_type': 'book',
+        'entry_cat': '[]',
+        'fields': json.dumps({'title': [{'type': 'text', 'text': title}]})
+    }
+
+
+class EntryChangeTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com')
+        self.client = Client(HTTP_HOST='localhost')
+        self.client.force_login(self.user)
+
+    def post(self, url, data):
+        response = self.client.post(
+            url,
+            data,
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        return response.status_code, json.loads(response.content)
+
+    def biblist(self, seq=None):
+        data = {'owner_id': 0}
+        if seq is not None:
+            data['seq'] = seq
+        status, response = self.post('/bibliography/biblist/', data)
+        self.assertEqual(status, 200)
+        return response
+
+    def titles(self, response):
+        return sorted(
+            json.loads(entry['fields'])['title'][0]['text']
+            for entry in response['bibList']
+        )
+
+    def save(self, bibs, is_new):
+        status, response = self.post('/bibliography/save/', {
+            'bibs': json.dumps(bibs),
+            'is_new': 'true' if is_new else 'false'
+        })
+        self.assertEqual(status, 200)
+        return dict(response['id_translations'])
+
+    def test_record(self):
+        EntryChange.record(self.user.id, [1, 2])
+        EntryChange.record(self.user.id, [1])
+        EntryChange.record(self.user.id, [2], deleted=True)
+        EntryChange.record(self.user.id, [])
+        changes = list(EntryChange.objects.filter(
+            owner=self.user
+        ).order_by('id').values_list('entry_id', 'deleted'))
+        # Only the latest change of each entry is kept.
+        self.assertEqual(changes, [(1, False), (2, True)])
+        self.assertEqual(
+            LibraryVersion.get_versions([self.user.id], 'bibliography'),
+            {self.user.id: 3}
+        )
+
+    def test_since(self):
+        first = self.biblist()
+        self.assertEqual(first['seq'], 0)
+        self.assertEqual(first['bibList'], [])
+        ids = self.save({
+            '-1': bib('a', 'A'),
+            '-2': bib('b', 'B'),
+            '-3': bib('c', 'C')
+        }, True)
+        created = self.biblist(first['seq'])
+        self.assertEqual(self.titles(created), ['A', 'B', 'C'])
+        self.assertEqual(created['deleted'], [])
+        # Nothing has changed since.
+        unchanged = self.biblist(created['seq'])
+        self.assertEqual(unchanged['seq'], created['seq'])
+        self.assertEqual(unchanged['bibList'], [])
+        self.assertEqual(unchanged['deleted'], [])
+        # Edit one entry and delete another.
+        self.save({str(ids['-1']): bib('a', 'A edited')}, False)
+        status, response = self.post('/bibliography/delete/', {
+            'ids[]': [ids['-2']]
+        })
+        self.assertEqual(status, 201)
+        changed = self.biblist(created['seq'])
+        self.assertEqual(self.titles(changed), ['A edited'])
+        self.assertEqual(changed['deleted'], [ids['-2']])
+        # A client that has not seen the creation of the entries receives
+        # the current state only.
+        since_start = self.biblist(first['seq'])
+        self.assertEqual(self.titles(since_start), ['A edited', 'C'])
+        self.assertEqual(since_start['deleted'], [ids['-2']])
+        # Entries of other users are not deleted.
+        other = User.objects.create_user('other', 'other@example.com')
+        entry = Entry.objects.create(entry_owner=other, entry_key='x')
+        self.post('/bibliography/delete/', {'ids[]': [entry.id]})
+        self.assertEqual(self.biblist(changed['seq'])['deleted'], [])
+        self.assertTrue(Entry.objects.filter(id=entry.id).exists())
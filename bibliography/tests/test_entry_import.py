@@ -0,0 +1,95 @@
+import json
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from bibliography.helpers.entry_import import import_entries
+from bibliography.models import Entry, EntryChange
+
+
+def bib(entry_key, title):
+    return {
+        'entry_key': entry_key,
+        'bib_type': 'book',
+        'entry_cat': '[]',
+        'fields': json.dumps({'title': [{'type': 'text', 'text': title}]})
+    }
+
+
+class ImportEntriesTest(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com')
+        self.other = User.objects.create_user('other', 'other@example.com')
+
+    def test_same_entry_twice(self):
+        translations = import_entries(self.owner.id, [
+            (-1, bib('a', 'A')),
+            (-2, bib('a', 'A')),
+        ])
+        entry = Entry.objects.get(entry_owner=self.owner)
+        # Both client ids are mapped to the one entry.
+        self.assertEqual(translations, [[-1, entry.id], [-2, entry.id]])
+        # Importing it again adds nothing either.
+        self.assertEqual(
+            import_entries(self.owner.id, [(-3, bib('a', 'A'))]),
+            [[-3, entry.id]]
+        )
+        self.assertEqual(
+            Entry.objects.filter(entry_owner=self.owner).count(),
+            1
+        )
+        self.assertEqual(
+            EntryChange.objects.filter(owner=self.owner).count(),
+            1
+        )
+
+    def test_same_key_different_fields(self):
+        translations = import_entries(self.owner.id, [
+            (-1, bib('a', 'A')),
+            (-2, bib('a', 'Another A')),
+        ])
+        entries = Entry.objects.filter(entry_owner=self.owner)
+        self.assertEqual(entries.count(), 2)
+        self.assertNotEqual(translations[0][1], translations[1][1])
+        self.assertEqual(
+            sorted(json.loads(entry.fields)['title'][0]['text']
+                   for entry in entries),
+            ['A', 'Another A']
+        )
+
+    def test_second_owner(self):
+        [[_, owner_entry_id]] = import_entries(
+            self.owner.id,
+            [(-1, bib('a', 'A'))]
+        )
+        # The same entry in the bibliography of another user is a copy of its
+        # own.
+        [[_, other_entry_id]] = import_entries(
+            self.other.id,
+            [(-1, bib('a', 'A'))]
+        )
+        self.assertNotEqual(owner_entry_id, other_entry_id)
+        self.assertEqual(
+            Entry.objects.get(id=other_entry_id).entry_owner,
+            self.other
+        )
+        self.assertEqual(
+            list(EntryChange.objects.filter(
+                owner=self.other
+            ).values_list('entry_id', flat=True)),
+            [other_entry_id]
+        )
+
+    def test_batches(self):
+        # Duplicates are found across batches.
+        translations = import_entries(self.owner.id, [
+            (-1, bib('a', 'A')),
+            (-2, bib('b', 'B')),
+            (-3, bib('a', 'A')),
+        ], batch_size=2)
+        self.assertEqual(translations[0][1], translations[2][1])
+        self.assertEqual(
+            Entry.objects.filter(entry_owner=self.owner).count(),
+            2
+        )
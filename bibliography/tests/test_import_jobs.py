@@ -0,0 +1,44 @@
+import json
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import Client, TestCase, override_settings
+from django.utils import timezone
+
+from bibliography.models import BibImportJob
+
+
+@override_settings(BIBTEX_IMPORT_TIMEOUT=600)
+class ImportStatusTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com')
+        self.client = Client(HTTP_HOST='localhost')
+        self.client.force_login(self.user)
+
+    def job(self, status, seconds_ago):
+        job = BibImportJob.objects.create(owner=self.user, status=status)
+        # updated is set on every save.
+        BibImportJob.objects.filter(id=job.id).update(
+            updated=timezone.now() - timedelta(seconds=seconds_ago)
+        )
+        return job
+
+    def status(self, job):
+        response = self.client.post(
+            '/bibliography/import_status/',
+            {'job_id': job.id},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)['status']
+
+    def test_progress(self):
+        self.assertEqual(self.status(self.job('queued', 30)), 'queued')
+        self.assertEqual(self.status(self.job('running', 599)), 'running')
+
+    def test_stale(self):
+        # The process that ran the jobs has ended.
+        self.assertEqual(self.status(self.job('queued', 601)), 'failed')
+        self.assertEqual(self.status(self.job('running', 3600)), 'failed')
+        self.assertEqual(self.status(self.job('done', 3600)), 'done')
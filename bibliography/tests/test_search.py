@@ -0,0 +1,120 @@
+import json
+
+from django.contrib.auth.models import User
+from django.test import Client, TestCase
+
+from bibliography.helpers import search
+from bibliography.models import Entry, EntryCategory
+
+
+def text(value):
+    return [{'type': 'text', 'text': value}]
+
+
+class SearchTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com')
+        self.client = Client(HTTP_HOST='localhost')
+        self.client.force_login(self.user)
+        self.category = EntryCategory.objects.create(
+            category_owner=self.user,
+            category_title='Category'
+        )
+        for entry_key, family, title, date, categories in [
+            ('a', 'Adams', 'Hitchhiking in space', '1979', []),
+            ('b', 'Bradbury', 'Burning books', '1953', [self.category.id]),
+            ('c', 'Clarke', 'A space odyssey', '1968', [self.category.id]),
+        ]:
+            Entry.objects.create(
+                entry_owner=self.user,
+                entry_key=entry_key,
+                bib_type='book',
+                entry_cat=json.dumps(categories),
+                fields=json.dumps({
+                    'author': [{'family': text(family)}],
+                    'title': text(title),
+                    'date': date
+                })
+            )
+        other = User.objects.create_user('other', 'other@example.com')
+        Entry.objects.create(
+            entry_owner=other,
+            entry_key='d',
+            fields=json.dumps({'title': text('Space of another user')})
+        )
+
+    def search(self, **data):
+        response = self.client.post(
+            '/bibliography/search/',
+            data,
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        if response.status_code != 200:
+            return response.status_code, None, None
+        response = json.loads(response.content)
+        return (
+            200,
+            response['total'],
+            [entry['entry_key'] for entry in response['bibList']]
+        )
+
+    def test_match(self):
+        self.assertEqual(self.search(q='space'), (200, 2, ['a', 'c']))
+        # All words have to match, each as the start of a word.
+        self.assertEqual(self.search(q='spa odys'), (200, 1, ['c']))
+        self.assertEqual(self.search(q='brad'), (200, 1, ['b']))
+        self.assertEqual(self.search(q='mars'), (200, 0, []))
+
+    def test_match_without_full_text_index(self):
+        # SQLite without FTS5 searches with LIKE.
+        search.sqlite_full_text_index = False
+        try:
+            self.test_match()
+        finally:
+            search.sqlite_full_text_index = None
+
+    def test_category(self):
+        self.assertEqual(
+            self.search(category=self.category.id),
+            (200, 2, ['b', 'c'])
+        )
+        self.assertEqual(
+            self.search(q='space', category=self.category.id),
+            (200, 1, ['c'])
+        )
+
+    def test_sort(self):
+        self.assertEqual(self.search(), (200, 3, ['a', 'b', 'c']))
+        self.assertEqual(
+            self.search(sort='-author'),
+            (200, 3, ['c', 'b', 'a'])
+        )
+        self.assertEqual(self.search(sort='year'), (200, 3, ['b', 'c', 'a']))
+        self.assertEqual(self.search(sort='title'), (200, 3, ['c', 'b', 'a']))
+
+    def test_pages(self):
+        self.assertEqual(
+            self.search(sort='year', page_size=2),
+            (200, 3, ['b', 'c'])
+        )
+        self.assertEqual(
+            self.search(sort='year', page_size=2, page=2),
+            (200, 3, ['a'])
+        )
+        # Pages after the last one are empty.
+        self.assertEqual(
+            self.search(sort='year', page_size=2, page=3),
+            (200, 3, [])
+        )
+
+    def test_invalid_arguments(self):
+        for data in [
+            {'page': 0},
+            {'page': 'last'},
+            {'page_size': 0},
+            {'page_size': '10.5'},
+            {'category': 'all'},
+            {'owner_id': 'me'},
+        ]:
+            self.assertEqual(self.search(**data)[0], 400)
@@ -6,11 +6,23 @@ urlpatterns = [
     url('^$', views.index, name='index'),
     url('^save/$', views.save_js, name='save'),
     url('^delete/$', views.delete_js, name='delete'),
+    url('^import/$', views.import_bibtex_js, name='import'),
+    url(
+        '^import_status/$',
+        views.import_status_js,
+        name='import_status'
+    ),
     url('^save_category/$', views.save_category_js, name='save_category'),
     url(
         '^delete_category/$',
         views.delete_category_js,
         name='delete_category'
     ),
-    url('^biblist/$', views.biblist_js, name='biblist')
+    url('^search/$', views.search_js, name='search'),
+    url('^biblist/$', views.biblist_js, name='biblist'),
+    url(
+        '^biblist/stream/$',
+        views.biblist_stream_js,
+        name='biblist_stream'
+    )
 ]
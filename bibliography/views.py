@@ -1,20 +1,34 @@
 import time
 import json
 from builtins import range
+from collections import OrderedDict
+from datetime import timedelta
 
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponse
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
+from django.utils import timezone
 from django.template.context_processors import csrf
 from django.db.models import Max, Count
 from django.core.serializers.python import Serializer
+from django.core.paginator import Paginator, EmptyPage
 
 from bibliography.models import (
+    BibImportJob,
     Entry,
-    EntryCategory
+    EntryCategory,
+    EntryChange
 )
+from bibliography.helpers.bibtex_import import fail_stale_jobs, \
+    start_import
+from bibliography.helpers.entry_import import import_entries
+from bibliography.helpers.search import filter_by_text, sort_entries
 
-from document.models import AccessRight
+from document.helpers.access_rights import check_access_rights, \
+    get_access_rights
+from user.models import LibraryVersion
+from user.util import get_library_blobs, library_json
 
 
 class SimpleSerializer(Serializer):
@@ -32,19 +46,113 @@ def index(request):
     return render(request, 'bibliography/index.html', response)
 
 
-def check_access_rights(other_user_id, this_user):
-    other_user_id = int(other_user_id)
-    has_access = False
-    if other_user_id == 0:
-        has_access = True
-    elif other_user_id == this_user.id:
-        has_access = True
-    elif AccessRight.objects.filter(
-        document__owner=other_user_id,
-        user=this_user
-    ).count() > 0:
-        has_access = True
-    return has_access
+BIBLIST_FIELDS = (
+    'entry_key',
+    'entry_owner',
+    'bib_type',
+    'entry_cat',
+    'fields'
+)
+
+
+def get_biblist(request):
+    """
+    Checks access to the bibliographies requested with owner_id and returns
+    the status, the response without the entries and the entries queryset,
+    which is None if the entries do not need to be sent.
+
+    For a single owner, the response includes seq, the sequence number of the
+    latest change. If the request includes the seq of an earlier response,
+    only the entries that have been saved since are returned, and the ids of
+    the entries that have been deleted since are listed in deleted.
+    """
+    response = {}
+    status = 403
+    entries = None
+    user_id = request.POST['owner_id']
+    if len(user_id.split(',')) > 1:
+        user_ids = user_id.split(',')
+        if check_access_rights(user_ids, request):
+            status = 200
+            entries = Entry.objects.filter(entry_owner__in=user_ids)
+            response['bibCategories'] = serializer.serialize(
+                EntryCategory.objects.filter(category_owner__in=user_ids))
+    else:
+        if check_access_rights([user_id], request):
+            if int(user_id) == 0:
+                user_id = request.user.id
+            # The sequence number of the latest change to the entries. Clients
+            # that send it along later on only receive the changes since.
+            seq = EntryChange.objects.filter(owner_id=user_id).aggregate(
+                Max('id'))['id__max'] or 0
+            response['seq'] = seq
+            if 'seq' in request.POST:
+                changes = EntryChange.objects.filter(
+                    owner_id=user_id,
+                    id__gt=int(request.POST['seq']),
+                    id__lte=seq
+                )
+                response['deleted'] = list(changes.filter(
+                    deleted=True).values_list('entry_id', flat=True))
+                entries = Entry.objects.filter(
+                    entry_owner=user_id,
+                    id__in=changes.filter(deleted=False).values('entry_id')
+                )
+            elif user_id == request.user.id and request.POST.__contains__(
+                    'last_modified'):
+                last_modified_onclient = int(request.POST['last_modified'])
+                number_of_entries_onclient = int(
+                    request.POST['number_of_entries'])
+                aggregation_values = Entry.objects.filter(
+                    entry_owner=user_id).aggregate(
+                    Max('last_modified'), Count('id'))
+                last_modified__max = aggregation_values[
+                    'last_modified__max']
+                number_of_entries_onserver = aggregation_values[
+                    'id__count']
+                if last_modified__max:
+                    last_modified_onserver = int(
+                        time.mktime(last_modified__max.timetuple()))
+                else:
+                    last_modified_onserver = 0
+                if (
+                    last_modified_onclient < last_modified_onserver or
+                    number_of_entries_onclient > number_of_entries_onserver
+                ):
+                    entries = Entry.objects.filter(entry_owner=user_id)
+                    response['last_modified'] = last_modified_onserver
+                    response[
+                        'number_of_entries'] = number_of_entries_onserver
+            else:
+                entries = Entry.objects.filter(entry_owner=user_id)
+            response['bibCategories'] = serializer.serialize(
+                EntryCategory.objects.filter(category_owner=user_id))
+            status = 200
+    return status, response, entries
+
+
+def serialize_biblist(owner_id):
+    return (
+        u','.join(json.dumps(category) for category in serializer.serialize(
+            EntryCategory.objects.filter(category_owner=owner_id))),
+        u','.join(json.dumps(entry) for entry in Entry.objects.filter(
+            entry_owner=owner_id).values('id', *BIBLIST_FIELDS).iterator())
+    )
+
+
+# returns the bibliography items of several users from the cache
+def cached_biblists(request, owner_ids):
+    if not check_access_rights(owner_ids, request):
+        return JsonResponse({}, status=403)
+    owner_ids = list(OrderedDict.fromkeys(
+        int(owner_id) for owner_id in owner_ids))
+    return HttpResponse(
+        library_json(
+            get_library_blobs('bibliography', owner_ids, serialize_biblist),
+            ['bibCategories', 'bibList']
+        ),
+        content_type='application/json'
+    )
 
 
 # returns list of bibliography items
@@ -53,79 +161,92 @@ def biblist_js(request):
     response = {}
     status = 403
     if request.is_ajax() and request.method == 'POST':
-        user_id = request.POST['owner_id']
-        if len(user_id.split(',')) > 1:
-            user_ids = user_id.split(',')
-            status = 200
-            for user_id in user_ids:
-                if check_access_rights(user_id, request.user) is False:
-                    status = 403
-            if status == 200:
+        owner_ids = request.POST['owner_id'].split(',')
+        if len(owner_ids) > 1:
+            return cached_biblists(request, owner_ids)
+        status, response, entries = get_biblist(request)
+        if entries is not None:
+            response['bibList'] = serializer.serialize(
+                entries, fields=BIBLIST_FIELDS)
+    return JsonResponse(
+        response,
+        status=status
+    )
+
+
+def stream_biblist(response, entries):
+    yield json.dumps(response) + '\n'
+    if entries is None:
+        return
+    for entry in entries.values('id', *BIBLIST_FIELDS).iterator():
+        yield json.dumps(entry) + '\n'
+
+
+# returns list of bibliography items as newline delimited JSON: The first line
+# holds the same data as a response of biblist_js without bibList and with
+# bibList set to true if the entries follow, one per line.
+@login_required
+def biblist_stream_js(request):
+    if not (request.is_ajax() and request.method == 'POST'):
+        return JsonResponse({}, status=403)
+    status, response, entries = get_biblist(request)
+    if status != 200:
+        return JsonResponse(response, status=status)
+    response['bibList'] = entries is not None
+    return StreamingHttpResponse(
+        stream_biblist(response, entries),
+        content_type='application/x-ndjson'
+    )
+
+
+# Number of entries returned per page by search_js by default and at most.
+SEARCH_PAGE_SIZE = 50
+SEARCH_MAX_PAGE_SIZE = 500
+
+
+# returns a page of the bibliography items of owner_id that contain all words
+# of q, belong to the category with the id category, sorted by sort (author,
+# title, year or doi, prefixed with - for descending order).
+@login_required
+def search_js(request):
+    response = {}
+    status = 405
+    if request.is_ajax() and request.method == 'POST':
+        user_id = request.POST.get('owner_id', '0')
+        category = request.POST.get('category')
+        try:
+            user_id = int(user_id)
+            if category:
+                category = int(category)
+            page_size = int(request.POST.get('page_size', SEARCH_PAGE_SIZE))
+            page = int(request.POST.get('page', 1))
+            if page_size < 1 or page < 1:
+                raise ValueError
+        except ValueError:
+            return JsonResponse({}, status=400)
+        status = 403
+        if check_access_rights([user_id], request):
+            if user_id == 0:
+                user_id = request.user.id
+            entries = Entry.objects.filter(entry_owner=user_id)
+            entries = filter_by_text(entries, request.POST.get('q', ''))
+            if category:
+                entries = entries.filter(categories__id=category)
+            entries = sort_entries(entries, request.POST.get('sort'))
+            paginator = Paginator(
+                entries,
+                min(page_size, SEARCH_MAX_PAGE_SIZE)
+            )
+            response['total'] = paginator.count
+            try:
                 response['bibList'] = serializer.serialize(
-                    Entry.objects.filter(
-                        entry_owner__in=user_ids), fields=(
-                            'entry_key',
-                            'entry_owner',
-                            'bib_type',
-                            'entry_cat',
-                            'fields'
-                        )
-                    )
-                response['bibCategories'] = serializer.serialize(
-                    EntryCategory.objects.filter(category_owner__in=user_ids))
-        else:
-            if check_access_rights(user_id, request.user):
-                if int(user_id) == 0:
-                    user_id = request.user.id
-                if user_id == request.user.id and request.POST.__contains__(
-                        'last_modified'):
-                    last_modified_onclient = int(request.POST['last_modified'])
-                    number_of_entries_onclient = int(
-                        request.POST['number_of_entries'])
-                    aggregation_values = Entry.objects.filter(
-                        entry_owner=user_id).aggregate(
-                        Max('last_modified'), Count('id'))
-                    last_modified__max = aggregation_values[
-                        'last_modified__max']
-                    number_of_entries_onserver = aggregation_values[
-                        'id__count']
-                    if last_modified__max:
-                        last_modified_onserver = int(
-                            time.mktime(last_modified__max.timetuple()))
-                    else:
-                        last_modified_onserver = 0
-                    if (
-                        last_modified_onclient < last_modified_onserver or
-                        number_of_entries_onclient > number_of_entries_onserver
-                    ):
-                        response['bibList'] = serializer.serialize(
-                            Entry.objects.filter(
-                                entry_owner=user_id), fields=(
-                                    'entry_key',
-                                    'entry_owner',
-                                    'bib_type',
-                                    'entry_cat',
-                                    'fields'
-                                )
-                            )
-                        response['last_modified'] = last_modified_onserver
-                        response[
-                            'number_of_entries'] = number_of_entries_onserver
-                else:
-                    response['bibList'] = serializer.serialize(
-                        Entry.objects.filter(
-                            entry_owner=user_id
-                        ), fields=(
-                            'entry_key',
-                            'entry_owner',
-                            'bib_type',
-                            'entry_cat',
-                            'fields'
-                        )
-                    )
-                response['bibCategories'] = serializer.serialize(
-                    EntryCategory.objects.filter(category_owner=user_id))
-                status = 200
+                    paginator.page(page).object_list,
+                    fields=BIBLIST_FIELDS
+                )
+            except EmptyPage:
+                # Pages after the last one are empty.
+                response['bibList'] = []
+            status = 200
     return JsonResponse(
         response,
         status=status
@@ -146,35 +267,23 @@ def save_js(request):
             # If the user has write access to at least one document of another
             # user, we allow him to add new and edit bibliography entries of
             # this user.
-            if len(AccessRight.objects.filter(
-                    document__owner=requested_owner_id,
-                    user=request.user.id, rights='w')) > 0:
+            if get_access_rights(request.user, request).can_write_owner(
+                    requested_owner_id):
                 owner_id = requested_owner_id
-        response['id_translations'] = []
-        for b_id in bibs.keys():
-            bib = bibs[b_id]
-            if request.POST['is_new'] == 'true':
-                inserting_obj = {
-                    'entry_owner_id': owner_id,
-                    'entry_key': bib['entry_key'],
-                    'bib_type': bib['bib_type'],
-                    'entry_cat': bib['entry_cat'],
-                    'fields': bib['fields']
-                }
-                similar = Entry.objects.filter(**inserting_obj)
-                if len(similar) == 0:
-                    the_entry = Entry(**inserting_obj)
-                    the_entry.save()
-                    response['id_translations'].append([b_id, the_entry.id])
-                else:
-                    response['id_translations'].append([b_id, similar[0].id])
-            else:
+        if request.POST['is_new'] == 'true':
+            response['id_translations'] = import_entries(
+                owner_id, list(bibs.items()))
+        else:
+            response['id_translations'] = []
+            for b_id in bibs.keys():
+                bib = bibs[b_id]
                 the_entry = Entry.objects.get(id=b_id)
                 the_entry.entry_key = bib['entry_key']
                 the_entry.bib_type = bib['bib_type']
                 the_entry.entry_cat = bib['entry_cat']
                 the_entry.fields = bib['fields']
                 the_entry.save()
+                EntryChange.record(the_entry.entry_owner_id, [the_entry.id])
                 response['id_translations'].append([b_id, the_entry.id])
     return JsonResponse(
         response,
@@ -182,6 +291,69 @@ def save_js(request):
     )
 
 
+# import a BibTeX file in the background
+@login_required
+def import_bibtex_js(request):
+    response = {}
+    status = 405
+    if request.is_ajax() and request.method == 'POST':
+        bib_file = request.FILES['file']
+        if bib_file.size > settings.BIBTEX_IMPORT_MAX_SIZE:
+            status = 413
+        else:
+            # Old jobs are only kept for a day.
+            fail_stale_jobs(request.user)
+            BibImportJob.objects.filter(
+                owner=request.user,
+                status__in=['done', 'failed'],
+                updated__lt=timezone.now() - timedelta(days=1)
+            ).delete()
+            job = BibImportJob.objects.create(owner=request.user)
+            start_import(job, bib_file.read().decode('utf-8', 'replace'))
+            response['job_id'] = job.id
+            status = 201
+    return JsonResponse(
+        response,
+        status=status
+    )
+
+
+# returns the progress of a BibTeX import and the imported entries once it is
+# done
+@login_required
+def import_status_js(request):
+    response = {}
+    status = 405
+    if request.is_ajax() and request.method == 'POST':
+        fail_stale_jobs(request.user)
+        job = BibImportJob.objects.filter(
+            id=int(request.POST['job_id']),
+            owner=request.user
+        ).first()
+        if job is None:
+            status = 404
+        else:
+            status = 200
+            response['status'] = job.status
+            response['total'] = job.total
+            response['processed'] = job.processed
+            if job.status == 'done':
+                response['errors'] = json.loads(job.errors)
+                response['warnings'] = json.loads(job.warnings)
+                entry_ids = json.loads(job.entry_ids)
+                response['bibList'] = []
+                for index in range(0, len(entry_ids), 500):
+                    response['bibList'] += serializer.serialize(
+                        Entry.objects.filter(
+                            id__in=entry_ids[index:index + 500]),
+                        fields=BIBLIST_FIELDS
+                    )
+    return JsonResponse(
+        response,
+        status=status
+    )
+
+
 # delete an entry
 @login_required
 def delete_js(request):
@@ -192,10 +364,13 @@ def delete_js(request):
         ids = request.POST.getlist('ids[]')
         id_chunks = [ids[x:x + 100] for x in range(0, len(ids), 100)]
         for id_chunk in id_chunks:
-            Entry.objects.filter(
+            entries = Entry.objects.filter(
                 pk__in=id_chunk,
                 entry_owner=request.user
-            ).delete()
+            )
+            deleted_ids = list(entries.values_list('id', flat=True))
+            entries.delete()
+            EntryChange.record(request.user.id, deleted_ids, deleted=True)
     return JsonResponse(
         response,
         status=status
@@ -227,6 +402,7 @@ def save_category_js(request):
                 the_cat = EntryCategory.objects.get(pk=the_id)
                 the_cat.category_title = the_title
             the_cat.save()
+            LibraryVersion.bump(the_cat.category_owner_id, 'bibliography')
             response['entries'].append(
                 {'id': the_cat.id, 'category_title': the_cat.category_title}
             )
@@ -246,7 +422,9 @@ def delete_category_js(request):
     if request.is_ajax() and request.method == 'POST':
         ids = request.POST.getlist('ids[]')
         for id in ids:
-            EntryCategory.objects.get(pk=int(id)).delete()
+            the_cat = EntryCategory.objects.get(pk=int(id))
+            the_cat.delete()
+            LibraryVersion.bump(the_cat.category_owner_id, 'bibliography')
         status = 201
 
     return JsonResponse(
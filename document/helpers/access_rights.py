@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from document.models import AccessRight
+
+
+class UserAccessRights(object):
+    """
+    The access rights a user has been given to the documents of other users,
+    loaded with a single query. A user may read the bibliography and images of
+    everyone who has shared a document with them.
+    """
+
+    def __init__(self, user_id, rows):
+        self.user_id = user_id
+        self.document_rights = dict()
+        self.owner_ids = set()
+        self.write_owner_ids = set()
+        for document_id, owner_id, rights in rows:
+            self.document_rights[document_id] = rights
+            self.owner_ids.add(owner_id)
+            if rights == 'write':
+                self.write_owner_ids.add(owner_id)
+
+    def can_read_owner(self, owner_id):
+        owner_id = int(owner_id)
+        # 0 stands for the user.
+        return (
+            owner_id == 0 or
+            owner_id == self.user_id or
+            owner_id in self.owner_ids
+        )
+
+    def can_read_owners(self, owner_ids):
+        return all(self.can_read_owner(owner_id) for owner_id in owner_ids)
+
+    def can_write_owner(self, owner_id):
+        # Write access to a document of another user allows to add and edit
+        # bibliography entries of that user.
+        return int(owner_id) in self.write_owner_ids
+
+    def get_document_rights(self, document):
+        """
+        Returns 'write' for the owner of the document, the rights given to the
+        user otherwise and None if the user has no access.
+        """
+        if document.owner_id == self.user_id:
+            return 'write'
+        return self.document_rights.get(document.id)
+
+
+def cache_key(user_id):
+    return 'access_rights:%d' % user_id
+
+
+def get_access_rights(user, request=None):
+    """
+    Returns the UserAccessRights of user. They are memoized on the request if
+    one is given and cached for settings.ACCESS_RIGHTS_CACHE_TIMEOUT seconds.
+    """
+    if request is not None and hasattr(request, '_user_access_rights'):
+        return request._user_access_rights
+    rows = None
+    if settings.ACCESS_RIGHTS_CACHE_TIMEOUT:
+        rows = cache.get(cache_key(user.id))
+    if rows is None:
+        rows = list(AccessRight.objects.filter(user_id=user.id).values_list(
+            'document_id',
+            'document__owner_id',
+            'rights'
+        ))
+        if settings.ACCESS_RIGHTS_CACHE_TIMEOUT:
+            cache.set(
+                cache_key(user.id),
+                rows,
+                settings.ACCESS_RIGHTS_CACHE_TIMEOUT
+            )
+    access_rights = UserAccessRights(user.id, rows)
+    if request is not None:
+        request._user_access_rights = access_rights
+    return access_rights
+
+
+def check_access_rights(owner_ids, request):
+    """
+    Whether the user of the request may read the bibliographies and images of
+    all owner_ids.
+    """
+    if all(int(owner_id) in (0, request.user.id) for owner_id in owner_ids):
+        # Users can always read their own libraries.
+        return True
+    return get_access_rights(request.user, request).can_read_owners(owner_ids)
+
+
+@receiver(post_save, sender=AccessRight)
+@receiver(post_delete, sender=AccessRight)
+def forget_access_rights(sender, instance, **kwargs):
+    if settings.ACCESS_RIGHTS_CACHE_TIMEOUT:
+        cache.delete(cache_key(instance.user_id))
@@ -0,0 +1,134 @@
+import sys
+import json
+from collections import deque
+from itertools import islice
+
+from django.conf import settings
+
+from document.models import DocumentStep
+
+
+def deep_getsizeof(obj):
+    """
+    Approximate number of bytes used by a decoded JSON structure.
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_getsizeof(key) + deep_getsizeof(value)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            size += deep_getsizeof(item)
+    return size
+
+
+class DiffLog(object):
+    """
+    The last diffs that were accepted for a document, addressed by the
+    absolute diff version they lead to.
+
+    All diffs that have been accepted since the last full save of the
+    document (base_version) are kept. Of the diffs before that, only the last
+    `capacity` ones are kept so that clients that reconnect after a short
+    while can still catch up without reloading the document.
+    """
+
+    def __init__(self, diffs=None, version=0, base_version=0, capacity=None):
+        if capacity is None:
+            capacity = settings.DOC_DIFF_LOG_CAPACITY
+        self.capacity = capacity
+        self.diffs = deque()
+        self.sizes = deque()
+        self.nbytes = 0
+        # The diff version reached after applying the newest diff.
+        self.version = version - len(diffs or [])
+        self.base_version = base_version
+        self.extend(diffs or [])
+
+    @classmethod
+    def load(cls, document, capacity=None):
+        """
+        Restores the diff log of a document from its stored steps. Only the
+        steps needed to restore the document plus `capacity` older ones are
+        fetched.
+        """
+        if capacity is None:
+            capacity = settings.DOC_DIFF_LOG_CAPACITY
+        steps = DocumentStep.objects.filter(
+            document_id=document.id,
+            diff_version__gt=document.version - capacity,
+            diff_version__lte=document.diff_version
+        ).order_by('-diff_version').values_list('diff_version', 'step')
+        diffs = []
+        expected_version = document.diff_version
+        for diff_version, step in steps:
+            if diff_version != expected_version:
+                # There is a gap, so older steps are useless.
+                break
+            diffs.append(json.loads(step))
+            expected_version -= 1
+        diffs.reverse()
+        return cls(diffs, document.diff_version, document.version, capacity)
+
+    def __len__(self):
+        return len(self.diffs)
+
+    @property
+    def first_version(self):
+        # The diff version before the oldest diff that is still available.
+        return self.version - len(self.diffs)
+
+    def extend(self, diffs):
+        for diff in diffs:
+            size = deep_getsizeof(diff)
+            self.diffs.append(diff)
+            self.sizes.append(size)
+            self.nbytes += size
+        self.version += len(diffs)
+        self.enforce_capacity()
+
+    def since(self, version):
+        """
+        Returns the diffs needed to get from version to the current version or
+        None if some of them are no longer available. Only the returned diffs
+        are copied.
+        """
+        count = self.version - version
+        if count < 0 or count > len(self.diffs):
+            return None
+        diffs = list(islice(reversed(self.diffs), count))
+        diffs.reverse()
+        return diffs
+
+    def set_base_version(self, base_version):
+        """
+        The document has been saved in full at base_version, so the diffs up
+        to it are only kept as history.
+        """
+        self.base_version = base_version
+        self.enforce_capacity()
+
+    def enforce_capacity(self, capacity=None):
+        if capacity is None:
+            capacity = self.capacity
+        keep = max(self.version - self.base_version, 0) + capacity
+        while len(self.diffs) > keep:
+            self.diffs.popleft()
+            self.nbytes -= self.sizes.popleft()
+
+    def reset(self, version):
+        self.diffs.clear()
+        self.sizes.clear()
+        self.nbytes = 0
+        self.version = version
+        self.base_version = version
+
+    def to_list(self):
+        return list(self.diffs)
+
+    def memory_footprint(self):
+        return (
+            self.nbytes +
+            sys.getsizeof(self.diffs) +
+            sys.getsizeof(self.sizes)
+        )
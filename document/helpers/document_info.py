@@ -0,0 +1,185 @@
+from avatar.models import Avatar
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from document.models import AccessRight, Document, Submission
+from user.models import TeamMember
+from user.util import get_user_avatar_urls
+from ws.brokers import get_broker
+from ws.executor import run_in_db_thread
+
+
+class DocumentInfoCache(object):
+    """
+    The information about the owner, the owner's team, the access rights and
+    the submission status that is sent along with an open document.
+
+    It is built with a fixed number of queries the first time a document is
+    sent and then reused until the access rights or team members of the owner
+    change, or until one of the users it names changes their name or avatar,
+    so participants reconnecting to a popular document do not cost
+    any further queries. Invalidations are passed on to the other server
+    processes through the broker.
+
+    The queries run in a database thread. A burst of participants connecting
+    to the same document waits for the same build.
+    """
+
+    channel = 'document_info.invalidate'
+
+    def __init__(self):
+        self.entries = dict()
+        # The owner id and the future of running builds by document id.
+        self.building = dict()
+        self.broker = None
+
+    def get(self, document):
+        """
+        Returns a future that resolves to the information about document.
+        """
+        if document.id in self.entries:
+            future = Future()
+            future.set_result(self.entries[document.id])
+            return future
+        if document.id not in self.building:
+            if self.broker is None:
+                self.broker = get_broker()
+                self.broker.subscribe(self.channel, self.receive)
+            future = run_in_db_thread(self.build, document)
+            self.building[document.id] = (document.owner_id, future)
+            IOLoop.current().add_future(
+                future,
+                lambda future: self.built(document.id, future)
+            )
+        return self.building[document.id][1]
+
+    def built(self, document_id, future):
+        if self.building.get(document_id, (None, None))[1] is not future:
+            # The information has been invalidated while it was built.
+            return
+        del self.building[document_id]
+        if future.exception() is None:
+            self.entries[document_id] = future.result()
+
+    def build(self, document):
+        owner = User.objects.get(id=document.owner_id)
+        access_rights = list(AccessRight.objects.filter(
+            document__owner_id=owner.id
+        ).select_related('user'))
+        team_members = list(TeamMember.objects.filter(
+            leader_id=owner.id
+        ).select_related('member'))
+        users = [owner] + [ar.user for ar in access_rights] + [
+            team_member.member for team_member in team_members
+        ]
+        avatars = get_user_avatar_urls(users)
+        info = {
+            'owner_id': owner.id,
+            'avatars': avatars,
+            'access_rights': [{
+                'document_id': ar.document_id,
+                'user_id': ar.user.id,
+                'user_name': ar.user.readable_name,
+                'rights': ar.rights,
+                'avatar': avatars[ar.user.id]
+            } for ar in access_rights],
+            'owner': {
+                'id': owner.id,
+                'name': owner.readable_name,
+                'avatar': avatars[owner.id],
+                'team_members': [{
+                    'id': team_member.member.id,
+                    'name': team_member.member.readable_name,
+                    'avatar': avatars[team_member.member.id]
+                } for team_member in team_members]
+            },
+            'submission': {
+                'status': 'unsubmitted'
+            }
+        }
+        submission = Submission.objects.filter(
+            document_id=document.id
+        ).first()
+        if submission is not None and submission.version_id != 0:
+            info['submission'] = {
+                'status': 'submitted',
+                'submission_id': submission.submission_id,
+                'user_id': submission.user_id,
+                'version_id': submission.version_id,
+                'journal_id': submission.journal_id
+            }
+        return info
+
+    def discard(self, document_id):
+        self.entries.pop(document_id, None)
+        self.building.pop(document_id, None)
+
+    def invalidate_owner(self, owner_id):
+        """
+        The access rights or team members of a user have changed. This is
+        called from Django views, which may run in other threads, so the cache
+        is only changed on the IOLoop.
+        """
+        IOLoop.current().add_callback(
+            self.publish_invalidation,
+            {'owner_id': owner_id}
+        )
+
+    def invalidate_user(self, user_id):
+        """
+        The name or avatar of a user has changed, which may be part of the
+        information about the documents of any owner.
+        """
+        IOLoop.current().add_callback(
+            self.publish_invalidation,
+            {'user_id': user_id}
+        )
+
+    def publish_invalidation(self, message):
+        self.receive(message)
+        if self.broker is None:
+            self.broker = get_broker()
+        self.broker.publish(self.channel, message)
+
+    def invalidate_document(self, document_id):
+        owner_ids = Document.objects.light().filter(
+            id=document_id
+        ).values_list('owner_id', flat=True)
+        for owner_id in owner_ids:
+            self.invalidate_owner(owner_id)
+
+    def receive(self, message):
+        if 'user_id' in message:
+            # All users of an entry have an avatar url.
+            for document_id, info in list(self.entries.items()):
+                if message['user_id'] in info['avatars']:
+                    del self.entries[document_id]
+            # It is not known yet which users running builds will name.
+            self.building.clear()
+            return
+        for document_id, info in list(self.entries.items()):
+            if info['owner_id'] == message['owner_id']:
+                del self.entries[document_id]
+        for document_id, (owner_id, future) in list(self.building.items()):
+            if owner_id == message['owner_id']:
+                del self.building[document_id]
+
+
+document_info_cache = DocumentInfoCache()
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    # Logging in only updates the time of the last login.
+    if created or update_fields == frozenset(['last_login']):
+        return
+    document_info_cache.invalidate_user(instance.id)
+
+
+@receiver(post_save, sender=Avatar)
+@receiver(post_delete, sender=Avatar)
+def avatar_changed(sender, instance, **kwargs):
+    document_info_cache.invalidate_user(instance.user_id)
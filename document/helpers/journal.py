@@ -0,0 +1,168 @@
+import os
+import re
+from logging import warning
+
+from django.conf import settings
+from tornado.escape import json_decode, json_encode
+
+JOURNAL_FILE_NAME = re.compile(r'^(\d+)-(\d+)-(\d+)\.journal$')
+
+
+class SessionJournal(object):
+    """
+    Append-only files of the changes to open documents that were accepted but
+    have not been saved yet, so that they survive a crash of the server
+    process.
+
+    Every server process (worker) writes its own files, named
+    <document id>-<worker>-<segment>.journal. When a snapshot of a document is
+    taken, the current segment is closed with checkpoint and further changes
+    go to the next segment. Once the snapshot has been written, the segments
+    up to it are deleted with remove. Files are never rewritten. Whatever is
+    left when a worker starts is replayed (see DocumentWS.replay_journal).
+    """
+
+    def __init__(self, directory=None, sync=None, worker=0):
+        if directory is None:
+            directory = settings.DOC_JOURNAL_DIR
+        if sync is None:
+            sync = settings.DOC_JOURNAL_SYNC
+        self.directory = directory
+        self.sync = sync
+        self.worker = worker
+        # The open file and the number of the current segment by document id.
+        self.files = dict()
+        self.segments = dict()
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def path(self, document_id, segment, worker=None):
+        if worker is None:
+            worker = self.worker
+        return os.path.join(
+            self.directory,
+            '%d-%d-%d.journal' % (document_id, worker, segment)
+        )
+
+    def list_files(self):
+        """
+        Returns (document_id, worker, segment) of all journal files.
+        """
+        if not self.enabled or not os.path.isdir(self.directory):
+            return []
+        files = []
+        for name in os.listdir(self.directory):
+            match = JOURNAL_FILE_NAME.match(name)
+            if match:
+                files.append(tuple(int(part) for part in match.groups()))
+        return sorted(files)
+
+    def file_segments(self, document_id, worker=None):
+        if worker is None:
+            worker = self.worker
+        return [
+            segment for file_document_id, file_worker, segment
+            in self.list_files()
+            if file_document_id == document_id and file_worker == worker
+        ]
+
+    def append(self, document_id, record):
+        if not self.enabled:
+            return
+        if document_id not in self.files:
+            if document_id not in self.segments:
+                # Continue after the files left by an earlier process.
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+                self.segments[document_id] = max(
+                    self.file_segments(document_id) + [-1]
+                ) + 1
+            self.files[document_id] = open(
+                self.path(document_id, self.segments[document_id]),
+                'a'
+            )
+        journal_file = self.files[document_id]
+        journal_file.write(json_encode(record) + '\n')
+        journal_file.flush()
+        if self.sync:
+            os.fsync(journal_file.fileno())
+
+    def checkpoint(self, document_id):
+        """
+        Closes the current segment of a document, as a snapshot is taken.
+        Returns the number of the last closed segment, which the snapshot
+        contains all changes of, or None if nothing has been journaled.
+        """
+        if document_id not in self.segments:
+            return None
+        if document_id not in self.files:
+            return self.segments[document_id] - 1
+        self.files.pop(document_id).close()
+        self.segments[document_id] += 1
+        return self.segments[document_id] - 1
+
+    def remove(self, document_id, segment):
+        """
+        Deletes the segments up to segment, which have been saved. May be run
+        in another thread, as closed segments are not touched otherwise.
+        """
+        for file_segment in self.file_segments(document_id):
+            if file_segment <= segment:
+                os.remove(self.path(document_id, file_segment))
+
+    def close(self, document_id):
+        """
+        Closes the journal of a document whose session has been closed. Its
+        files are kept until they are removed, the next append starts a new
+        segment.
+        """
+        journal_file = self.files.pop(document_id, None)
+        if journal_file is not None:
+            journal_file.close()
+        self.segments.pop(document_id, None)
+
+    def worker_files(self, worker):
+        """
+        Returns the document ids and segments with files of worker by document
+        id.
+        """
+        files = dict()
+        for document_id, file_worker, segment in self.list_files():
+            if file_worker == worker:
+                files.setdefault(document_id, []).append(segment)
+        return files
+
+    def workers(self):
+        return sorted(set(worker for _, worker, _ in self.list_files()))
+
+    def read(self, document_id, worker, segments):
+        records = []
+        for segment in segments:
+            with open(self.path(document_id, segment, worker)) as segment_file:
+                for line in segment_file:
+                    try:
+                        records.append(json_decode(line))
+                    except ValueError:
+                        # The process ended while the last record was
+                        # written.
+                        warning(
+                            'Incomplete record in the journal of document '
+                            '#%d',
+                            document_id
+                        )
+                        break
+        return records
+
+    def discard(self, document_id, worker, segments):
+        for segment in segments:
+            os.remove(self.path(document_id, segment, worker))
+
+    def set_aside(self, document_id, worker, segments):
+        """
+        Keeps journal files that could not be replayed for inspection.
+        """
+        for segment in segments:
+            path = self.path(document_id, segment, worker)
+            os.rename(path, path + '.failed')
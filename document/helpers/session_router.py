@@ -0,0 +1,208 @@
+import random
+from itertools import count
+
+from tornado.ioloop import PeriodicCallback
+
+
+class RemoteParticipant(object):
+    """
+    Stands in for a participant of a document session that is connected to
+    another server process. Messages to it are passed on through the broker.
+    """
+
+    def __init__(self, router, node, document_id, session_id, user_id):
+        self.router = router
+        self.node = node
+        self.document_id = document_id
+        self.id = session_id
+        self.user_id = user_id
+
+    def write_message(self, message):
+        self.router.send_to_node(self.node, {
+            'type': 'message',
+            'document_id': self.document_id,
+            'session_id': self.id,
+            'message': message
+        })
+
+    def send_document(self):
+        self.router.send_to_node(self.node, {
+            'type': 'send_document',
+            'document_id': self.document_id,
+            'session_id': self.id
+        })
+
+
+class SessionRouter(object):
+    """
+    Connects the sessions of a document that are open in several server
+    processes (nodes) through a broker.
+
+    One node owns each open document. Only the owner accepts diffs and
+    document updates, so the order of diff versions is decided in one place.
+    The other nodes keep a mirror of the session that follows the changes
+    broadcast by the owner, forward the changes of their own participants to
+    the owner and deliver broadcast messages to their own participants.
+
+    Ownership is a lease in the broker that the owner renews while the session
+    is open. If the owner disappears, one of the other nodes takes over once
+    the lease has expired.
+
+    The handler receives the messages of other nodes through its classmethods
+    receive_broadcast (sent to all nodes of a document), receive_forwarded
+    (sent to the owner of a document) and receive_direct (sent to this node),
+    and is told about ownership through ownership_changed.
+    """
+
+    def __init__(self, broker, handler, lease_time=30):
+        self.broker = broker
+        self.handler = handler
+        self.lease_time = lease_time
+        # Session ids have to be unique across all nodes. The node number
+        # makes up the upper bits, but the ids stay below 2 ** 53 so that they
+        # can be used as numbers in JavaScript. So the lower bits wrap around
+        # and ids that are still in use are skipped.
+        self.node = random.randint(1, 2 ** 32 - 1)
+        self.session_ids = count()
+        self.session_ids_in_use = set()
+        # document_id -> True (owner), False (mirror) or None (unknown yet)
+        self.documents = dict()
+        self.timer = None
+
+    def new_session_id(self):
+        for _ in range(0x100000):
+            session_id = (self.node << 20) | (next(self.session_ids) & 0xFFFFF)
+            if session_id not in self.session_ids_in_use:
+                self.session_ids_in_use.add(session_id)
+                return session_id
+        raise RuntimeError('All session ids of this node are in use')
+
+    def release_session_id(self, session_id):
+        self.session_ids_in_use.discard(session_id)
+
+    def start(self):
+        if self.timer is None:
+            self.broker.subscribe(
+                self.node_channel(self.node),
+                self.on_direct_message
+            )
+            self.timer = PeriodicCallback(
+                self.renew_claims,
+                self.lease_time * 1000 / 3
+            )
+            self.timer.start()
+
+    def document_channel(self, document_id):
+        return 'document.%d' % document_id
+
+    def owner_channel(self, document_id):
+        return 'document.%d.owner' % document_id
+
+    def node_channel(self, node):
+        return 'node.%d' % node
+
+    def owner_key(self, document_id):
+        return 'document.%d.owner' % document_id
+
+    def is_owner(self, document_id):
+        return self.documents.get(document_id) is True
+
+    def join(self, document_id, callback):
+        """
+        Start receiving the messages of a document and try to become its
+        owner. callback is run with True if this node owns the document.
+        """
+        self.start()
+        self.documents[document_id] = None
+        self.broker.subscribe(
+            self.document_channel(document_id),
+            self.on_document_message
+        )
+        self.broker.subscribe(
+            self.owner_channel(document_id),
+            self.on_owner_message
+        )
+        self.claim(document_id, callback)
+
+    def leave(self, document_id):
+        if document_id not in self.documents:
+            return
+        is_owner = self.documents.pop(document_id)
+        self.broker.unsubscribe(
+            self.document_channel(document_id),
+            self.on_document_message
+        )
+        self.broker.unsubscribe(
+            self.owner_channel(document_id),
+            self.on_owner_message
+        )
+        if is_owner:
+            self.broker.release(self.owner_key(document_id), self.node)
+
+    def claim(self, document_id, callback=None):
+        def claimed(is_owner):
+            if document_id not in self.documents:
+                # The document has been left in the meantime.
+                if is_owner:
+                    self.broker.release(
+                        self.owner_key(document_id), self.node)
+                return
+            was_owner = self.documents[document_id]
+            self.documents[document_id] = is_owner
+            if callback:
+                callback(is_owner)
+            elif was_owner is not None and was_owner != is_owner:
+                self.handler.ownership_changed(document_id, is_owner)
+        self.broker.claim(
+            self.owner_key(document_id),
+            self.node,
+            self.lease_time,
+            claimed
+        )
+
+    def renew_claims(self):
+        # Owners renew their leases, other nodes take over documents whose
+        # owner has disappeared.
+        for document_id in list(self.documents.keys()):
+            if self.documents[document_id] is not None:
+                self.claim(document_id)
+
+    def publish(self, document_id, message):
+        """
+        Send a message to all other nodes that have the document open.
+        """
+        message['node'] = self.node
+        message['document_id'] = document_id
+        self.broker.publish(self.document_channel(document_id), message)
+
+    def forward(self, document_id, message):
+        """
+        Send a message to the owner of the document.
+        """
+        message['node'] = self.node
+        message['document_id'] = document_id
+        self.broker.publish(self.owner_channel(document_id), message)
+
+    def send_to_node(self, node, message):
+        message['node'] = self.node
+        self.broker.publish(self.node_channel(node), message)
+
+    def remote_participant(self, origin, document_id):
+        return RemoteParticipant(
+            self,
+            origin['node'],
+            document_id,
+            origin['session_id'],
+            origin['user_id']
+        )
+
+    def on_document_message(self, message):
+        if message['node'] != self.node:
+            self.handler.receive_broadcast(message)
+
+    def on_owner_message(self, message):
+        if self.is_owner(message['document_id']):
+            self.handler.receive_forwarded(message)
+
+    def on_direct_message(self, message):
+        self.handler.receive_direct(message)
@@ -1,4 +1,5 @@
-from document.models import AccessRight, Document
+from document.models import Document
+from document.helpers.access_rights import get_access_rights
 
 
 class SessionUserInfo():
@@ -32,22 +33,20 @@ class SessionUserInfo():
             document = Document.objects.create(owner_id=self.user.id)
             self.document_id = document.id
         else:
-            document = Document.objects.filter(id=int(document_id))
+            document = Document.objects.light().filter(id=int(document_id))
             if len(document) > 0:
                 document = document[0]
                 self.document_id = document.id
-                if document.owner == self.user:
+                if document.owner_id == self.user.id:
                     self.access_rights = 'write'
                     self.is_owner = True
                     can_access = True
                 else:
                     self.is_owner = False
-                    access_rights = AccessRight.objects.filter(
-                        document=document,
-                        user=self.user
-                    )
-                    if len(access_rights) > 0:
-                        self.access_rights = access_rights[0].rights
+                    rights = get_access_rights(
+                        self.user).get_document_rights(document)
+                    if rights is not None:
+                        self.access_rights = rights
                         can_access = True
 
         return (document, can_access)
@@ -0,0 +1,235 @@
+import time
+from logging import info, error
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from tornado.escape import json_encode
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from document.models import Document, DocumentStep
+
+
+class WriteBehindSaver(object):
+    """
+    Persists open collaborative document sessions in the background.
+
+    Sessions are marked as dirty when they change. Dirty sessions are
+    coalesced and written to the database either every `interval` seconds or
+    as soon as more than `max_dirty_bytes` of changes have accumulated. The
+    JSON encoding and the database writes happen in a single worker thread so
+    that the IOLoop is never blocked by them and writes to the same document
+    are applied in the order they were queued.
+    """
+
+    def __init__(self, sessions, serialize, interval=None,
+                 max_dirty_bytes=None, written=None):
+        # sessions is the dict of open sessions by document id.
+        # serialize(document_id, all_have_left) returns a snapshot of the
+        # session or None if the session is gone. A snapshot is a dict with:
+        # fields: the Document fields to be updated,
+        # json_fields: the Document fields to be updated with the JSON of
+        # the values,
+        # steps: a list of (diff_version, step) to be stored as JSON,
+        # steps_since: the diff_version after which steps are replaced,
+        # keep_from: the diff_version up to which stored steps are removed.
+        # written(document_id, snapshot) is run in the worker thread after a
+        # snapshot has been written.
+        self.sessions = sessions
+        self.serialize = serialize
+        self.written = written
+        if interval is None:
+            interval = settings.DOC_SAVE_INTERVAL
+        if max_dirty_bytes is None:
+            max_dirty_bytes = settings.DOC_SAVE_MAX_DIRTY_BYTES
+        self.interval = interval
+        self.max_dirty_bytes = max_dirty_bytes
+        self.dirty = set()
+        self.dirty_bytes = 0
+        self.flush_scheduled = False
+        self.timer = None
+        self.is_shut_down = False
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.stats = {
+            'flushes': 0,
+            'documents_written': 0,
+            'bytes_written': 0,
+            'errors': 0,
+            'last_flush_documents': 0,
+            'last_flush_bytes': 0,
+            'last_flush_duration': 0.0,
+        }
+
+    def start_timer(self):
+        if self.timer is None:
+            self.timer = PeriodicCallback(self.flush, self.interval * 1000)
+            self.timer.start()
+
+    def mark_dirty(self, document_id, changed_bytes=0):
+        """
+        Queue a document session to be written with the next flush.
+        """
+        self.start_timer()
+        self.dirty.add(document_id)
+        self.dirty_bytes += changed_bytes
+        if (
+            self.dirty_bytes >= self.max_dirty_bytes and
+            not self.flush_scheduled
+        ):
+            self.flush_scheduled = True
+            IOLoop.current().add_callback(self.flush)
+
+    def flush(self):
+        """
+        Take snapshots of all dirty sessions on the IOLoop and hand them to
+        the worker thread for encoding and writing.
+        """
+        self.flush_scheduled = False
+        if len(self.dirty) == 0:
+            return
+        snapshots = []
+        for document_id in self.dirty:
+            fields = self.serialize(document_id, False)
+            if fields is not None:
+                snapshots.append((document_id, fields))
+        self.dirty = set()
+        self.dirty_bytes = 0
+        self.submit(snapshots)
+
+    def write(self, document_id, all_have_left, callback=None):
+        """
+        Write a single session immediately (in the worker thread), for
+        example because the last participant has left. The callback is run on
+        the IOLoop once the document has been written.
+        """
+        self.dirty.discard(document_id)
+        fields = self.serialize(document_id, all_have_left)
+        if fields is None:
+            return
+        self.submit([(document_id, fields)], callback)
+
+    def submit(self, snapshots, callback=None):
+        if len(snapshots) == 0:
+            return
+        io_loop = IOLoop.current()
+        future = self.executor.submit(self.write_snapshots, snapshots)
+
+        def done(future):
+            io_loop.add_callback(self.record_flush, future, callback)
+        future.add_done_callback(done)
+
+    def write_snapshots(self, snapshots):
+        """
+        Runs in the worker thread. Returns the statistics of the flush and the
+        ids of documents that could not be written.
+        """
+        start = time.time()
+        written_bytes = 0
+        written = []
+        failed = []
+        close_old_connections()
+        for document_id, snapshot in snapshots:
+            try:
+                written_bytes += self.write_snapshot(document_id, snapshot)
+                written.append((document_id, snapshot))
+            except Exception:
+                error(
+                    'Error saving document #%d', document_id, exc_info=True)
+                failed.append(document_id)
+                continue
+            if self.written:
+                self.written(document_id, snapshot)
+        close_old_connections()
+        return {
+            'documents': len(written),
+            'bytes': written_bytes,
+            'duration': time.time() - start,
+            'written': written,
+            'failed': failed,
+        }
+
+    def write_snapshot(self, document_id, snapshot):
+        fields = dict(snapshot['fields'])
+        for field_name, value in snapshot.get('json_fields', {}).items():
+            fields[field_name] = json_encode(value)
+        fields['updated'] = timezone.now()
+        steps = [
+            (diff_version, json_encode(step))
+            for diff_version, step in snapshot['steps']
+        ]
+        with transaction.atomic():
+            Document.objects.filter(id=document_id).update(**fields)
+            # Only steps that are new since the last save are written. Steps
+            # that are too old to be kept are removed with a range delete.
+            DocumentStep.objects.filter(document_id=document_id).filter(
+                Q(diff_version__lte=snapshot['keep_from']) |
+                Q(diff_version__gt=snapshot['steps_since'])
+            ).delete()
+            DocumentStep.objects.bulk_create([
+                DocumentStep(
+                    document_id=document_id,
+                    diff_version=diff_version,
+                    step=step
+                ) for diff_version, step in steps
+            ])
+        written_bytes = sum(
+            len(value) for value in fields.values()
+            if hasattr(value, '__len__')
+        )
+        written_bytes += sum(len(step) for _, step in steps)
+        return written_bytes
+
+    def record_flush(self, future, callback=None):
+        result = future.result()
+        self.stats['flushes'] += 1
+        self.stats['documents_written'] += result['documents']
+        self.stats['bytes_written'] += result['bytes']
+        self.stats['errors'] += len(result['failed'])
+        self.stats['last_flush_documents'] = result['documents']
+        self.stats['last_flush_bytes'] = result['bytes']
+        self.stats['last_flush_duration'] = result['duration']
+        info(
+            'saved %d documents (%d bytes) in %.3f seconds',
+            result['documents'],
+            result['bytes'],
+            result['duration']
+        )
+        for document_id, snapshot in result['written']:
+            if document_id in self.sessions:
+                session = self.sessions[document_id]
+                session['saved_diff_version'] = max(
+                    session['saved_diff_version'],
+                    snapshot['fields']['diff_version']
+                )
+        for document_id in result['failed']:
+            # Try again with the next flush.
+            self.mark_dirty(document_id)
+        if callback and len(result['failed']) == 0:
+            callback()
+
+    def shutdown(self):
+        """
+        Write all open sessions synchronously and stop the worker. Called
+        when the server stops. Calling it more than once has no effect.
+        """
+        if self.is_shut_down:
+            return
+        self.is_shut_down = True
+        if self.timer is not None:
+            self.timer.stop()
+        self.executor.shutdown(wait=True)
+        self.dirty = set()
+        snapshots = []
+        for document_id in list(self.sessions.keys()):
+            fields = self.serialize(document_id, True)
+            if fields is not None:
+                snapshots.append((document_id, fields))
+        result = self.write_snapshots(snapshots)
+        info(
+            'saved %d documents (%d bytes) on shutdown',
+            result['documents'],
+            result['bytes']
+        )
@@ -0,0 +1,99 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from tornado.escape import json_encode
+
+from document.models import Document, AccessRight
+from document.management.commands.benchmark_ws_transport import \
+    mock_contents
+
+
+class Rollback(Exception):
+    pass
+
+
+def fetched_bytes(queryset):
+    # Runs the query of the queryset and adds up the size of the values
+    # returned by the database.
+    sql, params = queryset.query.sql_with_params()
+    total = 0
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for row in cursor.fetchall():
+            for value in row:
+                if value is not None:
+                    total += len(u'%s' % value)
+    return total
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the bytes fetched from the database to list documents and '
+        'to check access to them with all fields and with light().'
+        ' The documents are created for the benchmark and removed afterward.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--documents',
+            type=int,
+            default=50,
+            help='Number of documents of the user.'
+        )
+        parser.add_argument(
+            '--paragraphs',
+            type=int,
+            default=100,
+            help='Number of paragraphs per document.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['documents'], options['paragraphs'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, document_count, paragraphs):
+        owner = User.objects.create(username='benchmark_owner')
+        user = User.objects.create(username='benchmark_user')
+        contents = json_encode(mock_contents(paragraphs))
+        for index in range(document_count):
+            document = Document.objects.create(
+                title='Benchmark %d' % index,
+                owner=owner,
+                contents=contents
+            )
+            AccessRight.objects.create(
+                document=document,
+                user=user,
+                rights='write'
+            )
+
+        def document_list(queryset):
+            return queryset.filter(
+                Q(owner=user) | Q(accessright__user=user)
+            ).select_related('owner').distinct().order_by('-updated', '-id')
+
+        def access(queryset):
+            return queryset.filter(id=document.id)
+
+        def access_right_save(queryset):
+            return queryset.filter(pk=document.id, owner=owner)
+
+        operations = [
+            ('document list', document_list),
+            ('open document', access),
+            ('save access rights', access_right_save),
+        ]
+        self.stdout.write(
+            '%-20s %14s %14s' % ('operation', 'all fields', 'light()')
+        )
+        for operation_name, operation in operations:
+            self.stdout.write('%-20s %14d %14d' % (
+                operation_name,
+                fetched_bytes(operation(Document.objects.all())),
+                fetched_bytes(operation(Document.objects.light()))
+            ))
@@ -0,0 +1,179 @@
+import json
+import zlib
+from timeit import default_timer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from tornado.escape import json_encode, utf8
+
+from document.ws_views import DocumentWS
+from test.mock.document_contents import Contents, Paragraph, Text, \
+    BoldText, ItalicText, Footnote, Citation, Link
+
+
+# Number of paragraphs of the benchmarked documents.
+DOCUMENT_SIZES = [
+    ('small', 10),
+    ('medium', 100),
+    ('large', 1000),
+]
+
+
+def mock_contents(paragraphs):
+    return json.loads(str(Contents(*[
+        Paragraph(
+            Text('Lorem ipsum dolor sit amet, paragraph %d.' % index),
+            BoldText('Nemo enim ipsam voluptatem quia voluptas,'),
+            Footnote('sed quia consequuntur magni dolores.'),
+            ItalicText('Neque porro quisquam est, qui dolorem ipsum.'),
+            Citation(index, '', str(index)),
+            Link(text='about', address='/about/', title='About'),
+        ) for index in range(paragraphs)
+    ])))
+
+
+def mock_doc_data(paragraphs):
+    comments = dict()
+    for index in range(paragraphs // 10):
+        comments[str(index)] = {
+            'id': index,
+            'user': 1,
+            'userName': 'Reviewer',
+            'userAvatar': '/static/img/default_avatar.png',
+            'date': 1483228800000,
+            'comment': 'Please clarify paragraph %d.' % (index * 10),
+            'answers': [],
+            'review:isMajor': False
+        }
+    return {
+        'type': 'doc_data',
+        'doc': {
+            'id': 1,
+            'version': 0,
+            'title': 'Benchmark',
+            'contents': mock_contents(paragraphs),
+            'metadata': {},
+            'settings': {'papersize': 'A4', 'citationstyle': 'apa'},
+            'comments': comments,
+            'comment_version': 0,
+            'access_rights': [],
+        },
+        'doc_info': {
+            'is_owner': True,
+            'rights': 'write',
+            'unapplied_diffs': [],
+            'session_id': 1,
+        }
+    }
+
+
+def mock_diff(position):
+    return {
+        'type': 'diff',
+        'diff_version': position,
+        'diff': [{
+            'stepType': 'replace',
+            'from': position + index,
+            'to': position + index,
+            'slice': {'content': [{'type': 'text', 'text': 'typing '}]}
+        } for index in range(5)],
+        'comments': [],
+        'comment_version': 0,
+        'request_id': position,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the bytes sent and the time spent per message on the '
+        'document websocket with text frames, permessage-deflate and the '
+        'binary envelope'
+    )
+
+    def add_arguments(self, parser):
+        compression = settings.WS_COMPRESSION or dict()
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=20,
+            help='How often each message is encoded.'
+        )
+        parser.add_argument(
+            '--compression-level',
+            type=int,
+            default=compression.get('compression_level', 6),
+            help='Compression level used for permessage-deflate.'
+        )
+        parser.add_argument(
+            '--mem-level',
+            type=int,
+            default=compression.get('mem_level', 8),
+            help='Memory level used for permessage-deflate.'
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+
+        def text(message):
+            return utf8(json_encode(message))
+
+        def compressor():
+            return zlib.compressobj(
+                options['compression_level'],
+                zlib.DEFLATED,
+                -zlib.MAX_WBITS,
+                options['mem_level']
+            )
+
+        def deflate(persistent):
+            # Like permessage-deflate, one compressor is kept per connection.
+            # A document is only sent once per connection, so documents are
+            # compressed without the context of earlier messages.
+            connection_compressor = compressor()
+
+            def encode(message):
+                message_compressor = connection_compressor
+                if not persistent:
+                    message_compressor = compressor()
+                data = message_compressor.compress(text(message))
+                data += message_compressor.flush(zlib.Z_SYNC_FLUSH)
+                return data[:-4]
+            return encode
+
+        def binary(message):
+            return DocumentWS.encode_message(message, True)[0]
+
+        self.stdout.write(
+            '%-8s %-9s %-19s %12s %14s' %
+            ('size', 'message', 'transport', 'bytes/msg', 'ms/msg')
+        )
+        for size_name, paragraphs in DOCUMENT_SIZES:
+            messages = [
+                ('doc_data', [mock_doc_data(paragraphs)] * iterations, False),
+                (
+                    'diff',
+                    [mock_diff(index) for index in range(iterations)],
+                    True
+                ),
+            ]
+            for message_name, message_list, persistent in messages:
+                transports = [
+                    ('text', text),
+                    ('permessage-deflate', deflate(persistent)),
+                    ('binary envelope', binary),
+                ]
+                for transport_name, encode in transports:
+                    total_bytes = 0
+                    start = default_timer()
+                    for message in message_list:
+                        total_bytes += len(encode(message))
+                    duration = default_timer() - start
+                    self.stdout.write(
+                        '%-8s %-9s %-19s %12d %14.3f' % (
+                            size_name,
+                            message_name,
+                            transport_name,
+                            total_bytes // len(message_list),
+                            duration * 1000 / len(message_list)
+                        )
+                    )
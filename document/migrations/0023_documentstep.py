@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 21:16
+from __future__ import unicode_literals
+
+import json
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def last_diffs_to_steps(apps, schema_editor):
+    Document = apps.get_model('document', 'Document')
+    DocumentStep = apps.get_model('document', 'DocumentStep')
+    for document in Document.objects.exclude(last_diffs='[]').only(
+        'id',
+        'diff_version',
+        'last_diffs'
+    ).iterator():
+        diffs = json.loads(document.last_diffs)
+        first_version = document.diff_version - len(diffs)
+        DocumentStep.objects.bulk_create([
+            DocumentStep(
+                document_id=document.id,
+                diff_version=first_version + index + 1,
+                step=json.dumps(diff)
+            ) for index, diff in enumerate(diffs)
+            if first_version + index + 1 > 0
+        ])
+
+
+def steps_to_last_diffs(apps, schema_editor):
+    Document = apps.get_model('document', 'Document')
+    DocumentStep = apps.get_model('document', 'DocumentStep')
+    for document in Document.objects.only('id').iterator():
+        steps = DocumentStep.objects.filter(
+            document_id=document.id
+        ).order_by('diff_version').values_list('step', flat=True)
+        Document.objects.filter(id=document.id).update(
+            last_diffs='[' + ','.join(steps) + ']'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0022_merge_20161219_0605'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentStep',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('diff_version', models.PositiveIntegerField()),
+                ('step', models.TextField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='document.Document')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='documentstep',
+            unique_together=set([('document', 'diff_version')]),
+        ),
+        migrations.RunPython(last_diffs_to_steps, steps_to_last_diffs),
+        migrations.RemoveField(
+            model_name='document',
+            name='last_diffs',
+        ),
+    ]
@@ -7,6 +7,34 @@ from fiduswriter.settings import LOCK_TIMEOUT
 
 MAX_SINCE_SAVE = timedelta(seconds=LOCK_TIMEOUT)
 
+# The fields of a document that are needed to list it and to check access to
+# it. The other fields hold the document itself and can be megabytes large.
+DOCUMENT_LIGHT_FIELDS = (
+    'id',
+    'title',
+    'owner',
+    'added',
+    'updated',
+    'version',
+    'diff_version',
+    'comment_version'
+)
+
+
+class DocumentQuerySet(models.QuerySet):
+    def light(self):
+        """
+        Only fetch the fields in DOCUMENT_LIGHT_FIELDS. The other fields are
+        loaded one by one if they are accessed.
+        """
+        return self.only(*DOCUMENT_LIGHT_FIELDS)
+
+    def heavy(self):
+        """
+        Fetch all fields, also those of a queryset restricted with light().
+        """
+        return self.defer(None)
+
 
 class Document(models.Model):
     title = models.CharField(max_length=255, default='', blank=True)
@@ -21,30 +49,47 @@ class Document(models.Model):
     # document that was sent in by a browser. Such full copies are sent in
     # every 2 minutes automatically or when specific actions are executed by
     # the user (such as exporting the document).
-    last_diffs = models.TextField(default='[]')
-    # The last few diffs that were received and approved. The number of stored
-    # diffs should always be equivalent to or more than all the diffs since the
-    # last full save of the document.
     diff_version = models.PositiveIntegerField(default=0)
     # The diff version is the latest version for which diffs have been
     # accepted. This version should always be the same or higher than the
     # version attribute.
     # To obtain the very last approved version of the document, one needs to
     # take the HTML/JSON version of the document (in the fields title,
-    # contents, metadata and version) and apply N of the last last_diffs, where
-    # N is diff_version - version.
+    # contents, metadata and version) and apply the DocumentSteps with a
+    # diff_version higher than version.
     owner = models.ForeignKey(User, related_name='owner')
     added = models.DateTimeField(auto_now_add=True)
-    updated = models.DateTimeField(auto_now=True)
+    updated = models.DateTimeField(auto_now=True, db_index=True)
     comments = models.TextField(default='{}')
     comment_version = models.PositiveIntegerField(default=0)
 
+    objects = DocumentQuerySet.as_manager()
+
     def __unicode__(self):
         return self.title
 
     def get_absolute_url(self):
         return "/document/%i/" % self.id
 
+
+class DocumentStep(models.Model):
+    # The last few diffs that were received and approved. The stored diffs
+    # should always include all the diffs since the last full save of the
+    # document. Steps are only ever added or removed, never changed.
+    document = models.ForeignKey(Document)
+    diff_version = models.PositiveIntegerField()
+    # The diff version of the document after applying this step.
+    step = models.TextField()  # json object of the step
+
+    class Meta:
+        unique_together = (("document", "diff_version"),)
+
+    def __unicode__(self):
+        return '%(doc_id)d: %(diff_version)d' % {
+            'doc_id': self.document_id,
+            'diff_version': self.diff_version
+        }
+
 RIGHTS_CHOICES = (
     ('read', 'Reader'),
     ('read-without-comments', 'Reader without comment access'),
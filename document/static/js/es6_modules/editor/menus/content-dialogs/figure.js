@@ -33,7 +33,7 @@ export class FigureDialog {
         if (this.imageId && this.imageDB.db[this.imageId]) {
             document.getElementById('inner-figure-preview').innerHTML =
                 '<img src="' +
-                this.imageDB.db[this.imageId].image +
+                this.imageDB.derivativeUrl(this.imageId, 600) +
                 '" style="max-width: 400px;max-height:220px">'
         }
     }
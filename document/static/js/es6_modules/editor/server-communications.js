@@ -1,3 +1,5 @@
+import {inflate} from "pako"
+
 /* Sets up communicating with server (retrieving document,
   saving, collaboration, etc.).
  */
@@ -19,9 +21,12 @@ export class ModServerCommunications {
 
     createWSConnection() {
         let websocketProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:'
+        /* Documents and diffs can be received as zlib compressed binary frames. */
+        let websocketArguments = window.websocketBinary ? '?binary=1' : ''
 
         try {
-            this.ws = new window.WebSocket(`${websocketProtocol}//${window.websocketServer}${window.websocketPort}/ws/doc/${this.editor.doc.id}`)
+            this.ws = new window.WebSocket(`${websocketProtocol}//${window.websocketServer}${window.websocketPort}/ws/doc/${this.editor.doc.id}${websocketArguments}`)
+            this.ws.binaryType = 'arraybuffer'
             this.ws.onopen = () => {
                 jQuery('#unobtrusive_messages').html('')
             }
@@ -31,7 +36,12 @@ export class ModServerCommunications {
 
 
         this.ws.onmessage = event => {
-            let data = JSON.parse(event.data)
+            let data
+            if (event.data instanceof ArrayBuffer) {
+                data = JSON.parse(inflate(new Uint8Array(event.data), {to: 'string'}))
+            } else {
+                data = JSON.parse(event.data)
+            }
             this.receive(data)
         }
         this.ws.onclose = event => {
@@ -2,6 +2,10 @@ import {Block, Inline, Text, Attribute} from "prosemirror-old/dist/model"
 import {elt} from "prosemirror-old/dist/util/dom"
 import {katexRender} from "../katex/katex"
 
+// Figures are shown with a copy of the image in this width, which is enough
+// for the width of the page on high resolution screens.
+const FIGURE_IMAGE_WIDTH = 1200
+
 export class Citation extends Inline {
     get attrs() {
         return {
@@ -99,7 +103,7 @@ export class Figure extends Block {
                     node.type.schema.cached.imageDB.db[node.attrs.image].image) {
                         let imgSrc = node.type.schema.cached.imageDB.db[node.attrs.image].image
                     dom.firstChild.appendChild(elt("img", {
-                        "src": node.type.schema.cached.imageDB.db[node.attrs.image].image
+                        "src": node.type.schema.cached.imageDB.derivativeUrl(node.attrs.image, FIGURE_IMAGE_WIDTH)
                     }))
                     dom.setAttribute('data-image-src', node.type.schema.cached.imageDB.db[node.attrs.image].image)
                 } else {
@@ -111,7 +115,7 @@ export class Figure extends Block {
                         node.type.schema.cached.imageDB.getDB(() => {
                             if (node.type.schema.cached.imageDB.db[node.attrs.image] &&
                                     node.type.schema.cached.imageDB.db[node.attrs.image].image) {
-                                let imgSrc = node.type.schema.cached.imageDB.db[node.attrs.image].image
+                                let imgSrc = node.type.schema.cached.imageDB.derivativeUrl(node.attrs.image, FIGURE_IMAGE_WIDTH)
                                 dom.firstChild.appendChild(elt("img", {
                                     "src": imgSrc
                                 }))
@@ -0,0 +1,42 @@
+from django.test import SimpleTestCase
+
+from document.helpers.diff_log import DiffLog
+
+
+class DiffLogTest(SimpleTestCase):
+
+    def test_since(self):
+        diff_log = DiffLog([{'step': 1}, {'step': 2}], 7, 5, capacity=10)
+        self.assertEqual(diff_log.first_version, 5)
+        self.assertEqual(diff_log.since(7), [])
+        self.assertEqual(diff_log.since(6), [{'step': 2}])
+        self.assertEqual(diff_log.since(5), [{'step': 1}, {'step': 2}])
+        self.assertIsNone(diff_log.since(4))
+        self.assertIsNone(diff_log.since(8))
+
+    def test_capacity(self):
+        diff_log = DiffLog(capacity=2)
+        diff_log.extend([1, 2, 3, 4, 5])
+        # Diffs after the last full save are never dropped.
+        self.assertEqual(diff_log.to_list(), [1, 2, 3, 4, 5])
+        diff_log.set_base_version(4)
+        self.assertEqual(diff_log.to_list(), [3, 4, 5])
+        self.assertEqual(diff_log.first_version, 2)
+        diff_log.extend([6, 7, 8])
+        self.assertEqual(diff_log.to_list(), [3, 4, 5, 6, 7, 8])
+        diff_log.enforce_capacity(0)
+        self.assertEqual(diff_log.to_list(), [5, 6, 7, 8])
+        self.assertEqual(diff_log.version, 8)
+
+    def test_memory_footprint(self):
+        diff_log = DiffLog(capacity=1)
+        empty_size = diff_log.memory_footprint()
+        diff_log.extend([{'stepType': 'replace', 'from': 1, 'to': 2}])
+        one_diff_size = diff_log.memory_footprint()
+        self.assertGreater(one_diff_size, empty_size)
+        diff_log.extend([{'stepType': 'replace', 'from': 1, 'to': 2}])
+        diff_log.set_base_version(2)
+        self.assertEqual(diff_log.memory_footprint(), one_diff_size)
+        diff_log.reset(2)
+        self.assertEqual(len(diff_log), 0)
+        self.assertEqual(diff_log.memory_footprint(), empty_size)
@@ -0,0 +1,63 @@
+from avatar.models import Avatar
+from django.contrib.auth.models import User
+from django.test import TestCase
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from document.helpers.document_info import document_info_cache
+
+
+class DocumentInfoInvalidationTest(TestCase):
+
+    def setUp(self):
+        self.io_loop = IOLoop()
+        self.io_loop.make_current()
+        self.owner = User.objects.create(username='owner')
+        self.collaborator = User.objects.create(username='collaborator')
+        self.other = User.objects.create(username='other')
+        # The information about a document of the owner that names the
+        # collaborator and about one of another user.
+        document_info_cache.entries.update({
+            1: {
+                'owner_id': self.owner.id,
+                'avatars': {self.owner.id: '', self.collaborator.id: ''}
+            },
+            2: {
+                'owner_id': self.other.id,
+                'avatars': {self.other.id: ''}
+            }
+        })
+
+    def tearDown(self):
+        document_info_cache.entries.clear()
+        document_info_cache.broker = None
+        self.io_loop.clear_current()
+        self.io_loop.close(all_fds=True)
+
+    def cached(self):
+        # Runs the invalidations that the signals have passed to the IOLoop.
+        self.io_loop.run_sync(lambda: gen.moment)
+        return sorted(document_info_cache.entries)
+
+    def test_login(self):
+        self.collaborator.last_login = self.collaborator.date_joined
+        self.collaborator.save(update_fields=['last_login'])
+        self.assertEqual(self.cached(), [1, 2])
+
+    def test_name_change(self):
+        self.collaborator.first_name = 'Collaborator'
+        self.collaborator.save()
+        self.assertEqual(self.cached(), [2])
+
+    def test_avatar_change(self):
+        avatar = Avatar.objects.create(
+            user=self.other,
+            avatar='avatars/other.png'
+        )
+        self.assertEqual(self.cached(), [1])
+        document_info_cache.entries[2] = {
+            'owner_id': self.other.id,
+            'avatars': {self.other.id: ''}
+        }
+        avatar.delete()
+        self.assertEqual(self.cached(), [1])
@@ -0,0 +1,49 @@
+import json
+
+from django.contrib.auth.models import User
+from django.test import Client, TestCase
+
+from document.models import Document
+
+
+class DocumentListTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com')
+        self.client = Client(HTTP_HOST='localhost')
+        self.client.force_login(self.user)
+        for title in ['A', 'B', 'C']:
+            Document.objects.create(owner=self.user, title=title)
+
+    def post(self, data):
+        return self.client.post(
+            '/document/documentlist/',
+            data,
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+
+    def test_pages(self):
+        response = self.post({'page': 2, 'page_size': 2})
+        self.assertEqual(response.status_code, 200)
+        documents = json.loads(response.content)['documents']
+        self.assertEqual([document['title'] for document in documents], ['A'])
+
+    def test_since(self):
+        timestamp = json.loads(self.post({}).content)['timestamp']
+        response = self.post({'since': timestamp + 3600})
+        self.assertEqual(response.status_code, 200)
+        response = json.loads(response.content)
+        self.assertEqual(response['documents'], [])
+        self.assertEqual(len(response['document_ids']), 3)
+
+    def test_invalid_arguments(self):
+        for data in [
+            {'since': 'yesterday'},
+            {'since': 'nan'},
+            {'since': '1e30'},
+            {'page_size': 'ten'},
+            {'page_size': 0},
+            {'page_size': 10, 'page': 'last'},
+            {'page_size': 10, 'page': 0},
+        ]:
+            self.assertEqual(self.post(data).status_code, 400, data)
@@ -0,0 +1,170 @@
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+
+from base.servers.workers import WorkerGroup
+from document.helpers.journal import SessionJournal
+from document.models import Document, DocumentStep
+from document.ws_views import DocumentWS
+
+
+def diff_record(diff_version, steps=1):
+    return {
+        'diff_version': diff_version,
+        'diff': [{'stepType': 'replace', 'from': 1, 'to': 1}] * steps,
+        'comment_version': 0,
+        'comments': []
+    }
+
+
+class SessionJournalTest(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_all(self, journal, document_id, worker=0):
+        return journal.read(
+            document_id,
+            worker,
+            journal.worker_files(worker).get(document_id, [])
+        )
+
+    def test_append(self):
+        journal = SessionJournal(self.directory, False)
+        journal.append(1, diff_record(0))
+        journal.append(1, {'title': 'Title'})
+        journal.append(2, diff_record(4))
+        journal.close(1)
+        journal.close(2)
+        self.assertEqual(
+            self.read_all(journal, 1),
+            [diff_record(0), {'title': 'Title'}]
+        )
+        self.assertEqual(self.read_all(journal, 2), [diff_record(4)])
+
+    def test_checkpoint_and_remove(self):
+        journal = SessionJournal(self.directory, False)
+        self.assertIsNone(journal.checkpoint(1))
+        journal.append(1, diff_record(0))
+        segment = journal.checkpoint(1)
+        # The next changes go to a new segment, which is kept when the
+        # snapshot has been written.
+        journal.append(1, diff_record(1))
+        journal.remove(1, segment)
+        self.assertEqual(self.read_all(journal, 1), [diff_record(1)])
+        # A snapshot without new changes still removes what is saved.
+        self.assertEqual(journal.checkpoint(1), segment + 1)
+        self.assertEqual(journal.checkpoint(1), segment + 1)
+        journal.remove(1, segment + 1)
+        self.assertEqual(journal.list_files(), [])
+
+    def test_incomplete_last_record(self):
+        journal = SessionJournal(self.directory, False)
+        journal.append(1, diff_record(0))
+        journal.append(1, diff_record(1))
+        journal.close(1)
+        path = journal.path(1, 0)
+        with open(path) as journal_file:
+            data = journal_file.read()
+        # The process ended in the middle of the last record.
+        with open(path, 'w') as journal_file:
+            journal_file.write(data[:-10])
+        self.assertEqual(self.read_all(journal, 1), [diff_record(0)])
+
+    def test_restart_continues_segments(self):
+        journal = SessionJournal(self.directory, False)
+        journal.append(1, diff_record(0))
+        journal.checkpoint(1)
+        journal.append(1, diff_record(1))
+        # The process ends without saving, the next one with the same worker
+        # number continues after the files that are left.
+        restarted = SessionJournal(self.directory, False)
+        restarted.append(1, diff_record(2))
+        segment = restarted.checkpoint(1)
+        self.assertEqual(segment, 2)
+        restarted.append(1, diff_record(3))
+        restarted.remove(1, segment)
+        self.assertEqual(self.read_all(restarted, 1), [diff_record(3)])
+
+    def test_workers(self):
+        journal = SessionJournal(self.directory, False, worker=0)
+        other = SessionJournal(self.directory, False, worker=1)
+        journal.append(1, diff_record(0))
+        other.append(1, diff_record(5))
+        other.checkpoint(1)
+        other.remove(1, 0)
+        # Workers only remove their own files.
+        self.assertEqual(self.read_all(journal, 1), [diff_record(0)])
+        self.assertEqual(journal.workers(), [0])
+
+
+class ReplayJournalTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.journal = DocumentWS.journal
+        DocumentWS.journal = SessionJournal(self.directory, False)
+        self.owner = User.objects.create(username='owner')
+
+    def tearDown(self):
+        DocumentWS.journal = self.journal
+        shutil.rmtree(self.directory)
+
+    def write_journal(self, worker, document, records):
+        journal = SessionJournal(self.directory, False, worker=worker)
+        for record in records:
+            journal.append(document.id, record)
+        journal.close(document.id)
+
+    def test_replay(self):
+        workers = WorkerGroup(2, 0)
+        documents = [
+            Document.objects.create(owner=self.owner) for i in range(10)
+        ]
+        owned = [document for document in documents
+                 if workers.owns(document.id)]
+        other = [document for document in documents
+                 if not workers.owns(document.id)]
+        # A record that is there twice and one after missing records.
+        self.write_journal(0, owned[0], [
+            diff_record(0), diff_record(0), diff_record(1, 2),
+            {'title': 'Replayed'}, diff_record(5)
+        ])
+        # Replayed by worker 1.
+        self.write_journal(1, other[0], [diff_record(0)])
+        # Left by a third worker that is gone, replayed by the owner.
+        self.write_journal(2, owned[1], [diff_record(0)])
+        self.write_journal(2, other[1], [diff_record(0)])
+        DocumentWS.replay_journal(workers)
+        document = Document.objects.get(id=owned[0].id)
+        self.assertEqual(document.diff_version, 3)
+        self.assertEqual(document.title, 'Replayed')
+        self.assertEqual(
+            DocumentStep.objects.filter(document=document).count(),
+            3
+        )
+        self.assertEqual(
+            Document.objects.get(id=owned[1].id).diff_version,
+            1
+        )
+        self.assertEqual(
+            Document.objects.get(id=other[0].id).diff_version,
+            0
+        )
+        self.assertEqual(
+            Document.objects.get(id=other[1].id).diff_version,
+            0
+        )
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            [
+                '%d-1-0.journal' % other[0].id,
+                '%d-2-0.journal' % other[1].id
+            ]
+        )
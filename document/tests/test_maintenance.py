@@ -0,0 +1,59 @@
+import json
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from document.models import Document, DocumentStep
+
+
+class GetAllDocsTest(TestCase):
+
+    def setUp(self):
+        staff = User.objects.create_user('staff', 'staff@example.com')
+        staff.is_staff = True
+        staff.save()
+        self.client = Client(HTTP_HOST='localhost')
+        self.client.force_login(staff)
+        self.documents = [
+            Document.objects.create(owner=staff, version=version)
+            for version in [0, 2, 3]
+        ]
+        # The steps up to the version of a document have been applied.
+        DocumentStep.objects.bulk_create([
+            DocumentStep(
+                document=document,
+                diff_version=diff_version,
+                step=json.dumps({'n': diff_version})
+            ) for document in self.documents for diff_version in range(1, 4)
+        ])
+
+    def test_last_diffs(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/document/maintenance/get_all/',
+                {'batch': 1},
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+            )
+        self.assertEqual(response.status_code, 200)
+        docs = json.loads(json.loads(response.content)['docs'])
+        self.assertEqual(
+            dict(
+                (doc['pk'], json.loads(doc['fields']['last_diffs']))
+                for doc in docs
+            ),
+            {
+                self.documents[0].id: [{'n': 1}, {'n': 2}, {'n': 3}],
+                self.documents[1].id: [{'n': 3}],
+                self.documents[2].id: [],
+            }
+        )
+        # The steps of all documents are fetched at once.
+        self.assertEqual(
+            len([
+                query for query in queries.captured_queries
+                if 'document_documentstep' in query['sql']
+            ]),
+            1
+        )
@@ -0,0 +1,160 @@
+from itertools import count
+
+from django.test import SimpleTestCase
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from document.helpers.session_router import SessionRouter
+from ws.brokers import LocalBroker
+
+
+class SessionRouterTest(SimpleTestCase):
+
+    def test_session_ids_wrap_around(self):
+        router = SessionRouter(None, None)
+        first = router.new_session_id()
+        second = router.new_session_id()
+        router.release_session_id(second)
+        # Continue just before the lower bits wrap around.
+        router.session_ids = count(0xFFFFF)
+        last = router.new_session_id()
+        # The first id is still in use, so it is skipped, the second one has
+        # been released.
+        self.assertEqual(router.new_session_id(), second)
+        self.assertNotIn(first, [last, second])
+        self.assertLess(last, 2 ** 53)
+
+
+class Handler(object):
+    # Records what a SessionRouter passes on to DocumentWS.
+
+    def __init__(self):
+        self.calls = []
+
+    def receive_broadcast(self, message):
+        self.calls.append(('broadcast', message))
+
+    def receive_forwarded(self, message):
+        self.calls.append(('forwarded', message))
+
+    def receive_direct(self, message):
+        self.calls.append(('direct', message))
+
+    def ownership_changed(self, document_id, is_owner):
+        self.calls.append(('ownership_changed', document_id, is_owner))
+
+
+class SessionRoutingTest(AsyncTestCase, SimpleTestCase):
+    # Two nodes that share a broker.
+
+    def setUp(self):
+        super(SessionRoutingTest, self).setUp()
+        broker = LocalBroker()
+        self.first = SessionRouter(broker, Handler(), lease_time=0.1)
+        self.second = SessionRouter(broker, Handler(), lease_time=0.1)
+
+    def tearDown(self):
+        for router in [self.first, self.second]:
+            if router.timer is not None:
+                router.timer.stop()
+        super(SessionRoutingTest, self).tearDown()
+
+    def join(self, router, document_id):
+        results = []
+        router.join(document_id, results.append)
+        return results[0]
+
+    def stop(self, router):
+        # The node is gone without leaving its documents.
+        router.timer.stop()
+
+    @gen.coroutine
+    def wait_for(self, condition):
+        for i in range(100):
+            if condition():
+                break
+            yield gen.sleep(0.01)
+        self.assertTrue(condition())
+
+    @gen_test
+    def test_routing(self):
+        self.assertTrue(self.join(self.first, 1))
+        self.assertFalse(self.join(self.second, 1))
+        # Broadcasts go to the other nodes.
+        self.first.publish(1, {'type': 'diff'})
+        # Changes of participants of the mirror go to the owner.
+        self.second.forward(1, {'type': 'diff'})
+        # Messages to a participant go to the node it is connected to.
+        participant = self.first.remote_participant(
+            {'node': self.second.node, 'session_id': 5, 'user_id': 2},
+            1
+        )
+        participant.write_message({'type': 'confirm_diff'})
+        yield gen.moment
+        self.assertEqual(self.first.handler.calls, [
+            ('forwarded', {
+                'type': 'diff',
+                'node': self.second.node,
+                'document_id': 1
+            }),
+        ])
+        self.assertEqual(self.second.handler.calls, [
+            ('broadcast', {
+                'type': 'diff',
+                'node': self.first.node,
+                'document_id': 1
+            }),
+            ('direct', {
+                'type': 'message',
+                'document_id': 1,
+                'session_id': 5,
+                'message': {'type': 'confirm_diff'},
+                'node': self.first.node
+            }),
+        ])
+
+    @gen_test
+    def test_owner_leaves(self):
+        self.join(self.first, 1)
+        self.join(self.second, 1)
+        self.first.leave(1)
+        # The mirror takes over once it renews its claims.
+        self.second.renew_claims()
+        self.assertTrue(self.second.is_owner(1))
+        self.assertEqual(self.second.handler.calls, [
+            ('ownership_changed', 1, True)
+        ])
+        # Messages of the document no longer reach the node that has left.
+        self.second.publish(1, {'type': 'diff'})
+        yield gen.moment
+        self.assertEqual(self.first.handler.calls, [])
+
+    @gen_test
+    def test_owner_disappears(self):
+        self.join(self.first, 1)
+        self.join(self.second, 1)
+        # The owner renews its lease, so the mirror does not take over.
+        yield gen.sleep(0.2)
+        self.assertTrue(self.first.is_owner(1))
+        self.assertFalse(self.second.is_owner(1))
+        self.stop(self.first)
+        yield self.wait_for(lambda: self.second.is_owner(1))
+        self.assertEqual(self.second.handler.calls, [
+            ('ownership_changed', 1, True)
+        ])
+        # The old owner finds out that it has lost the document as soon as it
+        # renews its claims again.
+        self.first.renew_claims()
+        self.assertFalse(self.first.is_owner(1))
+        self.assertEqual(self.first.handler.calls, [
+            ('ownership_changed', 1, False)
+        ])
+        # Forwarded changes now go to the new owner only.
+        self.first.forward(1, {'type': 'diff'})
+        yield gen.moment
+        self.assertEqual(self.second.handler.calls[-1], ('forwarded', {
+            'type': 'diff',
+            'node': self.first.node,
+            'document_id': 1
+        }))
+        self.assertEqual(len(self.first.handler.calls), 1)
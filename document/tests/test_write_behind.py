@@ -0,0 +1,164 @@
+import json
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import TransactionTestCase
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from document.helpers.write_behind import WriteBehindSaver
+from document.models import Document, DocumentStep
+
+
+def share_connection(connection):
+    connections[DEFAULT_DB_ALIAS] = connection
+
+
+class WriteBehindSaverTest(TransactionTestCase):
+
+    def setUp(self):
+        self.io_loop = IOLoop()
+        self.io_loop.make_current()
+        owner = User.objects.create(username='owner')
+        self.document = Document.objects.create(owner=owner)
+        self.sessions = {
+            self.document.id: {
+                'title': 'Title',
+                'contents': {'type': 'doc'},
+                'diffs': [],
+                'saved_diff_version': 0,
+            }
+        }
+        self.written = []
+        self.saver = WriteBehindSaver(
+            self.sessions,
+            self.serialize,
+            interval=1000,
+            max_dirty_bytes=1000000,
+            written=self.snapshot_written
+        )
+        # The worker thread uses the in-memory test database of this thread,
+        # like the server thread of LiveServerTestCase.
+        self.connection = connections[DEFAULT_DB_ALIAS]
+        self.connection.allow_thread_sharing = True
+        self.saver.executor.submit(
+            share_connection,
+            self.connection
+        ).result()
+
+    def tearDown(self):
+        self.saver.shutdown()
+        self.io_loop.clear_current()
+        self.io_loop.close(all_fds=True)
+        self.connection.allow_thread_sharing = False
+
+    def serialize(self, document_id, all_have_left):
+        if document_id not in self.sessions:
+            return None
+        session = self.sessions[document_id]
+        steps_since = session['saved_diff_version']
+        return {
+            'fields': {
+                'title': session['title'],
+                'diff_version': len(session['diffs']),
+            },
+            'json_fields': {
+                'contents': session['contents'],
+            },
+            'steps': [
+                (diff_version, step) for diff_version, step in enumerate(
+                    session['diffs'][steps_since:],
+                    steps_since + 1
+                )
+            ],
+            'steps_since': steps_since,
+            'keep_from': 0,
+        }
+
+    def snapshot_written(self, document_id, snapshot):
+        self.written.append((document_id, threading.current_thread()))
+
+    def change(self, title, contents, *diffs):
+        session = self.sessions[self.document.id]
+        session['title'] = title
+        session['contents'] = contents
+        session['diffs'] = session['diffs'] + list(diffs)
+        self.saver.mark_dirty(self.document.id)
+
+    def flush(self):
+        # Flushes and waits until the result is back on the IOLoop.
+        flushes = self.saver.stats['flushes']
+        self.saver.flush()
+        timeout = time.time() + 5
+        while self.saver.stats['flushes'] == flushes:
+            self.assertLess(time.time(), timeout)
+            self.io_loop.run_sync(lambda: gen.sleep(0.01))
+
+    def saved(self):
+        document = Document.objects.get(id=self.document.id)
+        steps = DocumentStep.objects.filter(
+            document=document
+        ).order_by('diff_version')
+        return (
+            document.title,
+            json.loads(document.contents),
+            [(step.diff_version, json.loads(step.step)) for step in steps]
+        )
+
+    def test_flush(self):
+        self.change('First', {'type': 'doc', 'n': 1}, {'step': 1})
+        self.flush()
+        self.assertEqual(
+            self.saved(),
+            ('First', {'type': 'doc', 'n': 1}, [(1, {'step': 1})])
+        )
+        self.assertEqual(
+            self.sessions[self.document.id]['saved_diff_version'],
+            1
+        )
+        # Only the new steps are written with the next flush.
+        self.change('Second', {'type': 'doc', 'n': 2}, {'step': 2})
+        self.flush()
+        self.assertEqual(
+            self.saved(),
+            (
+                'Second',
+                {'type': 'doc', 'n': 2},
+                [(1, {'step': 1}), (2, {'step': 2})]
+            )
+        )
+        self.assertEqual(self.saver.stats['documents_written'], 2)
+        # The written callback is run in the worker thread.
+        self.assertEqual(len(self.written), 2)
+        self.assertNotEqual(self.written[0][1], threading.current_thread())
+
+    def test_shutdown(self):
+        self.change('Changed', {'type': 'doc', 'n': 1}, {'step': 1})
+        # Unsaved sessions are written when the server stops.
+        self.saver.shutdown()
+        self.assertEqual(
+            self.saved(),
+            ('Changed', {'type': 'doc', 'n': 1}, [(1, {'step': 1})])
+        )
+        self.assertEqual(self.written[0][0], self.document.id)
+        self.saver.shutdown()
+        self.assertEqual(len(self.written), 1)
+
+    def test_failed_write_is_retried(self):
+        # Contents that cannot be encoded fail in the worker thread.
+        self.change('Failed', {'type': 'doc', 'invalid': set()}, {'step': 1})
+        self.flush()
+        self.assertEqual(self.saver.stats['errors'], 1)
+        self.assertEqual(self.saved(), ('', {}, []))
+        self.assertEqual(self.written, [])
+        self.assertIn(self.document.id, self.saver.dirty)
+        # The next flush writes the session again.
+        self.sessions[self.document.id]['contents'] = {'type': 'doc'}
+        self.flush()
+        self.assertEqual(
+            self.saved(),
+            ('Failed', {'type': 'doc'}, [(1, {'step': 1})])
+        )
+        self.assertEqual(len(self.written), 1)
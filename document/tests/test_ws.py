@@ -0,0 +1,219 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import Client, TransactionTestCase, override_settings
+from tornado import gen
+from tornado.escape import json_decode, json_encode
+from tornado.httpclient import HTTPRequest
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application
+from tornado.websocket import websocket_connect
+
+from document.helpers.document_info import document_info_cache
+from document.helpers.journal import SessionJournal
+from document.helpers.session_router import SessionRouter
+from document.helpers.write_behind import WriteBehindSaver
+from document.models import AccessRight, Document
+from document.ws_views import DocumentWS
+from ws import executor
+from ws.brokers import LocalBroker
+
+
+def share_connection(connection):
+    connections[DEFAULT_DB_ALIAS] = connection
+
+
+STEP = {
+    'stepType': 'replace',
+    'from': 1,
+    'to': 1,
+    'slice': {'content': [{'type': 'text', 'text': 'A'}]}
+}
+
+
+@override_settings(WS_DB_THREADS=1)
+class DocumentWSTest(AsyncHTTPTestCase, TransactionTestCase):
+
+    def setUp(self):
+        super(DocumentWSTest, self).setUp()
+        # The database threads use the in-memory test database of this
+        # thread.
+        executor.executor = None
+        self.connection = connections[DEFAULT_DB_ALIAS]
+        self.connection.allow_thread_sharing = True
+        executor.run_in_db_thread(share_connection, self.connection).result()
+        self.journal_dir = tempfile.mkdtemp()
+        self.saved = (DocumentWS.saver, DocumentWS.journal, DocumentWS.router)
+        DocumentWS.saver = WriteBehindSaver(
+            DocumentWS.sessions,
+            DocumentWS.serialize_document,
+            written=DocumentWS.snapshot_written
+        )
+        DocumentWS.saver.executor.submit(
+            share_connection,
+            self.connection
+        ).result()
+        DocumentWS.journal = SessionJournal(self.journal_dir, False)
+        DocumentWS.router = SessionRouter(LocalBroker(), DocumentWS)
+        self.owner = User.objects.create_user('owner')
+        self.collaborator = User.objects.create_user('collaborator')
+        self.document = Document.objects.create(owner=self.owner)
+        AccessRight.objects.create(
+            document=self.document,
+            user=self.collaborator,
+            rights='write'
+        )
+
+    def tearDown(self):
+        if DocumentWS.router.timer is not None:
+            DocumentWS.router.timer.stop()
+        if DocumentWS.saver.timer is not None:
+            DocumentWS.saver.timer.stop()
+        DocumentWS.saver.executor.shutdown()
+        for document_id in list(DocumentWS.journal.files):
+            DocumentWS.journal.close(document_id)
+        DocumentWS.saver, DocumentWS.journal, DocumentWS.router = self.saved
+        DocumentWS.sessions.clear()
+        document_info_cache.entries.clear()
+        document_info_cache.broker = None
+        shutil.rmtree(self.journal_dir)
+        executor.executor.shutdown()
+        executor.executor = None
+        self.connection.allow_thread_sharing = False
+        super(DocumentWSTest, self).tearDown()
+
+    def get_app(self):
+        return Application([
+            ('/ws/doc/(\w+)', DocumentWS),
+        ])
+
+    @gen.coroutine
+    def connect(self, user):
+        client = Client()
+        client.force_login(user)
+        connection = yield websocket_connect(HTTPRequest(
+            'ws://127.0.0.1:%d/ws/doc/%d' % (
+                self.get_http_port(),
+                self.document.id
+            ),
+            headers={'Cookie': '%s=%s' % (
+                settings.SESSION_COOKIE_NAME,
+                client.cookies[settings.SESSION_COOKIE_NAME].value
+            )}
+        ))
+        message = yield self.receive(connection)
+        self.assertEqual(message['type'], 'welcome')
+        raise gen.Return(connection)
+
+    @gen.coroutine
+    def receive(self, connection, message_type=None):
+        # Returns the next message, of the given type if there is one.
+        while True:
+            message = yield connection.read_message()
+            self.assertIsNotNone(message)
+            message = json_decode(message)
+            if message_type is None or message['type'] == message_type:
+                raise gen.Return(message)
+
+    def send(self, connection, message):
+        connection.write_message(json_encode(message))
+
+    @gen_test(timeout=10)
+    def test_diff(self):
+        owner = yield self.connect(self.owner)
+        collaborator = yield self.connect(self.collaborator)
+        self.send(owner, {'type': 'get_document'})
+        self.send(collaborator, {'type': 'get_document'})
+        owner_doc = yield self.receive(owner)
+        self.assertEqual(owner_doc['type'], 'doc_data')
+        self.assertEqual(owner_doc['doc']['id'], self.document.id)
+        self.assertTrue(owner_doc['doc_info']['is_owner'])
+        collaborator_doc = yield self.receive(collaborator)
+        self.assertEqual(collaborator_doc['type'], 'doc_data')
+        self.assertEqual(collaborator_doc['doc_info']['rights'], 'write')
+        self.assertEqual(
+            collaborator_doc['user']['id'],
+            self.collaborator.id
+        )
+        self.send(owner, {
+            'type': 'diff',
+            'diff_version': 0,
+            'diff': [STEP],
+            'comment_version': 0,
+            'comments': [],
+            'request_id': 1,
+            'hash': 'hash'
+        })
+        confirmation = yield self.receive(owner, 'confirm_diff')
+        self.assertEqual(confirmation['request_id'], 1)
+        diff = yield self.receive(collaborator, 'diff')
+        self.assertEqual(diff['diff_version'], 0)
+        self.assertEqual(diff['diff'], [STEP])
+        # The document sent to a participant that reloads includes the diff.
+        self.send(collaborator, {'type': 'get_document'})
+        collaborator_doc = yield self.receive(collaborator, 'doc_data')
+        self.assertEqual(
+            collaborator_doc['doc_info']['unapplied_diffs'],
+            [STEP]
+        )
+        owner.close()
+        collaborator.close()
+
+    @gen_test(timeout=10)
+    def test_document_before_updates(self):
+        owner = yield self.connect(self.owner)
+        collaborator = yield self.connect(self.collaborator)
+        self.send(owner, {'type': 'get_document'})
+        yield self.receive(owner, 'doc_data')
+        # The information about the document is fetched again, so that the
+        # diff is likely to arrive while the document is being sent to the
+        # collaborator.
+        document_info_cache.entries.clear()
+        self.send(collaborator, {'type': 'get_document'})
+        self.send(owner, {
+            'type': 'diff',
+            'diff_version': 0,
+            'diff': [STEP],
+            'comment_version': 0,
+            'comments': [],
+            'request_id': 1,
+            'hash': 'hash'
+        })
+        yield self.receive(owner, 'confirm_diff')
+        self.send(owner, {'type': 'chat', 'body': 'Hello'})
+        messages = []
+        while len(messages) == 0 or messages[-1]['type'] != 'chat':
+            received = yield self.receive(collaborator)
+            messages.append(received)
+        types = [message['type'] for message in messages]
+        doc_data = messages[types.index('doc_data')]
+        # The diff is either part of the document or follows it, but it is
+        # never received before the document.
+        self.assertEqual(
+            doc_data['doc_info']['unapplied_diffs'] +
+            sum([
+                message['diff'] for message in messages
+                if message['type'] == 'diff'
+            ], []),
+            [STEP]
+        )
+        self.assertNotIn('diff', types[:types.index('doc_data')])
+        owner.close()
+        collaborator.close()
+
+    @gen_test(timeout=10)
+    def test_old_diff_version(self):
+        owner = yield self.connect(self.owner)
+        self.send(owner, {'type': 'get_document'})
+        yield self.receive(owner, 'doc_data')
+        # A client that is ahead of the server receives the document again.
+        self.send(owner, {'type': 'check_diff_version', 'diff_version': 5})
+        message = yield self.receive(owner)
+        self.assertEqual(message['type'], 'doc_data')
+        self.send(owner, {'type': 'check_diff_version', 'diff_version': 0})
+        message = yield self.receive(owner)
+        self.assertEqual(message['type'], 'confirm_diff_version')
+        owner.close()
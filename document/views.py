@@ -1,4 +1,6 @@
 import time
+import json
+import datetime
 from django.shortcuts import render
 from django.apps import apps
 from django.shortcuts import redirect
@@ -16,15 +18,17 @@ from django.utils.translation import ugettext as _
 from django.conf import settings
 from django.core.mail import send_mail
 from django.db.models import Q
+from django.utils import timezone
 from django.core.serializers.python import Serializer
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.admin.views.decorators import staff_member_required
 from django.core.paginator import Paginator, EmptyPage
 
-from avatar.utils import get_primary_avatar, get_default_avatar_url
-from avatar.templatetags.avatar_tags import avatar_url
+from user.util import get_user_avatar_urls
 
 from document.models import Document, AccessRight, DocumentRevision, \
-    ExportTemplate, Submission, SubmittedAccessRight
+    ExportTemplate, Submission, SubmittedAccessRight, DocumentStep
+from document.helpers.document_info import document_info_cache
 
 
 class SimpleSerializer(Serializer):
@@ -37,19 +41,16 @@ serializer = SimpleSerializer()
 
 
 def get_accessrights(ars):
+    ars = list(ars.select_related('user'))
+    avatars = get_user_avatar_urls([ar.user for ar in ars])
     ret = []
     for ar in ars:
-        the_avatar = get_primary_avatar(ar.user, 80)
-        if the_avatar:
-            the_avatar = the_avatar.avatar_url(80)
-        else:
-            the_avatar = get_default_avatar_url()
         ret.append({
-            'document_id': ar.document.id,
+            'document_id': ar.document_id,
             'user_id': ar.user.id,
             'user_name': ar.user.readable_name,
             'rights': ar.rights,
-            'avatar': the_avatar
+            'avatar': avatars[ar.user.id]
         })
     return ret
 
@@ -79,7 +80,7 @@ def get_documentlist_extra_js(request):
     if request.is_ajax() and request.method == 'POST':
         status = 200
         ids = request.POST['ids'].split(',')
-        documents = Document.objects.filter(Q(owner=request.user) | Q(
+        documents = Document.objects.heavy().filter(Q(owner=request.user) | Q(
             accessright__user=request.user)).filter(id__in=ids)
         response['documents'] = serializer.serialize(
             documents, fields=(
@@ -96,33 +97,54 @@ def get_documentlist_extra_js(request):
     )
 
 
-def documents_list(request):
-    documents = Document.objects.filter(Q(owner=request.user) | Q(
-        accessright__user=request.user)).order_by('-updated')
+def documents_list(request, since=None, page=None, page_size=None):
+    """
+    The documents the user owns or has access to, most recently updated
+    first. If since is given (a datetime), only documents updated after it
+    are included. page and page_size select one
+    page of the list.
+
+    The list is built with a constant number of queries: the documents with
+    their owners, the access rights of the user, the revisions and the
+    avatars of the owners.
+    """
+    documents = Document.objects.light().filter(
+        Q(owner=request.user) | Q(accessright__user=request.user)
+    ).select_related('owner').distinct().order_by('-updated', '-id')
+    if since is not None:
+        documents = documents.filter(updated__gt=since)
+    if page_size is not None:
+        first = (page - 1) * page_size
+        documents = documents[first:first + page_size]
+    documents = list(documents)
+    if len(documents) == 0:
+        return []
+    document_ids = [document.id for document in documents]
+    access_rights = dict(AccessRight.objects.filter(
+        user=request.user,
+        document_id__in=document_ids
+    ).values_list('document_id', 'rights'))
+    revisions = dict()
+    for revision in DocumentRevision.objects.filter(
+        document_id__in=document_ids
+    ).only('id', 'document_id', 'date', 'note', 'file_name').order_by('id'):
+        revisions.setdefault(revision.document_id, []).append({
+            'date': time.mktime(revision.date.utctimetuple()),
+            'note': revision.note,
+            'file_name': revision.file_name,
+            'pk': revision.pk
+        })
+    owners = dict()
+    for document in documents:
+        owners[document.owner_id] = document.owner
+    avatars = get_user_avatar_urls(list(owners.values()))
     output_list = []
     for document in documents:
-        if document.owner == request.user:
+        is_owner = document.owner_id == request.user.id
+        if is_owner:
             access_right = 'write'
         else:
-            access_right = AccessRight.objects.get(
-                user=request.user,
-                document=document
-            ).rights
-        revisions = DocumentRevision.objects.filter(document=document)
-        revision_list = []
-        for revision in revisions:
-            revision_list.append({
-                'date': time.mktime(revision.date.utctimetuple()),
-                'note': revision.note,
-                'file_name': revision.file_name,
-                'pk': revision.pk
-            })
-
-        added = time.mktime(document.added.utctimetuple())
-        updated = time.mktime(document.updated.utctimetuple())
-        is_owner = False
-        if document.owner == request.user:
-            is_owner = True
+            access_right = access_rights[document.id]
         output_list.append({
             'id': document.id,
             'title': document.title,
@@ -130,34 +152,81 @@ def documents_list(request):
             'owner': {
                 'id': document.owner.id,
                 'name': document.owner.readable_name,
-                'avatar': avatar_url(document.owner, 80)
+                'avatar': avatars[document.owner_id]
             },
-            'added': added,
-            'updated': updated,
+            'added': time.mktime(document.added.utctimetuple()),
+            'updated': time.mktime(document.updated.utctimetuple()),
             'rights': access_right,
-            'revisions': revision_list
+            'revisions': revisions.get(document.id, [])
         })
     return output_list
 
 
+def datetime_from_timestamp(timestamp):
+    # The timestamps sent to the client are created with
+    # time.mktime(date.utctimetuple()), which treats the UTC time as local
+    # standard time. This reverses that.
+    return datetime.datetime.fromtimestamp(
+        float(timestamp) - time.timezone,
+        timezone.utc
+    )
+
+
 @login_required
 def get_documentlist_js(request):
+    """
+    Optional POST arguments:
+    since: only send documents updated after this timestamp (the 'timestamp'
+    of an earlier response). The ids of all the documents of the user are sent
+    along, so that documents that have been removed can be dropped.
+    page, page_size: only send one page of the document list.
+    """
     response = {}
     status = 405
     if request.is_ajax() and request.method == 'POST':
         status = 200
-        response['documents'] = documents_list(request)
+        response['timestamp'] = time.mktime(
+            timezone.now().utctimetuple())
+        since = request.POST.get('since')
+        page_size = request.POST.get('page_size')
+        page = None
+        try:
+            if since is not None:
+                since = datetime_from_timestamp(since)
+            if page_size is not None:
+                page_size = int(page_size)
+                page = int(request.POST.get('page', 1))
+                if page_size < 1 or page < 1:
+                    raise ValueError
+        except (ValueError, OverflowError, OSError):
+            return JsonResponse({}, status=400)
+        response['documents'] = documents_list(
+            request,
+            since=since,
+            page=page,
+            page_size=page_size
+        )
+        if since is not None:
+            response['document_ids'] = list(Document.objects.filter(
+                Q(owner=request.user) | Q(accessright__user=request.user)
+            ).distinct().values_list('id', flat=True))
         response['team_members'] = []
-        for team_member in request.user.leader.all():
+        team_members = list(
+            request.user.leader.all().select_related('member'))
+        avatars = get_user_avatar_urls(
+            [request.user] +
+            [team_member.member for team_member in team_members]
+        )
+        for team_member in team_members:
             tm_object = {}
             tm_object['id'] = team_member.member.id
             tm_object['name'] = team_member.member.readable_name
-            tm_object['avatar'] = avatar_url(team_member.member, 80)
+            tm_object['avatar'] = avatars[team_member.member.id]
             response['team_members'].append(tm_object)
         response['user'] = {}
         response['user']['id'] = request.user.id
         response['user']['name'] = request.user.readable_name
-        response['user']['avatar'] = avatar_url(request.user, 80)
+        response['user']['avatar'] = avatars[request.user.id]
         response['access_rights'] = get_accessrights(
             AccessRight.objects.filter(document__owner=request.user))
     return JsonResponse(
@@ -340,7 +409,8 @@ def new_submission_revision_js(request):
             last_version = Submission.objects.filter(
                 submission_id=submission_id).latest('version_id')
             user = User.objects.get(email=email)
-            document = Document.objects.get(pk=last_version.document_id)
+            document = Document.objects.heavy().get(
+                pk=last_version.document_id)
             document.pk = None
             document.save()
             data['document_id'] = document.pk
@@ -399,7 +469,8 @@ def delete_js(request):
     status = 405
     if request.is_ajax() and request.method == 'POST':
         doc_id = int(request.POST['id'])
-        document = Document.objects.get(pk=doc_id, owner=request.user)
+        document = Document.objects.light().get(
+            pk=doc_id, owner=request.user)
         document.delete()
         status = 200
     return JsonResponse(
@@ -410,7 +481,7 @@ def delete_js(request):
 
 def send_share_notification(request, doc_id, collaborator_id, right):
     owner = request.user.readable_name
-    document = Document.objects.get(id=doc_id)
+    document = Document.objects.light().get(id=doc_id)
     collaborator = User.objects.get(id=collaborator_id)
     collaborator_name = collaborator.readable_name
     collaborator_email = collaborator.email
@@ -441,7 +512,7 @@ def send_share_notification(request, doc_id, collaborator_id, right):
 
 def send_share_upgrade_notification(request, doc_id, collaborator_id):
     owner = request.user.readable_name
-    document = Document.objects.get(id=doc_id)
+    document = Document.objects.light().get(id=doc_id)
     collaborator = User.objects.get(id=collaborator_id)
     collaborator_name = collaborator.readable_name
     collaborator_email = collaborator.email
@@ -475,7 +546,7 @@ def access_right_save_js(request):
         for tgt_doc in tgt_documents:
             doc_id = int(tgt_doc)
             try:
-                Document.objects.get(pk=doc_id, owner=request.user)
+                Document.objects.light().get(pk=doc_id, owner=request.user)
             except ObjectDoesNotExist:
                 continue
             x = 0
@@ -513,6 +584,7 @@ def access_right_save_js(request):
                             request, doc_id, collaborator_id, tgt_right)
                     access_right.save()
                 x += 1
+        document_info_cache.invalidate_owner(request.user.id)
         response['access_rights'] = get_accessrights(
             AccessRight.objects.filter(document__owner=request.user))
         status = 201
@@ -592,6 +664,8 @@ def set_version(data):
             version_id=version
         )
         submission.save()
+        document_info_cache.invalidate_document(pre_document_id)
+        document_info_cache.invalidate_document(document_id)
         return True
     except:
         return False
@@ -613,6 +687,7 @@ def review_submit_js(request):
         if access_right.rights != tgt_right:
             access_right.rights = tgt_right
             access_right.save()
+            document_info_cache.invalidate_document(document_id)
         submission = Submission.objects.get(
             document_id=document_id)
         response['submission'] = {}
@@ -639,6 +714,7 @@ def review_submit_undo_js(request):
         if access_right.rights != tgt_right:
             access_right.rights = tgt_right
             access_right.save()
+            document_info_cache.invalidate_document(document_id)
         submission = Submission.objects.get(
             document_id=document_id)
         response['submission'] = {}
@@ -682,10 +758,10 @@ def upload_revision_js(request):
     status = 405
     if request.is_ajax() and request.method == 'POST':
         document_id = request.POST['document_id']
-        document = Document.objects.filter(id=int(document_id))
+        document = Document.objects.light().filter(id=int(document_id))
         if len(document) > 0:
             document = document[0]
-            if document.owner == request.user:
+            if document.owner_id == request.user.id:
                 can_save = True
             else:
                 access_rights = AccessRight.objects.filter(
@@ -759,12 +835,30 @@ def get_all_docs_js(request):
 
         batch = request.POST['batch']
         try:
-            response['docs'] = serializers.serialize(
-                'json',
-                paginator.page(batch)
-            )
+            docs = serializers.serialize('python', paginator.page(batch))
         except EmptyPage:
-            response['docs'] = "[]"
+            docs = []
+        # The steps of all documents of the batch are fetched together.
+        steps = dict((doc['pk'], []) for doc in docs)
+        versions = dict(
+            (doc['pk'], doc['fields']['version']) for doc in docs
+        )
+        for document_id, diff_version, step in DocumentStep.objects.filter(
+            document_id__in=list(steps)
+        ).order_by('diff_version').values_list(
+            'document_id',
+            'diff_version',
+            'step'
+        ):
+            if diff_version > versions[document_id]:
+                steps[document_id].append(step)
+        for doc in docs:
+            # The maintenance script expects the unapplied diffs in the same
+            # format as the other fields.
+            doc['fields']['last_diffs'] = (
+                '[' + ','.join(steps[doc['pk']]) + ']'
+            )
+        response['docs'] = json.dumps(docs, cls=DjangoJSONEncoder)
     return JsonResponse(
         response,
         status=status
@@ -794,11 +888,21 @@ def save_doc_js(request):
             doc.settings = settings
         if version:
             doc.version = version
-        if last_diffs:
-            doc.last_diffs = last_diffs
         if diff_version:
             doc.diff_version = diff_version
         doc.save()
+        if last_diffs:
+            # The posted diffs replace all stored steps.
+            diffs = json.loads(last_diffs)
+            first_version = int(doc.diff_version) - len(diffs)
+            DocumentStep.objects.filter(document=doc).delete()
+            DocumentStep.objects.bulk_create([
+                DocumentStep(
+                    document=doc,
+                    diff_version=first_version + index + 1,
+                    step=json.dumps(diff)
+                ) for index, diff in enumerate(diffs)
+            ])
     return JsonResponse(
         response,
         status=status
@@ -857,7 +961,7 @@ def submit_right_js(request):
         tgt_doc = request.POST.get('documentId')
         tgt_users = request.POST.getlist('collaborators[]')
         doc_id = int(tgt_doc)
-        document = Document.objects.get(id=doc_id)
+        document = Document.objects.light().get(id=doc_id)
         tgt_right = 'read-without-comments'
         try:
             the_user = User.objects.filter(is_superuser=1)
@@ -1,82 +1,183 @@
 import uuid
-import atexit
+import zlib
 from copy import deepcopy
 
+from django.conf import settings
+
 from document.helpers.session_user_info import SessionUserInfo
+from document.helpers.diff_log import DiffLog
+from document.helpers.document_info import document_info_cache
+from document.helpers.journal import SessionJournal
+from document.helpers.session_router import SessionRouter
+from document.helpers.write_behind import WriteBehindSaver
 from ws.base import BaseWebSocketHandler
+from ws.brokers import get_broker
+from ws.executor import run_in_db_thread
 from logging import info, error
-from tornado.escape import json_decode, json_encode
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.escape import json_decode, json_encode, utf8
 from tornado.websocket import WebSocketClosedError
-from document.models import AccessRight, COMMENT_ONLY, CAN_UPDATE_DOCUMENT, \
+from document.models import Document, COMMENT_ONLY, CAN_UPDATE_DOCUMENT, \
     CAN_COMMUNICATE
-from document.views import get_accessrights, doc_mode
 from avatar.templatetags.avatar_tags import avatar_url
 
+# Large messages that are sent as zlib compressed binary frames to clients
+# that ask for them.
+BINARY_MESSAGE_TYPES = ['diff', 'doc_data']
+
 
 class DocumentWS(BaseWebSocketHandler):
     sessions = dict()
+    # The futures of documents that are being loaded by document id.
+    loading = dict()
+    # Bytes encoded for broadcasts versus bytes sent to participants, shown at
+    # /server-status/.
+    broadcast_stats = {
+        'payloads_encoded': 0,
+        'bytes_encoded': 0,
+        'messages_sent': 0,
+        'bytes_sent': 0,
+    }
 
+    def get_compression_options(self):
+        # permessage-deflate is only negotiated if it has been configured.
+        return settings.WS_COMPRESSION
+
+    @gen.coroutine
     def open(self, document_id):
         print('Websocket opened')
+        # Messages are only handled once the connection has been set up.
+        self.opened = Future()
+        # Messages to the participant while a document is sent to it.
+        self.held_messages = None
+        self.doc_info_prefetch = None
+        try:
+            yield self.set_up(document_id)
+        finally:
+            self.opened.set_result(None)
+
+    @gen.coroutine
+    def set_up(self, document_id):
+        # Clients connect with ?binary=1 to receive BINARY_MESSAGE_TYPES as
+        # compressed binary frames.
+        self.binary = self.get_argument('binary', '') == '1'
         response = dict()
-        current_user = self.get_current_user()
+        # The session, user, document and access rights are loaded in a
+        # database thread, so that a burst of connections does not hold up
+        # the other documents.
+        current_user = yield run_in_db_thread(self.get_current_user)
         if current_user is None:
             response['type'] = 'access_denied'
             self.write_message(response)
             return
-        self.user_info = SessionUserInfo()
-        doc_db, can_access = self.user_info.init_access(
-            document_id, current_user)
-        if can_access:
-            if doc_db.id in DocumentWS.sessions:
-                self.doc = DocumentWS.sessions[doc_db.id]
-                self.id = max(self.doc['participants']) + 1
-                print("id when opened %s" % self.id)
-            else:
-                self.id = 0
-                self.doc = dict()
-                self.doc['db'] = doc_db
-                self.doc['participants'] = dict()
-                self.doc['last_diffs'] = json_decode(doc_db.last_diffs)
-                self.doc['comments'] = json_decode(doc_db.comments)
-                self.doc['settings'] = json_decode(doc_db.settings)
-                self.doc['contents'] = json_decode(doc_db.contents)
-                self.doc['metadata'] = json_decode(doc_db.metadata)
-                self.doc['version'] = doc_db.version
-                self.doc['diff_version'] = doc_db.diff_version
-                self.doc['comment_version'] = doc_db.comment_version
-                self.doc['title'] = doc_db.title
-                self.doc['id'] = doc_db.id
-                DocumentWS.sessions[doc_db.id] = self.doc
-            self.doc['participants'][self.id] = self
-            response['type'] = 'welcome'
-            self.write_message(response)
-
-    def confirm_diff(self, request_id):
-        response = dict()
-        response['type'] = 'confirm_diff'
-        response['request_id'] = request_id
+        self._current_user = current_user
+        user_info = SessionUserInfo()
+        doc_db, can_access = yield run_in_db_thread(
+            user_info.init_access,
+            document_id,
+            current_user
+        )
+        if not can_access:
+            return
+        self.doc = yield DocumentWS.get_session(doc_db)
+        # Fetch the information sent with the document while the client
+        # says hello. send_document waits for it.
+        self.doc_info_prefetch = document_info_cache.get(doc_db)
+        if self.ws_connection is None:
+            # The connection was closed while loading.
+            DocumentWS.close_session_if_unused(doc_db.id)
+            return
+        self.user_info = user_info
+        # Session ids are unique across all server processes.
+        self.id = DocumentWS.router.new_session_id()
+        print("id when opened %s" % self.id)
+        self.doc['participants'][self.id] = self
+        response['type'] = 'welcome'
         self.write_message(response)
 
+    @property
+    def user_id(self):
+        return self.user_info.user.id
+
+    def write_message(self, message, binary=False):
+        if self.held_messages is not None:
+            self.held_messages.append((message, binary))
+            return
+        if isinstance(message, dict):
+            message, binary = self.encode_message(message, self.binary)
+        return super(DocumentWS, self).write_message(message, binary)
+
+    @staticmethod
+    def encode_message(message, binary=False):
+        # Returns the encoded message and whether it is binary.
+        data = utf8(json_encode(message))
+        if binary and message['type'] in BINARY_MESSAGE_TYPES:
+            return zlib.compress(data), True
+        return data, False
+
+    @gen.coroutine
     def send_document(self):
+        # Messages to the participant are held back until the document has
+        # been sent, so that they arrive in order. Diffs are not sent at all
+        # in the meantime, as the document includes them.
+        if self.held_messages is not None:
+            # The document that is being sent will be up to date.
+            return
+        self.held_messages = []
+        try:
+            yield self.write_document()
+        except Exception:
+            error('Error sending document', exc_info=True)
+        finally:
+            self.release_held_messages()
+
+    def release_held_messages(self, response=None):
+        held_messages = self.held_messages
+        if held_messages is None:
+            return
+        self.held_messages = None
+        try:
+            if response is not None:
+                self.write_message(response)
+            for message, binary in held_messages:
+                self.write_message(message, binary)
+        except WebSocketClosedError:
+            pass
+
+    @gen.coroutine
+    def write_document(self):
+        if self.doc_info_prefetch is not None:
+            prefetch = self.doc_info_prefetch
+            self.doc_info_prefetch = None
+            yield prefetch
+        # Owner, team, access rights and submission are only queried once for
+        # all participants.
+        doc_info = yield document_info_cache.get(self.doc['db'])
+        the_user = self.user_info.user
+        if (
+            not self.user_info.is_owner and
+            the_user.id not in doc_info['avatars']
+        ):
+            avatar = yield run_in_db_thread(avatar_url, the_user, 80)
+        else:
+            avatar = None
+        if self.id not in self.doc['participants']:
+            # The participant has left in the meantime.
+            return
         response = dict()
         response['type'] = 'doc_data'
         response['doc'] = dict()
         response['doc']['id'] = self.doc['id']
         response['doc']['version'] = self.doc['version']
-        if self.doc['diff_version'] < self.doc['version']:
+        if self.doc['diffs'].version < self.doc['version']:
             print('!!!diff version issue!!!')
-            self.doc['diff_version'] = self.doc['version']
-            self.doc["last_diffs"] = []
+            self.doc['diffs'].reset(self.doc['version'])
         response['doc']['title'] = self.doc['title']
         response['doc']['contents'] = self.doc['contents']
         response['doc']['metadata'] = self.doc['metadata']
         response['doc']['settings'] = self.doc['settings']
-        doc_owner = self.doc['db'].owner
-        access_rights = get_accessrights(
-            AccessRight.objects.filter(
-                document__owner=doc_owner))
-        response['doc']['access_rights'] = access_rights
+        response['doc']['access_rights'] = doc_info['access_rights']
 
         if self.user_info.access_rights == 'read-without-comments':
             response['doc']['comments'] = []
@@ -90,51 +191,18 @@ class DocumentWS(BaseWebSocketHandler):
         else:
             response['doc']['comments'] = self.doc["comments"]
         response['doc']['comment_version'] = self.doc["comment_version"]
-        response['doc']['access_rights'] = get_accessrights(
-            AccessRight.objects.filter(document__owner=doc_owner))
-        response['doc']['owner'] = dict()
-        response['doc']['owner']['id'] = doc_owner.id
-        response['doc']['owner']['name'] = doc_owner.readable_name
-        response['doc']['owner'][
-            'avatar'] = avatar_url(doc_owner, 80)
-        response['doc']['owner']['team_members'] = []
-
-        for team_member in doc_owner.leader.all():
-            tm_object = dict()
-            tm_object['id'] = team_member.member.id
-            tm_object['name'] = team_member.member.readable_name
-            tm_object['avatar'] = avatar_url(team_member.member, 80)
-            response['doc']['owner']['team_members'].append(tm_object)
+        response['doc']['owner'] = dict(doc_info['owner'])
         response['doc_info'] = dict()
         response['doc_info']['is_owner'] = self.user_info.is_owner
         response['doc_info']['rights'] = self.user_info.access_rights
-        if self.doc['version'] > self.doc['diff_version']:
-            print('!!!diff version issue!!!')
-            self.doc['diff_version'] = self.doc['version']
-            self.doc["last_diffs"] = []
-        elif self.doc['diff_version'] > self.doc['version']:
-            needed_diffs = self.doc['diff_version'] - self.doc['version']
-            # We only send those diffs needed by the receiver.
-            response['doc_info']['unapplied_diffs'] = self.doc[
-                "last_diffs"][-needed_diffs:]
-        else:
-            response['doc_info']['unapplied_diffs'] = []
+        # We only send those diffs needed by the receiver.
+        unapplied_diffs = self.doc['diffs'].since(self.doc['version'])
+        if unapplied_diffs is None:
+            unapplied_diffs = self.doc['diffs'].to_list()
+        response['doc_info']['unapplied_diffs'] = unapplied_diffs
         # OJS submission related
-        submission = doc_mode(self.doc['id'])
-        response['doc_info']['submission'] = dict()
-        if submission == 'unsubmitted':
-            response['doc_info']['submission']['status'] = 'unsubmitted'
-        else:
-            response['doc_info']['submission']['status'] = 'submitted'
-            response['doc_info']['submission']['submission_id'] = \
-                submission.submission_id
-            response['doc_info']['submission']['user_id'] = submission.user_id
-            response['doc_info']['submission']['version_id'] = \
-                submission.version_id
-            response['doc_info']['submission']['journal_id'] = \
-                submission.journal_id
+        response['doc_info']['submission'] = doc_info['submission']
         if self.user_info.is_owner:
-            the_user = self.user_info.user
             # Data used for OJS submissions
             response['doc']['owner']['email'] = the_user.email
             response['doc']['owner']['username'] = the_user.username
@@ -142,11 +210,13 @@ class DocumentWS(BaseWebSocketHandler):
             response['doc']['owner']['last_name'] = the_user.last_name
             response['doc']['owner']['email'] = the_user.email
         else:
-            the_user = self.user_info.user
             response['user'] = dict()
             response['user']['id'] = the_user.id
             response['user']['name'] = the_user.readable_name
-            response['user']['avatar'] = avatar_url(the_user, 80)
+            if the_user.id in doc_info['avatars']:
+                response['user']['avatar'] = doc_info['avatars'][the_user.id]
+            else:
+                response['user']['avatar'] = avatar
             # Data used for OJS submissions
             response['user']['email'] = the_user.email
             response['user']['username'] = the_user.username
@@ -154,111 +224,85 @@ class DocumentWS(BaseWebSocketHandler):
             response['user']['last_name'] = the_user.last_name
             response['user']['email'] = the_user.email
         response['doc_info']['session_id'] = self.id
-        self.write_message(response)
+        # The response is written before any other diff can be applied.
+        self.release_held_messages(response)
 
+    @gen.coroutine
     def on_message(self, message):
-        if self.user_info.document_id not in DocumentWS.sessions:
+        # Tornado waits for this coroutine before it passes on the next
+        # message of the connection, so the messages of a participant are
+        # handled in order.
+        yield self.opened
+        if (
+            not hasattr(self, 'user_info') or
+            self.user_info.document_id not in DocumentWS.sessions
+        ):
             print('receiving message for closed document')
             return
         parsed = json_decode(message)
         print(parsed["type"])
+        if (
+            not self.doc['synced'] and
+            parsed["type"] not in ['participant_update', 'chat']
+        ):
+            # The current state of the document has not yet been received
+            # from the process that owns it.
+            self.doc['waiting'].append((self, parsed, len(message)))
+            return
+        future = self.handle_message(parsed, len(message))
+        if future is not None:
+            yield future
+
+    def handle_message(self, parsed, message_size=0):
+        # Returns a future if the message is still being handled.
         if parsed["type"] == 'get_document':
-            self.send_document()
+            return self.send_document()
         elif parsed["type"] == 'participant_update' and self.can_communicate():
             self.handle_participant_update()
         elif parsed["type"] == 'chat' and self.can_communicate():
             self.handle_chat(parsed)
         elif parsed["type"] == 'check_diff_version':
-            self.check_diff_version(parsed)
+            return self.check_diff_version(parsed)
         elif parsed["type"] == 'selection_change':
             self.handle_selection_change(parsed)
         elif (
             parsed["type"] == 'update_doc' and
             self.can_update_document()
         ):
-            self.handle_document_update(parsed)
+            self.handle_document_update(parsed, message_size)
         elif parsed["type"] == 'update_title' and self.can_update_document():
-            self.handle_title_update(parsed)
+            self.handle_title_update(parsed, message_size)
         elif parsed["type"] == 'diff' and self.can_update_document():
-            self.handle_diff(parsed)
+            self.handle_diff(parsed, message_size)
 
-    def update_document(self, changes):
-        if changes['version'] == self.doc['version']:
-            # Document hasn't changed, return.
-            return
-        elif (
-            changes['version'] > self.doc['diff_version'] or
-            changes['version'] < self.doc['version']
-        ):
-            # The version number is too high. Possibly due to server restart.
-            # Do not accept it, and send a document instead.
-            self.send_document()
-            return
-        else:
-            # The saved version does not contain all accepted diffs, so we keep
-            # the remaining ones + 1000 in case a client needs to reconnect and
-            # is missing some.
-            remaining_diffs = 1000 + \
-                self.doc['diff_version'] - changes['version']
-            self.doc['last_diffs'] = self.doc['last_diffs'][-remaining_diffs:]
-        self.doc['title'] = changes['title']
-        self.doc['contents'] = changes['contents']
-        self.doc['metadata'] = changes['metadata']
-        self.doc['settings'] = changes['settings']
-        self.doc['version'] = changes['version']
-
-    def update_title(self, title):
-        self.doc['title'] = title
-
-    def update_comments(self, comments_updates):
-        comments_updates = deepcopy(comments_updates)
-        for cd in comments_updates:
-            id = str(cd["id"])
-            if cd["type"] == "create":
-                del cd["type"]
-                self.doc["comments"][id] = cd
-            elif cd["type"] == "delete":
-                del self.doc["comments"][id]
-            elif cd["type"] == "update":
-                self.doc["comments"][id]["comment"] = cd["comment"]
-                if "review:isMajor" in cd:
-                    self.doc["comments"][id][
-                        "review:isMajor"] = cd["review:isMajor"]
-            elif cd["type"] == "add_answer":
-                comment_id = str(cd["commentId"])
-                if "answers" not in self.doc["comments"][comment_id]:
-                    self.doc["comments"][comment_id]["answers"] = []
-                del cd["type"]
-                self.doc["comments"][comment_id]["answers"].append(cd)
-            elif cd["type"] == "delete_answer":
-                comment_id = str(cd["commentId"])
-                for answer in self.doc["comments"][comment_id]["answers"]:
-                    if answer["id"] == cd["id"]:
-                        self.doc["comments"][comment_id][
-                            "answers"].remove(answer)
-            elif cd["type"] == "update_answer":
-                comment_id = str(cd["commentId"])
-                for answer in self.doc["comments"][comment_id]["answers"]:
-                    if answer["id"] == cd["id"]:
-                        answer["answer"] = cd["answer"]
-            self.doc['comment_version'] += 1
+    def forward_to_owner(self, parsed, message_size=0):
+        # Changes are only applied by the process that owns the document.
+        DocumentWS.router.forward(self.user_info.document_id, {
+            'type': parsed["type"],
+            'message': parsed,
+            'size': message_size,
+            'origin': {
+                'node': DocumentWS.router.node,
+                'session_id': self.id,
+                'user_id': self.user_id
+            }
+        })
 
     def handle_participant_update(self):
         DocumentWS.send_participant_list(self.user_info.document_id)
 
-    def handle_document_update(self, parsed):
-        self.update_document(parsed["doc"])
-        DocumentWS.save_document(self.user_info.document_id, False)
-        message = {
-            "type": 'check_hash',
-            "diff_version": parsed["doc"]["version"],
-            "hash": parsed["hash"]
-        }
-        DocumentWS.send_updates(message, self.user_info.document_id, self.id)
+    def handle_document_update(self, parsed, message_size=0):
+        if self.doc['owner']:
+            DocumentWS.apply_document_update(
+                self.doc, parsed, self, message_size)
+        else:
+            self.forward_to_owner(parsed, message_size)
 
-    def handle_title_update(self, parsed):
-        self.update_title(parsed["title"])
-        DocumentWS.save_document(self.user_info.document_id, False)
+    def handle_title_update(self, parsed, message_size=0):
+        if self.doc['owner']:
+            DocumentWS.apply_title_update(self.doc, parsed, message_size)
+        else:
+            self.forward_to_owner(parsed, message_size)
 
     def handle_chat(self, parsed):
         chat = {
@@ -271,7 +315,7 @@ class DocumentWS(BaseWebSocketHandler):
 
     def handle_selection_change(self, parsed):
         if self.user_info.document_id in DocumentWS.sessions and parsed[
-                "diff_version"] == self.doc['diff_version']:
+                "diff_version"] == self.doc['diffs'].version:
             DocumentWS.send_updates(
                 parsed, self.user_info.document_id, self.id)
 
@@ -285,7 +329,7 @@ class DocumentWS(BaseWebSocketHandler):
                 only_comment = False
         return only_comment
 
-    def handle_diff(self, parsed):
+    def handle_diff(self, parsed, message_size=0):
         if (
             self.user_info.access_rights in COMMENT_ONLY and
             not self.only_comments(parsed['diff'])
@@ -297,45 +341,14 @@ class DocumentWS(BaseWebSocketHandler):
                 )
             )
             return
-        if parsed["diff_version"] == self.doc['diff_version'] and parsed[
-                "comment_version"] == self.doc['comment_version']:
-            self.doc["last_diffs"].extend(parsed["diff"])
-            self.doc['diff_version'] += len(parsed["diff"])
-            self.update_comments(parsed["comments"])
-            self.confirm_diff(parsed["request_id"])
-            DocumentWS.send_updates(
-                parsed,
-                self.user_info.document_id,
-                self.id,
-                self.user_info.user.id
-            )
-        elif parsed["diff_version"] != self.doc['diff_version']:
-            if parsed["diff_version"] < (
-                    self.doc['diff_version'] - len(self.doc["last_diffs"])):
-                print('unfixable')
-                # Client has a version that is too old
-                self.send_document()
-            elif parsed["diff_version"] < self.doc['diff_version']:
-                print("can fix it")
-                number_requested_diffs = self.doc[
-                    'diff_version'] - parsed["diff_version"]
-                response = {
-                    "type": "diff",
-                    "diff_version": parsed["diff_version"],
-                    "diff": self.doc["last_diffs"][-number_requested_diffs:],
-                    "reject_request_id": parsed["request_id"],
-                }
-                self.write_message(response)
-            else:
-                print('unfixable')
-                # Client has a version that is too old
-                self.send_document()
+        if self.doc['owner']:
+            DocumentWS.apply_diff(self.doc, parsed, self, message_size)
         else:
-            print('comment_version incorrect!')
+            self.forward_to_owner(parsed, message_size)
 
     def check_diff_version(self, parsed):
         pdv = parsed["diff_version"]
-        ddv = self.doc['diff_version']
+        ddv = self.doc['diffs'].version
         if pdv == ddv:
             response = {
                 "type": "confirm_diff_version",
@@ -343,20 +356,18 @@ class DocumentWS(BaseWebSocketHandler):
             }
             self.write_message(response)
             return
-        elif pdv + len(self.doc["last_diffs"]) >= ddv:
-            number_requested_diffs = ddv - pdv
+        elif pdv >= self.doc['diffs'].first_version and pdv < ddv:
             response = {
                 "type": "diff",
                 "diff_version": parsed["diff_version"],
-                "diff": self.doc["last_diffs"][-number_requested_diffs:],
+                "diff": self.doc['diffs'].since(pdv),
             }
             self.write_message(response)
             return
         else:
             print('unfixable')
             # Client has a version that is too old
-            self.send_document()
-            return
+            return self.send_document()
 
     def can_update_document(self):
         return self.user_info.access_rights in CAN_UPDATE_DOCUMENT
@@ -366,6 +377,8 @@ class DocumentWS(BaseWebSocketHandler):
 
     def on_close(self):
         print('Websocket closing')
+        if hasattr(self, 'id'):
+            DocumentWS.router.release_session_id(self.id)
         if (
             hasattr(self, 'user_info') and
             hasattr(self.user_info, 'document_id') and
@@ -376,103 +389,738 @@ class DocumentWS(BaseWebSocketHandler):
             ]['participants']
         ):
             del self.doc['participants'][self.id]
-            if len(self.doc['participants'].keys()) == 0:
-                DocumentWS.save_document(self.user_info.document_id, True)
-                del DocumentWS.sessions[self.user_info.document_id]
-                print("noone left")
+            if (
+                not self.doc['owner'] or
+                len(self.doc['remote_participants']) > 0
+            ):
+                # Let the other processes know who is still connected here.
+                DocumentWS.send_participant_list(
+                    self.user_info.document_id, False)
+            DocumentWS.close_session_if_unused(self.user_info.document_id)
+
+    @classmethod
+    @gen.coroutine
+    def get_session(cls, doc_db):
+        """
+        Returns the session of a document, loading the document in a database
+        thread if it is not open yet. Participants that connect while it is
+        loaded wait for the same session.
+        """
+        if doc_db.id not in cls.sessions:
+            if doc_db.id not in cls.loading:
+                cls.loading[doc_db.id] = run_in_db_thread(
+                    cls.load_document,
+                    doc_db.id
+                )
+            future = cls.loading[doc_db.id]
+            try:
+                doc_heavy, diffs = yield future
+            finally:
+                if cls.loading.get(doc_db.id) is future:
+                    del cls.loading[doc_db.id]
+            if doc_db.id not in cls.sessions:
+                cls.open_session(doc_db, doc_heavy, diffs)
+        raise gen.Return(cls.sessions[doc_db.id])
+
+    @staticmethod
+    def load_document(document_id):
+        # Runs in a database thread.
+        doc_db = Document.objects.heavy().get(id=document_id)
+        return doc_db, DiffLog.load(doc_db)
+
+    @classmethod
+    def open_session(cls, doc_db, doc_heavy, diffs):
+        # doc_db only has the light fields loaded (see SessionUserInfo) and
+        # is kept as is. doc_heavy is the document with all fields.
+        doc = dict()
+        doc['db'] = doc_db
+        doc_db = doc_heavy
+        doc['participants'] = dict()
+        doc['diffs'] = diffs
+        doc['saved_diff_version'] = doc_db.diff_version
+        doc['comments'] = json_decode(doc_db.comments)
+        doc['settings'] = json_decode(doc_db.settings)
+        doc['contents'] = json_decode(doc_db.contents)
+        doc['metadata'] = json_decode(doc_db.metadata)
+        doc['version'] = doc_db.version
+        doc['comment_version'] = doc_db.comment_version
+        doc['title'] = doc_db.title
+        doc['id'] = doc_db.id
+        # Whether this process owns the document (None until known), the
+        # process that owns it otherwise and the participants connected to
+        # other processes by process.
+        doc['owner'] = None
+        doc['owner_node'] = None
+        doc['remote_participants'] = dict()
+        # Messages received before the session is synced with the owner.
+        doc['synced'] = False
+        doc['waiting'] = []
+        cls.sessions[doc_db.id] = doc
+        cls.router.join(
+            doc_db.id,
+            lambda is_owner: cls.joined(doc_db.id, is_owner)
+        )
+        return doc
+
+    @classmethod
+    def joined(cls, document_id, is_owner):
+        if document_id not in cls.sessions:
+            return
+        doc = cls.sessions[document_id]
+        doc['owner'] = is_owner
+        if is_owner:
+            cls.session_ready(doc)
+        else:
+            cls.request_sync(doc)
+
+    @classmethod
+    def ownership_changed(cls, document_id, is_owner):
+        if document_id not in cls.sessions:
+            return
+        doc = cls.sessions[document_id]
+        doc['owner'] = is_owner
+        if is_owner:
+            # The previous owner has disappeared and with it its
+            # participants. The document is continued from the state of the
+            # mirror.
+            print('taking over document #' + str(document_id))
+            doc['remote_participants'].pop(doc['owner_node'], None)
+            doc['saved_diff_version'] = min(
+                doc['saved_diff_version'],
+                doc['diffs'].first_version
+            )
+            cls.session_ready(doc)
+            cls.saver.mark_dirty(document_id)
+            cls.close_session_if_unused(document_id)
+        else:
+            cls.request_sync(doc)
+
+    @classmethod
+    def request_sync(cls, doc):
+        doc['synced'] = False
+        cls.router.forward(doc['id'], {
+            'type': 'sync_request',
+            'count': len(doc['participants'])
+        })
+
+    @classmethod
+    def session_ready(cls, doc):
+        doc['synced'] = True
+        waiting = doc['waiting']
+        doc['waiting'] = []
+        for waiter, parsed, message_size in waiting:
+            if waiter.id in doc['participants']:
+                waiter.handle_message(parsed, message_size)
+
+    @classmethod
+    def session_state(cls, doc):
+        participants = [
+            [node, remote]
+            for node, remote in doc['remote_participants'].items()
+        ]
+        participants.append([cls.router.node, {
+            'count': len(doc['participants']),
+            'participants': cls.local_participant_list(doc['id'])
+        }])
+        return {
+            'title': doc['title'],
+            'contents': doc['contents'],
+            'metadata': doc['metadata'],
+            'settings': doc['settings'],
+            'version': doc['version'],
+            'comments': doc['comments'],
+            'comment_version': doc['comment_version'],
+            'diffs': doc['diffs'].to_list(),
+            'diff_version': doc['diffs'].version,
+            'base_version': doc['diffs'].base_version,
+            'participants': participants
+        }
+
+    @classmethod
+    def apply_session_state(cls, doc, state, node):
+        if doc['owner']:
+            return
+        doc['title'] = state['title']
+        doc['contents'] = state['contents']
+        doc['metadata'] = state['metadata']
+        doc['settings'] = state['settings']
+        doc['version'] = state['version']
+        doc['comments'] = state['comments']
+        doc['comment_version'] = state['comment_version']
+        doc['diffs'] = DiffLog(
+            state['diffs'],
+            state['diff_version'],
+            state['base_version']
+        )
+        doc['saved_diff_version'] = doc['diffs'].first_version
+        doc['owner_node'] = node
+        doc['remote_participants'] = dict(
+            (remote_node, remote)
+            for remote_node, remote in state['participants']
+            if remote_node != cls.router.node
+        )
+        cls.session_ready(doc)
+
+    @classmethod
+    def close_session_if_unused(cls, document_id):
+        if document_id not in cls.sessions:
+            return
+        doc = cls.sessions[document_id]
+        if len(doc['participants']) > 0:
+            return
+        if not doc['owner']:
+            # Mirrors are not saved.
+            cls.router.leave(document_id)
+            del cls.sessions[document_id]
+            document_info_cache.discard(document_id)
+            cls.journal.close(document_id)
+        elif len(doc['remote_participants']) == 0:
+            cls.save_document(document_id, True)
+            print("noone left")
 
     @classmethod
-    def send_participant_list(cls, document_id):
+    def update_document(cls, doc, changes, origin):
+        if changes['version'] == doc['version']:
+            # Document hasn't changed, return.
+            return False
+        elif (
+            changes['version'] > doc['diffs'].version or
+            changes['version'] < doc['version']
+        ):
+            # The version number is too high. Possibly due to server restart.
+            # Do not accept it, and send a document instead.
+            origin.send_document()
+            return False
+        cls.apply_changes(doc, changes)
+        return True
+
+    @classmethod
+    def apply_changes(cls, doc, changes):
+        # The saved version does not contain all accepted diffs, so we keep
+        # the remaining ones + some older ones in case a client needs to
+        # reconnect and is missing some.
+        doc['diffs'].set_base_version(changes['version'])
+        doc['title'] = changes['title']
+        doc['contents'] = changes['contents']
+        doc['metadata'] = changes['metadata']
+        doc['settings'] = changes['settings']
+        doc['version'] = changes['version']
+
+    @classmethod
+    def update_comments(cls, doc, comments_updates):
+        if len(comments_updates) == 0:
+            return
+        comments_updates = deepcopy(comments_updates)
+        # The comments are replaced rather than changed, as the saver may be
+        # encoding the previous ones in its thread.
+        comments = dict(doc["comments"])
+        for cd in comments_updates:
+            id = str(cd["id"])
+            if cd["type"] == "create":
+                del cd["type"]
+                comments[id] = cd
+            elif cd["type"] == "delete":
+                del comments[id]
+            elif cd["type"] == "update":
+                comments[id] = dict(comments[id], comment=cd["comment"])
+                if "review:isMajor" in cd:
+                    comments[id]["review:isMajor"] = cd["review:isMajor"]
+            elif cd["type"] == "add_answer":
+                comment_id = str(cd["commentId"])
+                del cd["type"]
+                comments[comment_id] = dict(
+                    comments[comment_id],
+                    answers=comments[comment_id].get("answers", []) + [cd]
+                )
+            elif cd["type"] == "delete_answer":
+                comment_id = str(cd["commentId"])
+                comments[comment_id] = dict(
+                    comments[comment_id],
+                    answers=[
+                        answer for answer in comments[comment_id]["answers"]
+                        if answer["id"] != cd["id"]
+                    ]
+                )
+            elif cd["type"] == "update_answer":
+                comment_id = str(cd["commentId"])
+                comments[comment_id] = dict(
+                    comments[comment_id],
+                    answers=[
+                        dict(answer, answer=cd["answer"])
+                        if answer["id"] == cd["id"] else answer
+                        for answer in comments[comment_id]["answers"]
+                    ]
+                )
+            doc['comment_version'] += 1
+        doc["comments"] = comments
+
+    @classmethod
+    def apply_document_update(cls, doc, parsed, origin, message_size=0):
+        if cls.update_document(doc, parsed["doc"], origin):
+            cls.router.publish(doc['id'], {
+                'type': 'update_doc',
+                'changes': parsed["doc"]
+            })
+        cls.save_document(doc['id'], False, message_size)
+        message = {
+            "type": 'check_hash',
+            "diff_version": parsed["doc"]["version"],
+            "hash": parsed["hash"]
+        }
+        cls.send_updates(message, doc['id'], origin.id)
+
+    @classmethod
+    def apply_title_update(cls, doc, parsed, message_size=0):
+        doc['title'] = parsed["title"]
+        cls.journal.append(doc['id'], {'title': parsed["title"]})
+        cls.router.publish(doc['id'], {
+            'type': 'update_title',
+            'title': parsed["title"]
+        })
+        cls.save_document(doc['id'], False, message_size)
+
+    @classmethod
+    def apply_diff(cls, doc, parsed, origin, message_size=0):
+        if parsed["diff_version"] == doc['diffs'].version and parsed[
+                "comment_version"] == doc['comment_version']:
+            doc['diffs'].extend(parsed["diff"])
+            cls.update_comments(doc, parsed["comments"])
+            # The diff is journaled before it is confirmed.
+            cls.journal.append(doc['id'], {
+                'diff_version': parsed["diff_version"],
+                'diff': parsed["diff"],
+                'comment_version': parsed["comment_version"],
+                'comments': parsed["comments"]
+            })
+            cls.save_document(doc['id'], False, message_size)
+            # The other processes apply the diff before the sender receives
+            # the confirmation.
+            cls.router.publish(doc['id'], {
+                'type': 'diff',
+                'message': parsed,
+                'sender_id': origin.id,
+                'user_id': origin.user_id
+            })
+            origin.write_message({
+                'type': 'confirm_diff',
+                'request_id': parsed["request_id"]
+            })
+            cls.deliver_updates(parsed, doc['id'], origin.id, origin.user_id)
+        elif parsed["diff_version"] != doc['diffs'].version:
+            if parsed["diff_version"] < doc['diffs'].first_version:
+                print('unfixable')
+                # Client has a version that is too old
+                origin.send_document()
+            elif parsed["diff_version"] < doc['diffs'].version:
+                print("can fix it")
+                response = {
+                    "type": "diff",
+                    "diff_version": parsed["diff_version"],
+                    "diff": doc['diffs'].since(parsed["diff_version"]),
+                    "reject_request_id": parsed["request_id"],
+                }
+                origin.write_message(response)
+            else:
+                print('unfixable')
+                # Client has a version that is too old
+                origin.send_document()
+        else:
+            print('comment_version incorrect!')
+
+    @classmethod
+    def receive_forwarded(cls, message):
+        # Changes of participants connected to other processes.
+        if message['document_id'] not in cls.sessions:
+            return
+        doc = cls.sessions[message['document_id']]
+        if message['type'] == 'sync_request':
+            if message['node'] not in doc['remote_participants']:
+                doc['remote_participants'][message['node']] = {
+                    'count': message['count'],
+                    'participants': []
+                }
+            cls.router.send_to_node(message['node'], {
+                'type': 'sync',
+                'document_id': doc['id'],
+                'state': cls.session_state(doc)
+            })
+            return
+        origin = cls.router.remote_participant(message['origin'], doc['id'])
+        parsed = message['message']
+        if message['type'] == 'diff':
+            cls.apply_diff(doc, parsed, origin, message['size'])
+        elif message['type'] == 'update_doc':
+            cls.apply_document_update(doc, parsed, origin, message['size'])
+        elif message['type'] == 'update_title':
+            cls.apply_title_update(doc, parsed, message['size'])
+
+    @classmethod
+    def receive_broadcast(cls, message):
+        # Messages sent to all processes that have the document open.
+        if message['document_id'] not in cls.sessions:
+            return
+        doc = cls.sessions[message['document_id']]
+        if message['type'] == 'participants':
+            if message['count'] > 0:
+                doc['remote_participants'][message['node']] = {
+                    'count': message['count'],
+                    'participants': message['participants']
+                }
+            else:
+                doc['remote_participants'].pop(message['node'], None)
+            if message['notify']:
+                cls.deliver_participant_list(doc['id'])
+            cls.close_session_if_unused(doc['id'])
+            return
+        elif message['type'] == 'message':
+            cls.deliver_updates(
+                message['message'],
+                doc['id'],
+                message['sender_id'],
+                message['user_id']
+            )
+            return
+        # Changes accepted by the owner. Before the session is synced, they
+        # are part of the state that is still to be received.
+        doc['owner_node'] = message['node']
+        is_mirror = doc['synced'] and doc['owner'] is False
+        if message['type'] == 'diff':
+            parsed = message['message']
+            if is_mirror:
+                if parsed["diff_version"] == doc['diffs'].version:
+                    doc['diffs'].extend(parsed["diff"])
+                    cls.update_comments(doc, parsed["comments"])
+                else:
+                    # Some changes have been missed.
+                    cls.request_sync(doc)
+            cls.deliver_updates(
+                parsed,
+                doc['id'],
+                message['sender_id'],
+                message['user_id']
+            )
+        elif message['type'] == 'update_doc' and is_mirror:
+            cls.apply_changes(doc, message['changes'])
+        elif message['type'] == 'update_title' and is_mirror:
+            doc['title'] = message['title']
+
+    @classmethod
+    def receive_direct(cls, message):
+        # Messages for this process and its participants only.
+        if message['document_id'] not in cls.sessions:
+            return
+        doc = cls.sessions[message['document_id']]
+        if message['type'] == 'sync':
+            cls.apply_session_state(doc, message['state'], message['node'])
+            return
+        if message['session_id'] not in doc['participants']:
+            return
+        waiter = doc['participants'][message['session_id']]
+        if message['type'] == 'message':
+            try:
+                waiter.write_message(message['message'])
+            except WebSocketClosedError:
+                error("Error sending message", exc_info=True)
+        elif message['type'] == 'send_document':
+            waiter.send_document()
+
+    @classmethod
+    def local_participant_list(cls, document_id):
+        participant_list = []
+        for session_id, waiter in cls.sessions[
+            document_id
+        ]['participants'].items():
+            access_rights = waiter.user_info.access_rights
+            if access_rights not in CAN_COMMUNICATE:
+                continue
+            participant_list.append({
+                'session_id': session_id,
+                'id': waiter.user_info.user.id,
+                'name': waiter.user_info.user.readable_name,
+                'avatar': avatar_url(waiter.user_info.user, 80)
+            })
+        return participant_list
+
+    @classmethod
+    def send_participant_list(cls, document_id, notify=True):
         if document_id in DocumentWS.sessions:
-            participant_list = []
-            for session_id, waiter in cls.sessions[
-                document_id
-            ]['participants'].items():
-                access_rights = waiter.user_info.access_rights
-                if access_rights not in CAN_COMMUNICATE:
-                    continue
-                participant_list.append({
-                    'session_id': session_id,
-                    'id': waiter.user_info.user.id,
-                    'name': waiter.user_info.user.readable_name,
-                    'avatar': avatar_url(waiter.user_info.user, 80)
-                })
-            message = {
-                "participant_list": participant_list,
-                "type": 'connections'
-            }
-            DocumentWS.send_updates(message, document_id)
+            doc = cls.sessions[document_id]
+            cls.router.publish(document_id, {
+                'type': 'participants',
+                'count': len(doc['participants']),
+                'participants': cls.local_participant_list(document_id),
+                'notify': notify
+            })
+            if notify:
+                cls.deliver_participant_list(document_id)
+
+    @classmethod
+    def deliver_participant_list(cls, document_id):
+        participant_list = cls.local_participant_list(document_id)
+        for remote in cls.sessions[
+            document_id
+        ]['remote_participants'].values():
+            participant_list += remote['participants']
+        message = {
+            "participant_list": participant_list,
+            "type": 'connections'
+        }
+        cls.deliver_updates(message, document_id)
 
     @classmethod
     def send_updates(cls, message, document_id, sender_id=None, user_id=None):
-        info("sending message to %d waiters", len(cls.sessions[document_id]))
+        cls.router.publish(document_id, {
+            'type': 'message',
+            'message': message,
+            'sender_id': sender_id,
+            'user_id': user_id
+        })
+        cls.deliver_updates(message, document_id, sender_id, user_id)
+
+    @classmethod
+    def deliver_updates(cls, message, document_id, sender_id=None,
+                        user_id=None):
+        # Sends a message to the participants connected to this process.
+        # Participants either receive the full message, the message without
+        # comments or nothing. Each of these payloads is only encoded once
+        # (per framing).
+        info(
+            "sending message to %d waiters",
+            len(cls.sessions[document_id]['participants'])
+        )
+        payloads = dict()
         for waiter in cls.sessions[document_id]['participants'].values():
-            if waiter.id != sender_id:
-                access_rights = waiter.user_info.access_rights
-                if "comments" in message and len(message["comments"]) > 0:
-                    # Filter comments if needed
-                    if access_rights == 'read-without-comments':
-                        # The reader should not receive the comments update, so
-                        # we remove the comments from the copy of the message
-                        # sent to the reviewer. We still need to sned the rest
-                        # of the message as it may contain other diff
-                        # information.
-                        message = deepcopy(message)
-                        message['comments'] = []
-                    elif (
-                        access_rights == 'review' and
-                        user_id != waiter.user_info.user.id
-                    ):
-                        # The reviewer should not receive comments updates from
-                        # others than themselves, so we remove the comments
-                        # from the copy of the message sent to the reviewer
-                        # that are not from them. We still need to sned the
-                        # rest of the message as it may contain other diff
-                        # information.
-                        message = deepcopy(message)
-                        message['comments'] = []
-                elif (
-                    message['type'] in ["chat", "connections"] and
-                    access_rights not in CAN_COMMUNICATE
-                ):
-                    continue
-                elif (
-                    message['type'] == "selection_change" and
-                    access_rights not in CAN_COMMUNICATE and
-                    user_id != waiter.user_info.user.id
-                ):
+            if waiter.id == sender_id:
+                continue
+            if (
+                message['type'] == 'diff' and
+                getattr(waiter, 'held_messages', None) is not None
+            ):
+                # The document that is being sent to the participant will
+                # contain the diff.
+                continue
+            variant = cls.message_variant(message, waiter, user_id)
+            if variant is None:
+                continue
+            key = (variant, waiter.binary)
+            if key not in payloads:
+                if variant == 'without_comments':
+                    # Only the comments are replaced, so a shallow copy is
+                    # enough.
+                    payload = dict(message)
+                    payload['comments'] = []
+                else:
+                    payload = message
+                payloads[key] = cls.encode_message(payload, waiter.binary)
+                cls.broadcast_stats['payloads_encoded'] += 1
+                cls.broadcast_stats['bytes_encoded'] += len(payloads[key][0])
+            data, binary = payloads[key]
+            try:
+                waiter.write_message(data, binary)
+                cls.broadcast_stats['messages_sent'] += 1
+                cls.broadcast_stats['bytes_sent'] += len(data)
+            except WebSocketClosedError:
+                error("Error sending message", exc_info=True)
+
+    @staticmethod
+    def message_variant(message, waiter, user_id):
+        access_rights = waiter.user_info.access_rights
+        if "comments" in message and len(message["comments"]) > 0:
+            # Filter comments if needed
+            if access_rights == 'read-without-comments':
+                # The reader should not receive the comments update. We still
+                # need to send the rest of the message as it may contain other
+                # diff information.
+                return 'without_comments'
+            elif (
+                access_rights == 'review' and
+                user_id != waiter.user_info.user.id
+            ):
+                # The reviewer should not receive comments updates from others
+                # than themselves. We still need to send the rest of the
+                # message as it may contain other diff information.
+                return 'without_comments'
+        elif (
+            message['type'] in ["chat", "connections"] and
+            access_rights not in CAN_COMMUNICATE
+        ):
+            return None
+        elif (
+            message['type'] == "selection_change" and
+            access_rights not in CAN_COMMUNICATE and
+            user_id != waiter.user_info.user.id
+        ):
+            return None
+        return 'full'
+
+    @classmethod
+    def save_document(cls, document_id, all_have_left, changed_bytes=0):
+        if all_have_left:
+            # Write the document right away and close the session once it has
+            # been saved, unless someone has reconnected in the meantime.
+            cls.saver.write(
+                document_id,
+                True,
+                lambda: cls.release_session(document_id)
+            )
+        else:
+            cls.saver.mark_dirty(document_id, changed_bytes)
+
+    @classmethod
+    def release_session(cls, document_id):
+        if (
+            document_id in cls.sessions and
+            len(cls.sessions[document_id]['participants']) == 0 and
+            len(cls.sessions[document_id]['remote_participants']) == 0 and
+            document_id not in cls.saver.dirty
+        ):
+            cls.router.leave(document_id)
+            del cls.sessions[document_id]
+            document_info_cache.discard(document_id)
+            cls.journal.close(document_id)
+
+    @classmethod
+    def snapshot_written(cls, document_id, snapshot):
+        # Runs in the thread of the saver.
+        if snapshot['journal_segment'] is not None:
+            cls.journal.remove(document_id, snapshot['journal_segment'])
+
+    @classmethod
+    def replay_journal(cls, workers):
+        """
+        Saves the changes that are left in the journal by a server process
+        that ended before it could save them. Run in each worker before it
+        accepts connections. A worker replays its own files and those of
+        workers that no longer exist for the documents it owns. Reconnecting
+        clients can then catch up with the diffs instead of reloading the
+        document.
+        """
+        cls.journal.worker = workers.task_id
+        for worker in cls.journal.workers():
+            if worker != workers.task_id and worker < workers.count:
+                # Replayed by that worker.
+                continue
+            files = cls.journal.worker_files(worker)
+            for document_id, segments in sorted(files.items()):
+                if worker != workers.task_id and not workers.owns(document_id):
                     continue
                 try:
-                    waiter.write_message(message)
-                except WebSocketClosedError:
-                    error("Error sending message", exc_info=True)
+                    replayed = cls.replay_records(
+                        document_id,
+                        cls.journal.read(document_id, worker, segments)
+                    )
+                except Exception:
+                    error(
+                        'Error replaying the journal of document #%d',
+                        document_id,
+                        exc_info=True
+                    )
+                    cls.journal.set_aside(document_id, worker, segments)
+                    continue
+                cls.journal.discard(document_id, worker, segments)
+                info(
+                    'replayed %d diffs of document #%d',
+                    replayed,
+                    document_id
+                )
+
+    @classmethod
+    def replay_records(cls, document_id, records):
+        doc_db = Document.objects.heavy().filter(id=document_id).first()
+        if doc_db is None:
+            return 0
+        doc = {
+            'title': doc_db.title,
+            'comments': json_decode(doc_db.comments),
+            'comment_version': doc_db.comment_version
+        }
+        diff_version = doc_db.diff_version
+        steps = []
+        for record in records:
+            if 'title' in record:
+                doc['title'] = record['title']
+                continue
+            if record['diff_version'] < diff_version:
+                # Saved already.
+                continue
+            if record['diff_version'] > diff_version:
+                # Records are missing, so the rest cannot be applied.
+                break
+            for diff in record['diff']:
+                diff_version += 1
+                steps.append((diff_version, diff))
+            if record['comment_version'] == doc['comment_version']:
+                cls.update_comments(doc, record['comments'])
+        cls.saver.write_snapshot(document_id, {
+            'fields': {
+                'title': doc['title'],
+                'diff_version': diff_version,
+                'comment_version': doc['comment_version']
+            },
+            'json_fields': {
+                'comments': doc['comments']
+            },
+            'steps': steps,
+            'steps_since': doc_db.diff_version,
+            'keep_from': 0
+        })
+        return len(steps)
 
     @classmethod
-    def save_document(cls, document_id, all_have_left):
+    def serialize_document(cls, document_id, all_have_left):
+        if (
+            document_id not in cls.sessions or
+            not cls.sessions[document_id]['owner']
+        ):
+            # Only the process that owns a document saves it.
+            return None
         doc = cls.sessions[document_id]
-        doc_db = doc['db']
-        doc_db.title = doc['title']
-        doc_db.version = doc['version']
-        doc_db.diff_version = doc['diff_version']
-        doc_db.comment_version = doc['comment_version']
-        doc_db.contents = json_encode(doc['contents'])
-        doc_db.metadata = json_encode(doc['metadata'])
-        doc_db.settings = json_encode(doc['settings'])
         if all_have_left:
-            remaining_diffs = doc['diff_version'] - doc['version']
-            if remaining_diffs > 0:
-                doc['last_diffs'] = doc['last_diffs'][-remaining_diffs:]
-            else:
-                doc['last_diffs'] = []
-        doc_db.last_diffs = json_encode(doc['last_diffs'])
-        doc_db.comments = json_encode(doc['comments'])
-        print('saving document #' + str(doc_db.id))
-        print('version ' + str(doc_db.version))
-        doc_db.save()
+            # Only keep the diffs that are not part of the saved version.
+            doc['diffs'].enforce_capacity(0)
+        print('saving document #' + str(document_id))
+        print('version ' + str(doc['version']))
+        print(
+            'diff log: %d diffs, %d bytes' %
+            (len(doc['diffs']), doc['diffs'].memory_footprint())
+        )
+        diffs = doc['diffs']
+        # Only the steps that have been accepted since the last save are
+        # written.
+        steps_since = max(doc['saved_diff_version'], diffs.first_version)
+        if steps_since > diffs.version:
+            steps_since = diffs.first_version
+        steps = diffs.since(steps_since)
+        return {
+            # The journaled changes up to here are part of the snapshot.
+            'journal_segment': cls.journal.checkpoint(document_id),
+            'fields': {
+                'title': doc['title'],
+                'version': doc['version'],
+                'diff_version': diffs.version,
+                'comment_version': doc['comment_version']
+            },
+            # Encoded in the thread of the saver. These values are replaced
+            # when the session changes, never changed in place.
+            'json_fields': {
+                'contents': doc['contents'],
+                'metadata': doc['metadata'],
+                'settings': doc['settings'],
+                'comments': doc['comments']
+            },
+            'steps': [
+                (steps_since + index + 1, step)
+                for index, step in enumerate(steps)
+            ],
+            'steps_since': steps_since,
+            'keep_from': diffs.first_version
+        }
 
-    @classmethod
-    def save_all_docs(cls):
-        for document_id in cls.sessions:
-            cls.save_document(document_id, True)
 
-atexit.register(DocumentWS.save_all_docs)
+DocumentWS.saver = WriteBehindSaver(
+    DocumentWS.sessions,
+    DocumentWS.serialize_document,
+    written=DocumentWS.snapshot_written
+)
+DocumentWS.journal = SessionJournal()
+DocumentWS.router = SessionRouter(get_broker(), DocumentWS)
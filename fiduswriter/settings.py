@@ -21,6 +21,9 @@ SERVER_INFO = {
     'OJS_KEY': 'S5cr4T',
     # If websockets is running on a non-standard port, add it here:
     'WS_PORT': False,
+    # Whether the editor asks for documents and diffs to be sent as zlib
+    # compressed binary websocket frames. Do not combine with WS_COMPRESSION.
+    'WS_BINARY': False,
 }
 
 ADMINS = (
@@ -46,6 +49,13 @@ DATABASES = {
 # simultaneously
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 5000
 
+# Uploaded files are hashed while they are received, as images are stored
+# under the hash of their contents.
+FILE_UPLOAD_HANDLERS = [
+    'usermedia.helpers.uploads.HashingMemoryFileUploadHandler',
+    'usermedia.helpers.uploads.HashingTemporaryFileUploadHandler',
+]
+
 # Send emails to console.
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
@@ -264,6 +274,116 @@ AUTH_PROFILE_MODULE = "account.UserProfile"
 # locking
 LOCK_TIMEOUT = 600
 
+# Changes to documents that are open in the editor are saved in the background.
+# They are written to the database every DOC_SAVE_INTERVAL seconds or as soon
+# as more than DOC_SAVE_MAX_DIRTY_BYTES bytes of changes have been received.
+DOC_SAVE_INTERVAL = 10
+DOC_SAVE_MAX_DIRTY_BYTES = 1048576
+
+# Diffs, comments and titles accepted for open documents are appended to a
+# journal in this directory until they have been saved, so that they are not
+# lost if a server process ends before it can save them. Each worker process
+# has its own files, which are replayed when it starts. None disables the
+# journal. With DOC_JOURNAL_SYNC, every record is also synced to disk
+# (fsync), which protects against power failures but blocks the server for
+# the time it takes.
+DOC_JOURNAL_DIR = os.path.join(PROJECT_PATH, 'journal')
+DOC_JOURNAL_SYNC = False
+
+# The number of already saved diffs that are kept for each open document, so
+# that clients that reconnect can catch up without reloading the document.
+DOC_DIFF_LOG_CAPACITY = 1000
+
+# The message broker used to collaborate on documents across several server
+# processes. The LocalBroker only works within a single process. To run
+# several processes, use a server that speaks the Redis protocol, for example:
+# WS_BROKER = {
+#     'BACKEND': 'ws.brokers.RedisBroker',
+#     'HOST': 'localhost',
+#     'PORT': 6379,
+# }
+# or 'UNIX_SOCKET': '/var/run/redis/redis.sock' instead of HOST and PORT.
+WS_BROKER = {
+    'BACKEND': 'ws.brokers.LocalBroker',
+}
+
+# BibTeX files uploaded for import are parsed by this number of processes.
+BIBTEX_IMPORT_PROCESSES = 2
+
+# The maximal size of uploaded BibTeX files in bytes.
+BIBTEX_IMPORT_MAX_SIZE = 52428800
+
+# Imports that have not made progress for this number of seconds are marked
+# as failed, for example because the server process that ran them has ended.
+BIBTEX_IMPORT_TIMEOUT = 600
+
+# Seconds the serialized bibliographies and image libraries of users are kept
+# in the cache (see CACHES). As they are cached by version, this only limits
+# the memory used by libraries that are no longer requested.
+LIBRARY_CACHE_TIMEOUT = 86400
+
+# Seconds the access rights of a user to the documents of others are cached
+# for. They are always loaded once per request. The cache entry of a user is
+# deleted when their access rights change, but with a cache that is not shared
+# between server processes (see CACHES), other processes may use outdated
+# access rights for up to this time. 0 disables the cache.
+ACCESS_RIGHTS_CACHE_TIMEOUT = 0
+
+# Thumbnails of uploaded images are created by this number of background
+# threads per server process.
+THUMBNAIL_WORKERS = 2
+
+# The widths in pixels that scaled copies of images (derivatives) are created
+# in, and the maximal size in bytes of all derivatives together. The least
+# recently used derivatives are deleted when there are more.
+IMAGE_DERIVATIVE_WIDTHS = [150, 300, 600, 1200, 2400]
+IMAGE_DERIVATIVES_MAX_SIZE = 1073741824
+
+# The number of server processes started by runserver. They share the port.
+# The websocket connections of a document all go to the same process, which is
+# chosen by the document id. More than one process needs a broker that is
+# shared between processes (see WS_BROKER) and the autoreloader is not used.
+SERVER_WORKERS = 1
+
+# The addresses that may see which server process has which documents open at
+# /server-status/. In addition, the page is only shown to staff members who
+# are logged in.
+SERVER_STATUS_IPS = ['127.0.0.1', '::1']
+
+# Django views are run in a pool of this many threads per server process, so
+# that slow requests do not hold up the websocket connections. 0 runs them on
+# the event loop, one at a time.
+WSGI_THREADS = 8
+
+# The number of requests that may wait for a free thread. Further requests are
+# answered with 503 (Service Unavailable).
+WSGI_MAX_QUEUE = 64
+
+# Requests that take longer than this many seconds are logged as warnings.
+WSGI_SLOW_REQUEST = 2
+
+# The number of requests and the time spent per view are logged every this
+# many seconds. 0 disables the statistics.
+WSGI_STATS_INTERVAL = 300
+
+# The database queries of the document websockets (opening documents and
+# checking access rights) run in this many threads per server process.
+WS_DB_THREADS = 4
+
+# Seconds the user of a session or of Basic auth credentials is cached for when
+# a document websocket connects. Entries are checked against the password of
+# the user and deleted on logout, but with a cache that is not shared between
+# server processes (see CACHES), a session that has been logged out of may be
+# accepted by other processes for up to this time. 0 disables the cache.
+WS_AUTH_CACHE_TIMEOUT = 60
+
+# Compression of the document websocket with permessage-deflate. None disables
+# it. compression_level (1-9) trades CPU for bandwidth, mem_level (1-9) sets
+# the memory used by each connection's compressor. The window size is
+# negotiated with the browser. For example:
+# WS_COMPRESSION = {'compression_level': 6, 'mem_level': 5}
+WS_COMPRESSION = None
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
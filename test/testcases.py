@@ -45,7 +45,9 @@ class LiveTornadoThread(threading.Thread):
             for alias, conn in self.connections_override.items():
                 connections[alias] = conn
         try:
-            self.httpd = make_tornado_server()
+            # The views have to run in this thread to use the database
+            # connections of the main thread.
+            self.httpd = make_tornado_server(wsgi_threads=0)
 
             # Go through the list of possible ports, hoping that we can find
             # one that is free to use for the WSGI server.
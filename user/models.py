@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
 from django.contrib.auth.models import User
 
 
@@ -34,3 +35,50 @@ class TeamMember(models.Model):
 
     class Meta:
         unique_together = (("leader", "member"),)
+
+
+LIBRARY_CHOICES = (
+    ('bibliography', 'Bibliography'),
+    ('images', 'Images'),
+)
+
+
+# The version of the bibliography or the image library of a user. It is bumped
+# whenever an entry, an image or a category of the library is saved or
+# deleted, and the serialized libraries are cached by version (see
+# user.util.get_library_blobs).
+class LibraryVersion(models.Model):
+    owner = models.ForeignKey(User)
+    library = models.CharField(max_length=20, choices=LIBRARY_CHOICES)
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('owner', 'library'),)
+
+    @classmethod
+    def bump(cls, owner_id, library):
+        if cls.objects.filter(owner_id=owner_id, library=library).update(
+            version=F('version') + 1
+        ) > 0:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(owner_id=owner_id, library=library)
+        except IntegrityError:
+            # Created by another request in the meantime.
+            pass
+        cls.objects.filter(owner_id=owner_id, library=library).update(
+            version=F('version') + 1
+        )
+
+    @classmethod
+    def get_versions(cls, owner_ids, library):
+        """
+        Returns the versions of the libraries of several users by user id.
+        """
+        versions = dict((owner_id, 0) for owner_id in owner_ids)
+        versions.update(cls.objects.filter(
+            owner_id__in=owner_ids,
+            library=library
+        ).values_list('owner_id', 'version'))
+        return versions
@@ -0,0 +1,118 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import Client, TestCase
+
+from bibliography.helpers.bibtex_import import run_import
+from bibliography.models import BibImportJob, Entry, EntryCategory
+from bibliography.views import serialize_biblist
+from usermedia.models import Image, ImageCategory
+from usermedia.views import serialize_images
+from user.util import get_library_blobs
+
+
+class LibraryCacheTest(TestCase):
+
+    def setUp(self):
+        # Cached libraries of earlier tests may have the same owner id and
+        # version.
+        cache.clear()
+        self.user = User.objects.create_user('owner', 'owner@example.com')
+        self.client = Client(HTTP_HOST='localhost')
+        self.client.force_login(self.user)
+
+    def post(self, url, data):
+        response = self.client.post(
+            url,
+            data,
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertIn(response.status_code, [200, 201])
+
+    def biblist(self):
+        [blob] = get_library_blobs(
+            'bibliography',
+            [self.user.id],
+            serialize_biblist
+        )
+        return blob
+
+    def images(self):
+        [blob] = get_library_blobs(
+            'images',
+            [self.user.id],
+            serialize_images
+        )
+        return blob
+
+    def assertCached(self, library):
+        # The blob that is returned again without any changes comes from the
+        # cache, even if the database has been changed behind its back.
+        blob = library()
+        self.assertEqual(library(), blob)
+        return blob
+
+    def test_edit_entry(self):
+        entry = Entry.objects.create(
+            entry_owner=self.user,
+            entry_key='a',
+            fields=json.dumps({'title': 'Old'})
+        )
+        blob = self.assertCached(self.biblist)
+        Entry.objects.filter(id=entry.id).update(entry_key='b')
+        self.assertEqual(self.biblist(), blob)
+        self.post('/bibliography/save/', {
+            'bibs': json.dumps({entry.id: {
+                'entry_key': 'a',
+                'bib_type': 'book',
+                'entry_cat': '[]',
+                'fields': json.dumps({'title': 'New'})
+            }}),
+            'is_new': 'false'
+        })
+        self.assertNotEqual(self.biblist(), blob)
+        self.assertIn('New', self.biblist()[1])
+
+    def test_delete_entry_category(self):
+        category = EntryCategory.objects.create(
+            category_owner=self.user,
+            category_title='Category'
+        )
+        blob = self.assertCached(self.biblist)
+        self.assertIn('Category', blob[0])
+        self.post('/bibliography/delete_category/', {'ids[]': [category.id]})
+        self.assertEqual(self.biblist()[0], u'')
+
+    def test_bibtex_import(self):
+        blob = self.assertCached(self.biblist)
+        job = BibImportJob.objects.create(owner=self.user)
+        run_import(job, u'@book{key, title = {Imported}}')
+        self.assertEqual(job.status, 'done')
+        self.assertNotEqual(self.biblist(), blob)
+        self.assertIn('Imported', self.biblist()[1])
+
+    def test_delete_image(self):
+        # Image.save creates the thumbnail from the file.
+        Image.objects.bulk_create([Image(
+            title='Image',
+            uploader=self.user,
+            owner=self.user,
+            image='images/image.png',
+            file_type='image/png'
+        )])
+        image = Image.objects.get(owner=self.user)
+        blob = self.assertCached(self.images)
+        self.assertIn('Image', blob[1])
+        self.post('/usermedia/delete/', {'ids[]': [image.id]})
+        self.assertEqual(self.images()[1], u'')
+
+    def test_delete_image_category(self):
+        category = ImageCategory.objects.create(
+            category_owner=self.user,
+            category_title='Category'
+        )
+        blob = self.assertCached(self.images)
+        self.assertIn('Category', blob[0])
+        self.post('/usermedia/delete_category/', {'ids[]': [category.id]})
+        self.assertEqual(self.images()[0], u'')
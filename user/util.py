@@ -1,5 +1,11 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from avatar.models import Avatar
 from avatar.utils import get_primary_avatar, get_default_avatar_url
 
+from user.models import LibraryVersion
+
 
 def get_user_avatar_url(user):
     the_avatar = get_primary_avatar(user, 80)
@@ -8,3 +14,64 @@ def get_user_avatar_url(user):
     else:
         the_avatar = get_default_avatar_url()
     return the_avatar
+
+
+def get_user_avatar_urls(users, size=80):
+    """
+    Returns the avatar urls of several users by user id, using a single query.
+    """
+    avatars = dict()
+    for avatar in Avatar.objects.filter(user__in=users).order_by(
+        'user_id',
+        '-primary',
+        '-date_uploaded'
+    ):
+        # The primary or else newest avatar comes first for each user.
+        if avatar.user_id not in avatars:
+            avatars[avatar.user_id] = avatar
+    avatar_urls = dict()
+    for user in users:
+        if user.id in avatars:
+            the_avatar = avatars[user.id]
+            if not the_avatar.thumbnail_exists(size):
+                the_avatar.create_thumbnail(size)
+            avatar_urls[user.id] = the_avatar.avatar_url(size)
+        else:
+            avatar_urls[user.id] = get_default_avatar_url()
+    return avatar_urls
+
+
+def get_library_blobs(library, owner_ids, serialize):
+    """
+    Returns the serialized libraries (bibliography or images) of several
+    users. serialize(owner_id) serializes the library of one user and is only
+    called if it is not cached at the current version of the library, so in
+    the common case only the versions are read from the database.
+    """
+    versions = LibraryVersion.get_versions(owner_ids, library)
+    keys = dict(
+        (owner_id, 'library:%s:%d:%d' % (library, owner_id, version))
+        for owner_id, version in versions.items()
+    )
+    blobs = cache.get_many(list(keys.values()))
+    for owner_id in owner_ids:
+        key = keys[owner_id]
+        if key not in blobs:
+            # The version has been read before the library, so the cached
+            # library is at least as new as the version.
+            blobs[key] = serialize(owner_id)
+            cache.set(key, blobs[key], settings.LIBRARY_CACHE_TIMEOUT)
+    return [blobs[keys[owner_id]] for owner_id in owner_ids]
+
+
+def library_json(blobs, names):
+    """
+    Concatenates serialized libraries into a JSON object. Each library is a
+    tuple of JSON lists without brackets, which are joined to the lists named
+    by names.
+    """
+    return u'{%s}' % u', '.join(
+        u'"%s": [%s]' % (name, u','.join(
+            blob[index] for blob in blobs if blob[index] != u''
+        )) for index, name in enumerate(names)
+    )
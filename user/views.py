@@ -9,6 +9,7 @@ from django.contrib.auth.models import User
 from .forms import UserForm, TeamMemberForm
 from . import util as userutil
 from document.models import AccessRight
+from document.helpers.document_info import document_info_cache
 
 from allauth.account.models import EmailAddress
 from allauth.account import signals
@@ -366,6 +367,7 @@ def add_team_member_js(request):
                 team_member_form = TeamMemberForm(form_data)
                 if team_member_form.is_valid():
                     team_member_form.save()
+                    document_info_cache.invalidate_owner(request.user.id)
                     the_avatar = userutil.get_user_avatar_url(new_member)
                     response['member'] = {
                         'id': new_member.pk,
@@ -435,6 +437,7 @@ def remove_team_member_js(request):
                 member_id=former_member
             )[0]
             team_member_object_instance.delete()
+        document_info_cache.invalidate_owner(request.user.id)
         status = 200
     return JsonResponse(
         response,
@@ -0,0 +1,153 @@
+import os
+from builtins import range
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction, IntegrityError
+from django.db.models import Sum
+from django.utils import timezone
+
+from usermedia.models import ImageDerivative
+
+# The PIL format and content type of the formats derivatives can be rendered
+# in.
+DERIVATIVE_FORMATS = {
+    'jpeg': ('jpeg', 'image/jpeg'),
+    'png': ('png', 'image/png'),
+}
+
+# The last use of a derivative is only saved if the previous one was longer
+# ago than this, so that frequently used derivatives do not cost a write each
+# time.
+LAST_USED_RESOLUTION = timedelta(minutes=10)
+
+
+def derivative_width(width):
+    """
+    Returns the smallest width of settings.IMAGE_DERIVATIVE_WIDTHS that is at
+    least width, so that only a bounded number of derivatives is created per
+    image.
+    """
+    widths = sorted(settings.IMAGE_DERIVATIVE_WIDTHS)
+    for allowed_width in widths:
+        if allowed_width >= width:
+            return allowed_width
+    return widths[-1]
+
+
+def render_derivative(image, width, file_format):
+    """
+    Returns the image scaled to width (but never enlarged) as bytes in
+    file_format.
+    """
+    from PIL import Image as PilImage
+
+    image.image.open('rb')
+    try:
+        pil_image = PilImage.open(image.image)
+        src_width, src_height = pil_image.size
+        width = min(width, src_width)
+        height = max(int(round(float(src_height) * width / src_width)), 1)
+        # JPEG images are decoded at the smallest scale (down to 1/8) that is
+        # still at least as large as the derivative.
+        pil_image.draft(pil_image.mode, (width, height))
+        if file_format == 'jpeg' and pil_image.mode not in ('RGB', 'L'):
+            pil_image = pil_image.convert('RGB')
+        elif pil_image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+            pil_image = pil_image.convert('RGBA')
+        pil_image = pil_image.resize((width, height), PilImage.ANTIALIAS)
+        data = BytesIO()
+        if file_format == 'jpeg':
+            pil_image.save(data, 'jpeg', quality=85, optimize=True)
+        else:
+            pil_image.save(data, 'png', optimize=True)
+    finally:
+        image.image.close()
+    return data.getvalue()
+
+
+def get_derivative(image, width, file_format):
+    """
+    Returns the ImageDerivative of image in width (one of
+    settings.IMAGE_DERIVATIVE_WIDTHS) and file_format, which is rendered if
+    it does not exist yet.
+    """
+    now = timezone.now()
+    # Derivatives are shared by images with the same file.
+    derivative = ImageDerivative.objects.filter(
+        image__image=image.image.name,
+        width=width,
+        file_format=file_format
+    ).first()
+    if derivative is not None:
+        if derivative.last_used < now - LAST_USED_RESOLUTION:
+            ImageDerivative.objects.filter(id=derivative.id).update(
+                last_used=now
+            )
+        return derivative
+    data = render_derivative(image, width, file_format)
+    derivative = ImageDerivative(
+        image=image,
+        width=width,
+        file_format=file_format,
+        size=len(data),
+        last_used=now
+    )
+    derivative.file.save(
+        '%s_%d.%s' % (
+            os.path.splitext(os.path.split(image.image.name)[-1])[0],
+            width,
+            file_format
+        ),
+        ContentFile(data),
+        save=False
+    )
+    try:
+        with transaction.atomic():
+            derivative.save()
+    except IntegrityError:
+        # The same derivative has been rendered by another request.
+        derivative.file.delete(save=False)
+        return ImageDerivative.objects.get(
+            image=image,
+            width=width,
+            file_format=file_format
+        )
+    evict_derivatives()
+    return derivative
+
+
+def evict_derivatives():
+    """
+    Deletes the least recently used derivatives while all derivatives take up
+    more than settings.IMAGE_DERIVATIVES_MAX_SIZE bytes. A tenth more than
+    necessary is deleted, so that this does not happen with every new
+    derivative.
+    """
+    total_size = ImageDerivative.objects.aggregate(
+        Sum('size'))['size__sum'] or 0
+    if total_size <= settings.IMAGE_DERIVATIVES_MAX_SIZE:
+        return
+    target_size = settings.IMAGE_DERIVATIVES_MAX_SIZE * 9 // 10
+    evicted_ids = []
+    for derivative_id, size in ImageDerivative.objects.order_by(
+        'last_used'
+    ).values_list('id', 'size').iterator():
+        if total_size <= target_size:
+            break
+        evicted_ids.append(derivative_id)
+        total_size -= size
+    for index in range(0, len(evicted_ids), 100):
+        # The files are deleted by the post_delete signal.
+        ImageDerivative.objects.filter(
+            id__in=evicted_ids[index:index + 100]
+        ).delete()
+
+
+def discard_derivatives(image):
+    """
+    Deletes the derivatives of an image whose file has been replaced.
+    """
+    ImageDerivative.objects.filter(image=image).delete()
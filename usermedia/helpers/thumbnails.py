@@ -0,0 +1,72 @@
+import threading
+from logging import error
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from usermedia.models import Image
+from user.models import LibraryVersion
+
+thumbnail_workers = None
+# Views may upload images from several threads at once.
+thumbnail_workers_lock = threading.Lock()
+
+
+def start_thumbnail(image):
+    """
+    Creates the thumbnail of a newly uploaded image in a background thread of
+    the server process once the image has been committed to the database.
+    """
+    global thumbnail_workers
+    with thumbnail_workers_lock:
+        if thumbnail_workers is None:
+            thumbnail_workers = ThreadPoolExecutor(settings.THUMBNAIL_WORKERS)
+    image_id = image.id
+    transaction.on_commit(
+        lambda: thumbnail_workers.submit(run_background_thumbnail, image_id)
+    )
+
+
+def run_background_thumbnail(image_id):
+    try:
+        create_thumbnail(image_id)
+    finally:
+        # The thread has its own database connection.
+        connection.close()
+
+
+def create_thumbnail(image_id):
+    """
+    Creates the thumbnail of the image with the id image_id if it is pending.
+    It is used for all images with the same file whose thumbnail is pending.
+    Only the thumbnail fields are written, so changes made to the images in
+    the meantime are kept, unless the file has been replaced.
+    """
+    image = Image.objects.filter(
+        id=image_id,
+        thumbnail_status='pending'
+    ).first()
+    if image is None:
+        return
+    images = Image.objects.filter(
+        image=image.image.name,
+        thumbnail_status='pending'
+    )
+    owner_ids = set(images.values_list('owner_id', flat=True))
+    try:
+        image.create_thumbnail()
+    except Exception:
+        error('Could not create the thumbnail of image %d', image_id,
+              exc_info=True)
+        images.update(thumbnail_status='failed', updated=timezone.now())
+    else:
+        images.update(
+            thumbnail=image.thumbnail.name,
+            thumbnail_status='done',
+            updated=timezone.now()
+        )
+    for owner_id in owner_ids:
+        if owner_id is not None:
+            LibraryVersion.bump(owner_id, 'images')
@@ -0,0 +1,55 @@
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, \
+    TemporaryFileUploadHandler
+
+
+# The upload handlers of Django that also compute the SHA-256 hash of each
+# uploaded file while it is received, so that it does not have to be read
+# again to be stored under its hash (see usermedia.models.get_file_path). The
+# hash is set as the sha256 attribute of the uploaded file.
+class HashingMemoryFileUploadHandler(MemoryFileUploadHandler):
+
+    def new_file(self, *args, **kwargs):
+        # new_file of the superclass raises StopFutureHandlers if the file is
+        # kept in memory.
+        self.content_hash = hashlib.sha256()
+        super(HashingMemoryFileUploadHandler, self).new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        # Files too large to be kept in memory are passed on to the next
+        # handler, which hashes them.
+        if self.activated:
+            self.content_hash.update(raw_data)
+        return super(HashingMemoryFileUploadHandler, self).receive_data_chunk(
+            raw_data,
+            start
+        )
+
+    def file_complete(self, file_size):
+        upload = super(HashingMemoryFileUploadHandler, self).file_complete(
+            file_size)
+        if upload is not None:
+            upload.sha256 = self.content_hash.hexdigest()
+        return upload
+
+
+class HashingTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+
+    def new_file(self, *args, **kwargs):
+        self.content_hash = hashlib.sha256()
+        super(HashingTemporaryFileUploadHandler, self).new_file(
+            *args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.content_hash.update(raw_data)
+        return super(
+            HashingTemporaryFileUploadHandler,
+            self
+        ).receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        upload = super(HashingTemporaryFileUploadHandler, self).file_complete(
+            file_size)
+        upload.sha256 = self.content_hash.hexdigest()
+        return upload
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from usermedia.helpers.thumbnails import create_thumbnail
+from usermedia.models import Image
+
+
+class Command(BaseCommand):
+    help = (
+        'Create the thumbnails that are still pending, for example because '
+        'the server was stopped before they were created.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--failed',
+            action='store_true',
+            help='Also retry the thumbnails that could not be created.'
+        )
+
+    def handle(self, *args, **options):
+        images = Image.objects.filter(thumbnail_status='pending')
+        if options['failed']:
+            Image.objects.filter(thumbnail_status='failed').update(
+                thumbnail_status='pending'
+            )
+        image_ids = list(images.values_list('id', flat=True))
+        for image_id in image_ids:
+            create_thumbnail(image_id)
+        self.stdout.write('Processed %d images, %d failed' % (
+            len(image_ids),
+            Image.objects.filter(
+                id__in=image_ids,
+                thumbnail_status='failed'
+            ).count()
+        ))
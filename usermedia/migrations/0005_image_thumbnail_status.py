@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 22:13
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usermedia', '0004_auto_20160218_2250'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='thumbnail_status',
+            field=models.CharField(choices=[(b'pending', b'Pending'), (b'done', b'Done'), (b'failed', b'Failed')], default=b'done', max_length=10),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 22:14
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usermedia', '0005_image_thumbnail_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageDerivative',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('width', models.PositiveIntegerField()),
+                ('file_format', models.CharField(max_length=4)),
+                ('file', models.FileField(max_length=500, upload_to=b'image_derivatives')),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('last_used', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='derivatives', to='usermedia.Image')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='imagederivative',
+            unique_together=set([('image', 'width', 'file_format')]),
+        ),
+    ]
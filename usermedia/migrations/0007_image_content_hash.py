@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 22:16
+from __future__ import unicode_literals
+import hashlib
+
+from django.db import migrations, models
+import usermedia.models
+
+
+def set_checksums(apps, schema_editor):
+    # We can't import the model directly as it may be a newer
+    # version than this migration expects. We use the historical version.
+    # The files of existing images are left where they are, only their
+    # checksums are replaced by content hashes.
+    Image = apps.get_model("usermedia", "Image")
+    for image in Image.objects.all().iterator():
+        if not image.image:
+            continue
+        content_hash = hashlib.sha256()
+        try:
+            image.image.open('rb')
+        except IOError:
+            continue
+        for chunk in image.image.chunks():
+            content_hash.update(chunk)
+        image.image.close()
+        image.checksum = int(content_hash.hexdigest()[:13], 16)
+        image.save(update_fields=['checksum'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usermedia', '0006_imagederivative'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.FileField(db_index=True, upload_to=usermedia.models.get_file_path),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='thumbnail',
+            field=models.ImageField(blank=True, db_index=True, max_length=500, null=True, upload_to=b'image_thumbnails'),
+        ),
+        migrations.RunPython(set_checksums, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 22:18
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def set_categories(apps, schema_editor):
+    # We can't import the model directly as it may be a newer
+    # version than this migration expects. We use the historical version.
+    Image = apps.get_model("usermedia", "Image")
+    ImageCategory = apps.get_model("usermedia", "ImageCategory")
+    Membership = Image.categories.through
+    category_owners = dict(
+        ImageCategory.objects.values_list('id', 'category_owner_id'))
+    memberships = []
+    for image_id, owner_id, image_cat in Image.objects.values_list(
+        'id',
+        'owner_id',
+        'image_cat'
+    ).iterator():
+        for category_id in set(image_cat.split(',')):
+            if (
+                category_id.isdigit() and
+                category_owners.get(int(category_id)) == owner_id
+            ):
+                memberships.append(Membership(
+                    image_id=image_id,
+                    imagecategory_id=int(category_id)
+                ))
+    Membership.objects.bulk_create(memberships, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('usermedia', '0007_image_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='categories',
+            field=models.ManyToManyField(blank=True, related_name='images', to='usermedia.ImageCategory'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='image',
+            index_together=set([('owner', 'updated')]),
+        ),
+        migrations.RunPython(set_categories, migrations.RunPython.noop),
+    ]
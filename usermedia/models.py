@@ -1,19 +1,51 @@
+import hashlib
 import os
-import uuid
 
+from django.core.files.storage import default_storage
 from django.db import models
 from django.contrib.auth.models import User
 from django.db import IntegrityError
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 
 ALLOWED_FILETYPES = ['image/jpeg', 'image/png', 'image/svg+xml']
 ALLOWED_EXTENSIONS = ['jpeg', 'jpg', 'png', 'svg']
+# The PIL format and file extension of the thumbnails of the file types that
+# thumbnails are created for.
+THUMBNAIL_FILETYPES = {
+    'image/jpeg': ('jpeg', 'jpg'),
+    'image/png': ('png', 'png'),
+}
 
+THUMBNAIL_STATUS_CHOICES = (
+    ('pending', 'Pending'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+)
 
+
+def file_sha256(upload):
+    """
+    Returns the SHA-256 hash of an uploaded file as hex. It has usually been
+    computed while the file was received (see usermedia.helpers.uploads).
+    """
+    if getattr(upload, 'sha256', None) is None:
+        content_hash = hashlib.sha256()
+        for chunk in upload.chunks():
+            content_hash.update(chunk)
+        upload.seek(0)
+        upload.sha256 = content_hash.hexdigest()
+    return upload.sha256
+
+
+# Uploaded files are stored under their content hash, so that a file that is
+# uploaded several times is only stored once.
 def get_file_path(instance, filename):
     ext = filename.split('.')[-1].lower()
     if ext not in ALLOWED_EXTENSIONS:
         raise IntegrityError
-    filename = "%s.%s" % (uuid.uuid4(), ext)
+    filename = "%s.%s" % (file_sha256(instance.image.file), ext)
     return os.path.join('images', filename)
 
 
@@ -26,17 +58,36 @@ class Image(models.Model):
         blank=True,
         null=True)
     added = models.DateTimeField(auto_now_add=True)
-    image = models.FileField(upload_to=get_file_path)
+    image = models.FileField(upload_to=get_file_path, db_index=True)
     thumbnail = models.ImageField(
         upload_to='image_thumbnails',
         max_length=500,
         blank=True,
-        null=True)
+        null=True,
+        db_index=True)
     image_cat = models.CharField(max_length=255, default='')
     file_type = models.CharField(max_length=20, blank=True, null=True)
     height = models.IntegerField(blank=True, null=True)
     width = models.IntegerField(blank=True, null=True)
+    # The first 52 bits of the SHA-256 hash of the file, which are exact as
+    # JavaScript numbers.
     checksum = models.BigIntegerField(default=0)
+    # Whether the thumbnail is still to be created in the background.
+    thumbnail_status = models.CharField(
+        max_length=10,
+        choices=THUMBNAIL_STATUS_CHOICES,
+        default='done'
+    )
+    updated = models.DateTimeField(auto_now=True)
+    # The categories in image_cat, kept in sync on save.
+    categories = models.ManyToManyField(
+        'ImageCategory',
+        blank=True,
+        related_name='images'
+    )
+
+    class Meta:
+        index_together = (('owner', 'updated'),)
 
     def __unicode__(self):
         if len(self.title) > 0:
@@ -44,16 +95,29 @@ class Image(models.Model):
         else:
             return str(self.pk)
 
-    def create_checksum(self):
+    def store_file(self):
+        # If a newly uploaded file is stored already, the stored file is used
+        # along with the dimensions and thumbnail of an image that uses it.
         if not self.image:
             return
-        if self.checksum == 0:
-            from time import time
-            if hasattr(self.image.file, 'size'):
-                self.checksum = int(
-                    str(self.image.file.size) + str(time()).split('.')[0])
-            else:
-                self.checksum = time()
+        if not hasattr(self.image.file, 'content_type'):
+            return
+        name = get_file_path(self, self.image.name)
+        self.checksum = int(file_sha256(self.image.file)[:13], 16)
+        if not default_storage.exists(name):
+            self.read_dimensions()
+            return
+        duplicate = Image.objects.filter(image=name).exclude(
+            pk=self.pk).first()
+        if duplicate is None:
+            self.read_dimensions()
+        else:
+            self.file_type = duplicate.file_type
+            self.width = duplicate.width
+            self.height = duplicate.height
+            self.thumbnail = duplicate.thumbnail.name
+            self.thumbnail_status = duplicate.thumbnail_status
+        self.image = name
 
     def check_filetype(self):
         if not self.image:
@@ -64,105 +128,149 @@ class Image(models.Model):
         if self.image.file.content_type not in ALLOWED_FILETYPES:
             raise IntegrityError
 
+    def read_dimensions(self):
+        # Only the header of a newly uploaded image is read here. The
+        # thumbnail is created in the background afterward (see
+        # usermedia.helpers.thumbnails).
+        if not self.image:
+            return
+        if not hasattr(self.image.file, 'content_type'):
+            return
+
+        from PIL import Image as PilImage
+
+        self.file_type = self.image.file.content_type
+        if self.file_type not in THUMBNAIL_FILETYPES:
+            self.thumbnail_status = 'done'
+            return
+        image = PilImage.open(self.image.file)
+        self.width, self.height = image.size
+        self.image.file.seek(0)
+        self.thumbnail_status = 'pending'
+
     def create_thumbnail(self):
         # original code for this method came from
         # http://snipt.net/danfreak/generate-thumbnails-in-django-with-pil/
 
         # If there is no image associated with this.
         # do not create thumbnail
-        if not self.image:
-            return
-        if not hasattr(self.image.file, 'content_type'):
+        if not self.image or self.file_type not in THUMBNAIL_FILETYPES:
             return
 
         from PIL import Image as PilImage
-        from cStringIO import StringIO
-        from django.core.files.uploadedfile import SimpleUploadedFile
+        from io import BytesIO
+        from django.core.files.base import ContentFile
         import os
 
-        # Set our max thumbnail size in a tuple (max width, max height)
-        # THUMBNAIL_SIZE = (170,200)
+        PIL_TYPE, FILE_EXTENSION = THUMBNAIL_FILETYPES[self.file_type]
 
-        DJANGO_TYPE = self.image.file.content_type
+        # Open original photo which we want to thumbnail using PIL's Image
+        self.image.open('rb')
+        try:
+            image = PilImage.open(self.image)
 
-        if DJANGO_TYPE == 'image/jpeg':
-            PIL_TYPE = 'jpeg'
-            FILE_EXTENSION = 'jpg'
-            self.file_type = DJANGO_TYPE
-        elif DJANGO_TYPE == 'image/png':
-            PIL_TYPE = 'png'
-            FILE_EXTENSION = 'png'
-            self.file_type = DJANGO_TYPE
-        else:
-            self.file_type = DJANGO_TYPE
-            return
+            # cropping the thumbnail to exactly 60 x 60 px
+            dst_width = dst_height = 60
 
-        # Open original photo which we want to thumbnail using PIL's Image
-        image = PilImage.open(StringIO(self.image.read()))
+            # JPEG images are decoded at the smallest scale (down to 1/8)
+            # that is still larger than the thumbnail, which takes a
+            # fraction of the time and memory of decoding the full image.
+            image.draft(image.mode, (dst_width, dst_height))
+            src_width, src_height = image.size
 
-        self.width, self.height = image.size
+            if src_width < src_height:
+                crop_width = crop_height = src_width
+                x_offset = 0
+                y_offset = int(float(src_height - crop_height) / 2)
+            else:
+                crop_width = crop_height = src_height
+                x_offset = int(float(src_width - crop_width) / 2)
+                y_offset = 0
 
-        # cropping the thumbnail to exactly 60 x 60 px
-        src_width, src_height = image.size
-        dst_width = dst_height = 60
+            image = image.crop(
+                (x_offset,
+                 y_offset,
+                 x_offset +
+                 int(crop_width),
+                    y_offset +
+                    int(crop_height)))
 
-        if src_width < src_height:
-            crop_width = crop_height = src_width
-            x_offset = 0
-            y_offset = int(float(src_height - crop_height) / 2)
-        else:
-            crop_width = crop_height = src_height
-            x_offset = int(float(src_width - crop_width) / 2)
-            y_offset = 0
-
-        image = image.crop(
-            (x_offset,
-             y_offset,
-             x_offset +
-             int(crop_width),
-                y_offset +
-                int(crop_height)))
-
-        # Convert to RGB if necessary
-        # Thanks to Limodou on DjangoSnippets.org
-        # http://www.djangosnippets.org/snippets/20/
-        #
-        # I commented this part since it messes up my png files
-        #
-        # if image.mode not in ('L', 'RGB'):
-        #    image = image.convert('RGB')
-
-        # We use our PIL Image object to create the thumbnail, which already
-        # has a thumbnail() convenience method that contrains proportions.
-        # Additionally, we use Image.ANTIALIAS to make the image look better.
-        # Without antialiasing the image pattern artifacts may result.
-        image.thumbnail((dst_width, dst_height), PilImage.ANTIALIAS)
-
-        # Save the thumbnail
-        temp_handle = StringIO()
-        image.save(temp_handle, PIL_TYPE)
-        temp_handle.seek(0)
-
-        # Save image to a SimpleUploadedFile which can be saved into
-        # ImageField
-        suf = SimpleUploadedFile(os.path.split(
-            self.image.name)[-1], temp_handle.read(), content_type=DJANGO_TYPE)
-        # Save SimpleUploadedFile into image field
+            # We use our PIL Image object to create the thumbnail, which
+            # already has a thumbnail() convenience method that contrains
+            # proportions. Additionally, we use Image.ANTIALIAS to make the
+            # image look better. Without antialiasing the image pattern
+            # artifacts may result.
+            image.thumbnail((dst_width, dst_height), PilImage.ANTIALIAS)
+
+            # Save the thumbnail
+            temp_handle = BytesIO()
+            image.save(temp_handle, PIL_TYPE)
+        finally:
+            self.image.close()
+
+        # Save the thumbnail into the ImageField
         self.thumbnail.save(
             '%s_thumbnail.%s' %
             (os.path.splitext(
-                suf.name)[0],
+                os.path.split(self.image.name)[-1])[0],
                 FILE_EXTENSION),
-            suf,
+            ContentFile(temp_handle.getvalue()),
             save=False)
 
     def save(self):
-        # create a thumbnail
-        self.create_checksum()
         self.check_filetype()
-        self.create_thumbnail()
+        self.store_file()
 
         super(Image, self).save()
+        self.update_categories()
+
+    def update_categories(self):
+        category_ids = [
+            int(category_id) for category_id in self.image_cat.split(',')
+            if category_id.isdigit()
+        ]
+        self.categories.set(ImageCategory.objects.filter(
+            id__in=category_ids,
+            category_owner_id=self.owner_id
+        ))
+
+
+# A copy of an image scaled to one of settings.IMAGE_DERIVATIVE_WIDTHS,
+# created on demand. The least recently used derivatives are deleted when they
+# take up more than settings.IMAGE_DERIVATIVES_MAX_SIZE bytes (see
+# usermedia.helpers.derivatives).
+class ImageDerivative(models.Model):
+    image = models.ForeignKey(Image, related_name='derivatives')
+    width = models.PositiveIntegerField()
+    file_format = models.CharField(max_length=4)
+    file = models.FileField(upload_to='image_derivatives', max_length=500)
+    size = models.PositiveIntegerField(default=0)  # of the file in bytes
+    last_used = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        unique_together = (('image', 'width', 'file_format'),)
+
+    def __unicode__(self):
+        return self.file.name
+
+
+@receiver(post_delete, sender=Image)
+def delete_image_files(sender, instance, **kwargs):
+    # Files are shared by all images with the same contents, so they are only
+    # deleted with the last image that uses them.
+    if instance.image and not Image.objects.filter(
+        image=instance.image.name
+    ).exists():
+        instance.image.delete(save=False)
+    if instance.thumbnail and not Image.objects.filter(
+        thumbnail=instance.thumbnail.name
+    ).exists():
+        instance.thumbnail.delete(save=False)
+
+
+@receiver(post_delete, sender=ImageDerivative)
+def delete_derivative_file(sender, instance, **kwargs):
+    instance.file.delete(save=False)
 
 
 # category
@@ -81,6 +81,17 @@ export class ImageDB {
         })
     }
 
+    /* The url of a copy of the image that is scaled to at least width pixels
+    (if the image is that large), or of the image itself if the server cannot
+    scale it. */
+    derivativeUrl(id, width) {
+        let image = this.db[id]
+        if (['image/jpeg', 'image/png'].indexOf(image.file_type) === -1) {
+            return image.image
+        }
+        return `/usermedia/derivative/${id}_${width}.${image.file_type.split('/')[1]}`
+    }
+
     displayCreateImageError(errors) {
         let noError = true
         for (let eKey in errors) {
@@ -5,7 +5,14 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
-from django.test import TestCase
+import datetime
+import json
+
+from django.contrib.auth.models import User
+from django.test import Client, TestCase
+from django.utils import timezone
+
+from usermedia.models import Image
 
 
 class SimpleTest(TestCase):
@@ -14,3 +21,75 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class ImagePageTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com')
+        self.client = Client(HTTP_HOST='localhost')
+        self.client.force_login(self.user)
+        start = timezone.now() - datetime.timedelta(hours=1)
+        Image.objects.bulk_create([
+            Image(
+                title=title,
+                uploader=self.user,
+                owner=self.user,
+                image='images/%s.png' % title,
+                file_type='image/png'
+            ) for title in 'abcde'
+        ])
+        for index, image in enumerate(Image.objects.order_by('id')):
+            Image.objects.filter(id=image.id).update(
+                updated=start + datetime.timedelta(seconds=index)
+            )
+
+    def post(self, data):
+        data = dict(data, owner_id=0)
+        return self.client.post(
+            '/usermedia/images/',
+            data,
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+
+    def page(self, cursor=None):
+        data = {'page_size': 2}
+        if cursor is not None:
+            data['cursor'] = cursor
+        response = self.post(data)
+        self.assertEqual(response.status_code, 200)
+        response = json.loads(response.content)
+        return (
+            [image['title'] for image in response['images']],
+            response['next_cursor']
+        )
+
+    def test_update_while_paging(self):
+        titles, cursor = self.page()
+        self.assertEqual(titles, ['a', 'b'])
+        # An image that has been received and one that has not are changed
+        # before the next page is requested. Both are sent again at the end.
+        for title in 'bd':
+            Image.objects.filter(title=title).update(
+                title=title.upper(),
+                updated=timezone.now()
+            )
+        received = titles
+        while cursor is not None:
+            titles, cursor = self.page(cursor)
+            received += titles
+        self.assertEqual(received, ['a', 'b', 'c', 'e', 'B', 'D'])
+
+    def test_invalid_parameters(self):
+        for data in [
+            {'page_size': 'all'},
+            {'page_size': 0},
+            {'page_size': 2, 'category': 'x'},
+            {'page_size': 2, 'updated_since': 'yesterday'},
+            {'page_size': 2, 'updated_since': '1e30'},
+            {'page_size': 2, 'cursor': 'abc'},
+            {'page_size': 2, 'cursor': 'yesterday_5'},
+            {'page_size': 2, 'cursor': '2017-13-45T00:00:00_5'},
+            {'page_size': 2, 'cursor': '2017-01-01T00:00:00_x'},
+        ]:
+            self.assertEqual(self.post(data).status_code, 400, data)
@@ -7,6 +7,12 @@ urlpatterns = [
     url('^save/$', views.save_js, name='save_js'),
     url('^delete/$', views.delete_js, name='delete_js'),
     url('^images/$', views.images_js, name='images_js'),
+    url(
+        r'^derivative/(?P<image_id>\d+)_(?P<width>\d+)\.'
+        r'(?P<file_format>jpeg|png)$',
+        views.derivative,
+        name='derivative'
+    ),
     url('^save_category/$', views.save_category_js, name='save_category_js'),
     url(
         '^delete_category/$',
@@ -1,16 +1,30 @@
+import datetime
+import json
+import time
+from collections import OrderedDict
 from time import mktime
 
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.template.context_processors import csrf
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, Http404, \
+    HttpResponseForbidden, HttpResponseRedirect
 from django.core.serializers.python import Serializer
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.translation import ugettext as _
 
-from document.models import AccessRight
+from document.helpers.access_rights import check_access_rights
 from usermedia.models import Image, ImageCategory
+from usermedia.helpers.thumbnails import start_thumbnail
+from usermedia.helpers.derivatives import DERIVATIVE_FORMATS, \
+    derivative_width, get_derivative, discard_derivatives
+from user.models import LibraryVersion
+from user.util import get_library_blobs, library_json
 
-from .models import ALLOWED_FILETYPES
+from .models import ALLOWED_FILETYPES, THUMBNAIL_FILETYPES
 
 
 class SimpleSerializer(Serializer):
@@ -29,6 +43,55 @@ def index(request):
     return render(request, 'usermedia/index.html', response)
 
 
+# The fields of images that are sent to the client.
+IMAGE_FIELDS = (
+    'id',
+    'title',
+    'image',
+    'thumbnail',
+    'file_type',
+    'added',
+    'checksum',
+    'image_cat',
+    'thumbnail_status',
+    'width',
+    'height'
+)
+
+# Number of images returned per page by images_js at most.
+IMAGES_MAX_PAGE_SIZE = 500
+
+
+def image_values(image):
+    values = dict((field, getattr(image, field)) for field in IMAGE_FIELDS)
+    values['image'] = image.image.name
+    values['thumbnail'] = image.thumbnail.name
+    return values
+
+
+# Serializes the IMAGE_FIELDS values of an image. The urls are created from
+# the file names without instantiating the files. thumbnail_status is
+# 'pending' while the thumbnail is being created in the background and
+# 'failed' if it could not be created.
+def serialize_image(values):
+    field_obj = {
+        'pk': values['id'],
+        'title': values['title'],
+        'image': default_storage.url(values['image']),
+        'file_type': values['file_type'],
+        'added': mktime(values['added'].timetuple()) * 1000,
+        'checksum': values['checksum'],
+        'cats': values['image_cat'].split(','),
+        'thumbnail_status': values['thumbnail_status']
+    }
+    if values['thumbnail']:
+        field_obj['thumbnail'] = default_storage.url(values['thumbnail'])
+    if values['width'] is not None:
+        field_obj['height'] = values['height']
+        field_obj['width'] = values['width']
+    return field_obj
+
+
 # save changes or create a new entry
 @login_required
 def save_js(request):
@@ -40,7 +103,7 @@ def save_js(request):
         if 'owner_id' in request.POST:
             owner_id = int(request.POST['owner_id'])
             if owner_id != request.user.id:
-                if not check_access_rights(owner_id, request.user):
+                if not check_access_rights([owner_id], request):
                     return False
         else:
             owner_id = request.user.id
@@ -59,31 +122,22 @@ def save_js(request):
                 image.uploader = request.user
                 image.owner_id = owner_id
                 status = 201
-                if 'checksum' in request.POST:
-                    image.checksum = request.POST['checksum']
             image.title = request.POST['title']
             if 'imageCat' in request.POST:
                 image.image_cat = request.POST['imageCat']
             if 'image' in request.FILES:
+                if image.pk is not None:
+                    discard_derivatives(image)
                 image.image = request.FILES['image']
             if status == 201 and 'image' not in request.FILES:
                 status = 200
                 response['errormsg']['error'] = _('No file uploaded')
             else:
                 image.save()
-                response['values'] = {
-                    'pk': image.pk,
-                    'title': image.title,
-                    'image': image.image.url,
-                    'file_type': image.file_type,
-                    'added': mktime(image.added.timetuple()) * 1000,
-                    'checksum': image.checksum,
-                    'cats': image.image_cat.split(',')
-                }
-                if image.thumbnail:
-                    response['values']['thumbnail'] = image.thumbnail.url
-                    response['values']['height'] = image.height
-                    response['values']['width'] = image.width
+                if image.thumbnail_status == 'pending':
+                    start_thumbnail(image)
+                LibraryVersion.bump(image.owner_id, 'images')
+                response['values'] = serialize_image(image_values(image))
     return JsonResponse(
         response,
         status=status
@@ -99,76 +153,145 @@ def delete_js(request):
         status = 201
         ids = request.POST.getlist('ids[]')
         Image.objects.filter(pk__in=ids, owner=request.user).delete()
+        LibraryVersion.bump(request.user.id, 'images')
     return JsonResponse(
         response,
         status=status
     )
 
 
-def check_access_rights(other_user_id, this_user):
-    other_user_id = int(other_user_id)
-    has_access = False
-    if other_user_id == 0:
-        has_access = True
-    elif other_user_id == this_user.id:
-        has_access = True
-    elif AccessRight.objects.filter(
-        document__owner=other_user_id,
-        user=this_user
-    ).count() > 0:
-        has_access = True
-    return has_access
+def serialize_images(owner_id):
+    images = []
+    for values in Image.objects.filter(owner=owner_id).exclude(
+        image=''
+    ).values(*IMAGE_FIELDS).iterator():
+        images.append(json.dumps(serialize_image(values)))
+    return (
+        u','.join(json.dumps(category) for category in serializer.serialize(
+            ImageCategory.objects.filter(category_owner=owner_id))),
+        u','.join(images)
+    )
+
+
+def image_page(request, owner_ids):
+    """
+    Returns a page of the images of owner_ids, ordered by their last
+    modification. Parameters:
+    page_size: the number of images per page,
+    cursor: the next_cursor of the previous page,
+    updated_since: only images modified after this timestamp (the timestamp
+    of an earlier response) are returned, together with the ids of all images
+    in image_ids, so that the client can remove deleted images,
+    category: only images in the category with this id are returned.
+    Invalid parameters are answered with 400.
+    """
+    category = request.POST.get('category')
+    updated_since = request.POST.get('updated_since')
+    cursor = request.POST.get('cursor')
+    try:
+        page_size = int(request.POST['page_size'])
+        if page_size < 1:
+            raise ValueError
+        if category is not None:
+            category = int(category)
+        if updated_since is not None:
+            updated_since = datetime.datetime.fromtimestamp(
+                float(updated_since),
+                timezone.utc
+            )
+        if cursor:
+            updated, image_id = cursor.rsplit('_', 1)
+            cursor = parse_datetime(updated), int(image_id)
+            if cursor[0] is None:
+                raise ValueError
+    except (ValueError, OverflowError, OSError):
+        return JsonResponse({}, status=400)
+    response = {}
+    response['timestamp'] = time.time()
+    images = Image.objects.filter(owner__in=owner_ids).exclude(image='')
+    if category is not None:
+        images = images.filter(categories__id=category)
+    if updated_since is not None:
+        response['image_ids'] = list(images.values_list('id', flat=True))
+        images = images.filter(updated__gt=updated_since)
+    if cursor:
+        updated, image_id = cursor
+        images = images.filter(
+            Q(updated__gt=updated) |
+            Q(updated=updated, id__gt=image_id)
+        )
+    page_size = min(page_size, IMAGES_MAX_PAGE_SIZE)
+    page = list(images.order_by('updated', 'id').values(
+        'updated',
+        *IMAGE_FIELDS
+    )[:page_size + 1])
+    response['next_cursor'] = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        response['next_cursor'] = '%s_%d' % (
+            page[-1]['updated'].isoformat(),
+            page[-1]['id']
+        )
+    response['images'] = [serialize_image(values) for values in page]
+    if not cursor:
+        response['imageCategories'] = serializer.serialize(
+            ImageCategory.objects.filter(category_owner__in=owner_ids))
+    return JsonResponse(response)
 
 
-# returns list of images
+# returns list of images. The images of each user are serialized once per
+# version of the user's library and then served from the cache. If page_size
+# is given, a page of the images is returned instead (see image_page).
 @login_required
 def images_js(request):
     response = {}
     status = 403
     if request.is_ajax() and request.method == 'POST':
-        user_id = request.POST['owner_id']
-        if len(user_id.split(',')) > 1:
-            user_ids = user_id.split(',')
-            status = 200
-            for user_id in user_ids:
-                if check_access_rights(user_id, request.user) is False:
-                    status = 403
-            if status == 200:
-                images = Image.objects.filter(owner__in=user_ids)
-                response['imageCategories'] = serializer.serialize(
-                    ImageCategory.objects.filter(category_owner__in=user_ids))
-        else:
-            if check_access_rights(user_id, request.user):
-                if int(user_id) == 0:
-                    user_id = request.user.id
-                images = Image.objects.filter(owner=user_id)
-                status = 200
-                response['imageCategories'] = serializer.serialize(
-                    ImageCategory.objects.filter(category_owner=user_id))
-        if status == 200:
-            response['images'] = []
-            for image in images:
-                if image.image:
-                    field_obj = {
-                        'pk': image.pk,
-                        'title': image.title,
-                        'image': image.image.url,
-                        'file_type': image.file_type,
-                        'added': mktime(image.added.timetuple()) * 1000,
-                        'checksum': image.checksum,
-                        'cats': image.image_cat.split(',')
-                    }
-                    if image.thumbnail:
-                        field_obj['thumbnail'] = image.thumbnail.url
-                        field_obj['height'] = image.height
-                        field_obj['width'] = image.width
-                    response['images'].append(field_obj)
+        user_ids = request.POST['owner_id'].split(',')
+        if not check_access_rights(user_ids, request):
+            return JsonResponse(response, status=status)
+        if len(user_ids) == 1 and int(user_ids[0]) == 0:
+            user_ids = [request.user.id]
+        user_ids = list(OrderedDict.fromkeys(
+            int(user_id) for user_id in user_ids))
+        if 'page_size' in request.POST:
+            return image_page(request, user_ids)
+        return HttpResponse(
+            library_json(
+                get_library_blobs('images', user_ids, serialize_images),
+                ['imageCategories', 'images']
+            ),
+            content_type='application/json'
+        )
     return JsonResponse(
         response,
         status=status
     )
 
 
+# redirects to a copy of an image scaled to at least width pixels (if the
+# image is that wide) in file_format, which is created the first time it is
+# requested. Images that cannot be scaled are redirected to as they are.
+@login_required
+def derivative(request, image_id, width, file_format):
+    image = Image.objects.filter(id=int(image_id)).first()
+    if image is None or not image.image:
+        raise Http404
+    owner_id = image.owner_id or image.uploader_id
+    if not check_access_rights([owner_id], request):
+        return HttpResponseForbidden()
+    if (
+        image.file_type not in THUMBNAIL_FILETYPES or
+        file_format not in DERIVATIVE_FORMATS
+    ):
+        return HttpResponseRedirect(image.image.url)
+    return HttpResponseRedirect(get_derivative(
+        image,
+        derivative_width(int(width)),
+        file_format
+    ).file.url)
+
+
 # save changes or create a new category
 @login_required
 def save_category_js(request):
@@ -193,6 +316,7 @@ def save_category_js(request):
                 the_cat = ImageCategory.objects.get(pk=the_id)
                 the_cat.category_title = the_title
             the_cat.save()
+            LibraryVersion.bump(the_cat.category_owner_id, 'images')
             response['entries'].append(
                 {'id': the_cat.id, 'category_title': the_cat.category_title})
         status = 201
@@ -212,7 +336,9 @@ def delete_category_js(request):
     if request.is_ajax() and request.method == 'POST':
         ids = request.POST.getlist('ids[]')
         for id in ids:
-            ImageCategory.objects.get(pk=int(id)).delete()
+            the_cat = ImageCategory.objects.get(pk=int(id))
+            the_cat.delete()
+            LibraryVersion.bump(the_cat.category_owner_id, 'images')
         status = 201
 
     return JsonResponse(
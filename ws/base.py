@@ -5,12 +5,87 @@ from tornado.wsgi import WSGIContainer
 
 from django.db import connection
 from django.contrib import auth
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.core.cache import cache
+from django.dispatch import receiver
+from django.utils.crypto import salted_hmac
 from logging import info, debug
 from django.conf import settings
 from importlib import import_module
 from django.core.handlers.wsgi import WSGIRequest
 
 
+def auth_cache_key(kind, secret):
+    # Session keys and passwords are not used in cache keys as they are.
+    return 'ws_auth:%s:%s' % (
+        kind,
+        salted_hmac('ws.base.auth_cache_key', secret).hexdigest()
+    )
+
+
+def get_cached_user(key):
+    """
+    Returns the user cached under key, if there is one and the password of the
+    user has not changed since.
+    """
+    if not settings.WS_AUTH_CACHE_TIMEOUT:
+        return None
+    cached = cache.get(key)
+    if cached is None:
+        return None
+    user_id, session_auth_hash = cached
+    user = User.objects.filter(id=user_id, is_active=True).first()
+    if user is None or user.get_session_auth_hash() != session_auth_hash:
+        cache.delete(key)
+        return None
+    return user
+
+
+def cache_user(key, user):
+    if settings.WS_AUTH_CACHE_TIMEOUT:
+        cache.set(
+            key,
+            (user.id, user.get_session_auth_hash()),
+            settings.WS_AUTH_CACHE_TIMEOUT
+        )
+
+
+def get_session_user(session_key, session=None):
+    """
+    Returns the user logged in with the Django session session_key, or None.
+    Users are cached by session key, so that reconnecting clients do not cost
+    a session lookup.
+    """
+    key = auth_cache_key('session', session_key)
+    user = get_cached_user(key)
+    if user is not None:
+        return user
+
+    # get_user needs a django request object, but only looks at the session
+
+    class Dummy(object):
+        pass
+
+    django_request = Dummy()
+    if session is None:
+        session = import_module(settings.SESSION_ENGINE).SessionStore(
+            session_key)
+    django_request.session = session
+    user = auth.get_user(django_request)
+    if not user.is_authenticated():
+        return None
+    cache_user(key, user)
+    return user
+
+
+@receiver(user_logged_out)
+def forget_session(sender, request, **kwargs):
+    session_key = request.session.session_key
+    if session_key and settings.WS_AUTH_CACHE_TIMEOUT:
+        cache.delete(auth_cache_key('session', session_key))
+
+
 class BaseWebSocketHandler(WebSocketHandler):
 
     def check_origin(self, origin):
@@ -60,28 +135,30 @@ class BaseWebSocketHandler(WebSocketHandler):
         return self._session
 
     def get_current_user(self):
-        # get_user needs a django request object, but only looks at the session
-
-        class Dummy(object):
-            pass
-
-        django_request = Dummy()
-        django_request.session = self.get_django_session()
-        user = auth.get_user(django_request)
-        if user.is_authenticated():
-            return user
-        else:
-            # try basic auth
-            if 'Authorization' not in self.request.headers:
-                return None
-            (kind, data) = self.request.headers['Authorization'].split(' ')
-            if kind != 'Basic':
-                return None
-            (username, _, password) = data.decode('base64').partition(':')
-            user = auth.authenticate(username=username, password=password)
-            if user is not None and user.is_authenticated():
+        # Users are cached by session key and by Basic auth credentials, so
+        # that reconnecting clients cost neither a session lookup nor the
+        # hashing of a password.
+        session_key = self.get_cookie(settings.SESSION_COOKIE_NAME)
+        if session_key:
+            user = get_session_user(session_key, self.get_django_session())
+            if user is not None:
                 return user
+        # try basic auth
+        if 'Authorization' not in self.request.headers:
+            return None
+        (kind, data) = self.request.headers['Authorization'].split(' ')
+        if kind != 'Basic':
             return None
+        key = auth_cache_key('basic', data)
+        user = get_cached_user(key)
+        if user is not None:
+            return user
+        (username, _, password) = data.decode('base64').partition(':')
+        user = auth.authenticate(username=username, password=password)
+        if user is not None and user.is_authenticated():
+            cache_user(key, user)
+            return user
+        return None
 
     def get_django_request(self):
         request = \
@@ -0,0 +1,379 @@
+import json
+import socket
+import time
+from collections import deque
+from logging import info, error
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream, StreamClosedError
+
+
+broker = None
+
+
+def get_broker():
+    """
+    Returns the broker configured in settings.WS_BROKER. There is one broker
+    per process.
+    """
+    global broker
+    if broker is None:
+        options = dict(settings.WS_BROKER)
+        backend = import_string(options.pop('BACKEND'))
+        broker = backend(options)
+    return broker
+
+
+class BaseBroker(object):
+    """
+    Passes messages between the server processes that take part in the same
+    collaborative sessions.
+
+    Messages are dicts that can be encoded as JSON. They are published to
+    named channels and delivered to all callbacks subscribed to the channel,
+    in the order they were published. In addition, the broker holds leases:
+    keys that can be claimed by one value at a time and expire after a given
+    time unless they are claimed again by the same value.
+    """
+
+    def __init__(self, options=None):
+        self.options = options or dict()
+
+    def subscribe(self, channel, callback):
+        raise NotImplementedError
+
+    def unsubscribe(self, channel, callback):
+        raise NotImplementedError
+
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def claim(self, key, value, ttl, callback):
+        """
+        Claim or renew the lease key for value for ttl seconds. callback is
+        run with True if the lease is held by value afterward and False if it
+        is held by another value. It may be run before claim returns.
+        """
+        raise NotImplementedError
+
+    def release(self, key, value):
+        raise NotImplementedError
+
+
+class LocalBroker(BaseBroker):
+    """
+    Passes messages within the current process. This is all that is needed
+    when there is only one server process.
+    """
+
+    def __init__(self, options=None):
+        super(LocalBroker, self).__init__(options)
+        self.subscriptions = dict()
+        self.leases = dict()
+
+    def subscribe(self, channel, callback):
+        self.subscriptions.setdefault(channel, []).append(callback)
+
+    def unsubscribe(self, channel, callback):
+        callbacks = self.subscriptions.get(channel, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if len(callbacks) == 0:
+            self.subscriptions.pop(channel, None)
+
+    def publish(self, channel, message):
+        io_loop = IOLoop.current()
+        for callback in self.subscriptions.get(channel, []):
+            io_loop.add_callback(callback, message)
+
+    def claim(self, key, value, ttl, callback):
+        now = time.time()
+        lease = self.leases.get(key)
+        if lease is None or lease[0] == value or lease[1] < now:
+            self.leases[key] = (value, now + ttl)
+            callback(True)
+        else:
+            callback(False)
+
+    def release(self, key, value):
+        lease = self.leases.get(key)
+        if lease is not None and lease[0] == value:
+            del self.leases[key]
+
+
+class RedisError(Exception):
+    pass
+
+
+# Leases are renewed and released by scripts, so that the check that the lease
+# is still held and the change are atomic. Otherwise the lease could expire
+# and be claimed by another node in between.
+RENEW_LEASE_SCRIPT = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('pexpire', KEYS[1], ARGV[2]) end return 0"
+)
+RELEASE_LEASE_SCRIPT = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('del', KEYS[1]) end return 0"
+)
+
+
+def encode_arg(arg):
+    if isinstance(arg, bytes):
+        return arg
+    if not isinstance(arg, type(u'')):
+        arg = u'%s' % arg
+    return arg.encode('utf-8')
+
+
+class RedisConnection(object):
+    """
+    A minimal client for the Redis protocol (RESP) over TCP or a unix socket.
+    Replies to commands are matched to the commands in the order they were
+    sent. Anything else received (messages of subscribed channels) is passed
+    to on_push.
+    """
+
+    def __init__(self, options, on_push=None, on_connect=None):
+        self.options = options
+        self.on_push = on_push
+        self.on_connect = on_connect
+        self.stream = None
+        self.is_reconnecting = False
+        self.pending = deque()
+
+    def connect(self):
+        self.is_reconnecting = False
+        if self.options.get('UNIX_SOCKET'):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = self.options['UNIX_SOCKET']
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = (
+                self.options.get('HOST', 'localhost'),
+                self.options.get('PORT', 6379)
+            )
+        self.stream = IOStream(sock)
+        # Commands written before the connection has been established are
+        # buffered by the stream.
+        IOLoop.current().add_future(
+            self.stream.connect(address),
+            self.connected
+        )
+        if self.options.get('PASSWORD'):
+            self.execute('AUTH', self.options['PASSWORD'])
+        if self.options.get('DB'):
+            self.execute('SELECT', self.options['DB'])
+
+    def connected(self, future):
+        try:
+            future.result()
+        except Exception:
+            error('Could not connect to the message broker', exc_info=True)
+            self.reconnect()
+            return
+        info('Connected to the message broker')
+        self.read_replies()
+        if self.on_connect:
+            self.on_connect()
+
+    def reconnect(self):
+        while len(self.pending) > 0:
+            self.pending.popleft().set_exception(
+                RedisError('Connection lost'))
+        self.stream = None
+        self.is_reconnecting = True
+        IOLoop.current().call_later(1, self.connect)
+
+    def send(self, *args):
+        """
+        Send a command without waiting for its reply. Returns False if the
+        command could not be sent.
+        """
+        if self.is_reconnecting:
+            return False
+        if self.stream is None:
+            self.connect()
+        command = [encode_arg('*%d\r\n' % len(args))]
+        for arg in args:
+            arg = encode_arg(arg)
+            command.append(encode_arg('$%d\r\n' % len(arg)))
+            command.append(arg)
+            command.append(b'\r\n')
+        try:
+            self.stream.write(b''.join(command))
+        except StreamClosedError:
+            return False
+        return True
+
+    def execute(self, *args):
+        """
+        Send a command and return a Future of its reply.
+        """
+        future = Future()
+        if self.send(*args):
+            self.pending.append(future)
+        else:
+            future.set_exception(RedisError('Not connected'))
+        return future
+
+    @gen.coroutine
+    def read_reply(self):
+        line = yield self.stream.read_until(b'\r\n')
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b'+':
+            raise gen.Return(rest)
+        elif prefix == b'-':
+            raise gen.Return(RedisError(rest))
+        elif prefix == b':':
+            raise gen.Return(int(rest))
+        elif prefix == b'$':
+            length = int(rest)
+            if length < 0:
+                raise gen.Return(None)
+            data = yield self.stream.read_bytes(length + 2)
+            raise gen.Return(data[:-2])
+        elif prefix == b'*':
+            length = int(rest)
+            if length < 0:
+                raise gen.Return(None)
+            items = []
+            for _ in range(length):
+                item = yield self.read_reply()
+                items.append(item)
+            raise gen.Return(items)
+        raise gen.Return(RedisError('Unknown reply: %r' % line))
+
+    @gen.coroutine
+    def read_replies(self):
+        stream = self.stream
+        while True:
+            try:
+                reply = yield self.read_reply()
+            except StreamClosedError:
+                break
+            if len(self.pending) > 0:
+                future = self.pending.popleft()
+                if isinstance(reply, RedisError):
+                    future.set_exception(reply)
+                else:
+                    future.set_result(reply)
+            elif self.on_push:
+                try:
+                    self.on_push(reply)
+                except Exception:
+                    error('Error handling broker message', exc_info=True)
+        if self.stream is stream:
+            error('Lost the connection to the message broker')
+            self.reconnect()
+
+
+class RedisBroker(BaseBroker):
+    """
+    Passes messages through a Redis server or any server that speaks the
+    Redis protocol. Options:
+
+    HOST, PORT: the address of the server (default localhost:6379),
+    UNIX_SOCKET: the path to a unix socket to be used instead,
+    PASSWORD, DB: used with AUTH and SELECT if given,
+    PREFIX: prepended to all channel and key names (default 'fiduswriter:').
+
+    One connection is used for subscriptions and one for all other commands.
+    Messages published while the connection is down are lost.
+    """
+
+    def __init__(self, options=None):
+        super(RedisBroker, self).__init__(options)
+        self.prefix = self.options.get('PREFIX', 'fiduswriter:')
+        self.subscriptions = dict()
+        self.commands = RedisConnection(self.options)
+        self.listener = RedisConnection(
+            self.options,
+            on_push=self.receive,
+            on_connect=self.resubscribe
+        )
+
+    def subscribe(self, channel, callback):
+        if channel not in self.subscriptions:
+            self.subscriptions[channel] = []
+            self.listener.send('SUBSCRIBE', self.prefix + channel)
+        self.subscriptions[channel].append(callback)
+
+    def unsubscribe(self, channel, callback):
+        callbacks = self.subscriptions.get(channel, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if len(callbacks) == 0 and channel in self.subscriptions:
+            del self.subscriptions[channel]
+            self.listener.send('UNSUBSCRIBE', self.prefix + channel)
+
+    def resubscribe(self):
+        if len(self.subscriptions) > 0:
+            self.listener.send('SUBSCRIBE', *[
+                self.prefix + channel for channel in self.subscriptions
+            ])
+
+    def receive(self, reply):
+        if not isinstance(reply, list) or reply[0] != b'message':
+            # Confirmations of (un)subscriptions.
+            return
+        channel = reply[1].decode('utf-8')[len(self.prefix):]
+        message = json.loads(reply[2].decode('utf-8'))
+        for callback in list(self.subscriptions.get(channel, [])):
+            callback(message)
+
+    def publish(self, channel, message):
+        if not self.commands.send(
+            'PUBLISH',
+            self.prefix + channel,
+            json.dumps(message)
+        ):
+            error('Could not publish message to %s', channel)
+
+    @gen.coroutine
+    def claim_lease(self, key, value, ttl):
+        key = self.prefix + key
+        value = encode_arg(value)
+        milliseconds = int(ttl * 1000)
+        reply = yield self.commands.execute(
+            'SET', key, value, 'NX', 'PX', milliseconds)
+        if reply == b'OK':
+            raise gen.Return(True)
+        renewed = yield self.commands.execute(
+            'EVAL', RENEW_LEASE_SCRIPT, 1, key, value, milliseconds)
+        raise gen.Return(renewed == 1)
+
+    def claim(self, key, value, ttl, callback):
+        def claimed(future):
+            try:
+                callback(future.result())
+            except RedisError:
+                error('Could not claim %s', key, exc_info=True)
+                callback(False)
+        IOLoop.current().add_future(
+            self.claim_lease(key, value, ttl),
+            claimed
+        )
+
+    @gen.coroutine
+    def release_lease(self, key, value):
+        yield self.commands.execute(
+            'EVAL',
+            RELEASE_LEASE_SCRIPT,
+            1,
+            self.prefix + key,
+            encode_arg(value)
+        )
+
+    def release(self, key, value):
+        def released(future):
+            if future.exception() is not None:
+                error('Could not release %s', key)
+        IOLoop.current().add_future(
+            self.release_lease(key, value),
+            released
+        )
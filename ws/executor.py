@@ -0,0 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+
+executor = None
+
+
+def run_in_db_thread(fn, *args, **kwargs):
+    """
+    Runs fn, which queries the database, in a worker thread so that the
+    IOLoop is not blocked. Returns a future that can be yielded in
+    coroutines. There is one pool of settings.WS_DB_THREADS threads per
+    process.
+    """
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(settings.WS_DB_THREADS)
+    return executor.submit(run_with_connection, fn, *args, **kwargs)
+
+
+def run_with_connection(fn, *args, **kwargs):
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+
+from ws.base import auth_cache_key, cache_user, get_cached_user
+
+
+@override_settings(WS_AUTH_CACHE_TIMEOUT=60)
+class AuthCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            'user',
+            'user@example.com',
+            'password'
+        )
+        self.client = Client(HTTP_HOST='localhost')
+        self.client.force_login(self.user)
+        # The user of the session as cached by the first websocket connection.
+        self.key = auth_cache_key(
+            'session',
+            self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        )
+        cache_user(self.key, self.user)
+
+    def test_cached(self):
+        self.assertEqual(get_cached_user(self.key), self.user)
+
+    def test_logout(self):
+        self.client.logout()
+        self.assertIsNone(cache.get(self.key))
+        self.assertIsNone(get_cached_user(self.key))
+
+    def test_password_change(self):
+        self.user.set_password('changed')
+        self.user.save()
+        # The session auth hash of the cached user no longer matches.
+        self.assertIsNone(get_cached_user(self.key))
+        self.assertIsNone(cache.get(self.key))
+
+    def test_inactive(self):
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        self.assertIsNone(get_cached_user(self.key))
@@ -0,0 +1,274 @@
+import time
+
+from django.test import SimpleTestCase
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.iostream import StreamClosedError
+from tornado.tcpserver import TCPServer
+from tornado.testing import AsyncTestCase, bind_unused_port, gen_test
+
+from ws.brokers import LocalBroker, RedisBroker, RedisConnection, \
+    RedisError, RELEASE_LEASE_SCRIPT, RENEW_LEASE_SCRIPT
+
+
+class Messages(object):
+
+    def __init__(self):
+        self.received = []
+
+    def __call__(self, message):
+        self.received.append(message)
+
+
+class LocalBrokerTest(AsyncTestCase, SimpleTestCase):
+
+    def claim(self, broker, key, value, ttl=30):
+        results = []
+        broker.claim(key, value, ttl, results.append)
+        return results[0]
+
+    @gen_test
+    def test_publish(self):
+        broker = LocalBroker()
+        first = Messages()
+        second = Messages()
+        broker.subscribe('a', first)
+        broker.subscribe('a', second)
+        broker.subscribe('b', second)
+        broker.publish('a', {'n': 1})
+        broker.publish('b', {'n': 2})
+        broker.publish('c', {'n': 3})
+        # Messages are delivered on the IOLoop, in the order they were
+        # published.
+        self.assertEqual(first.received, [])
+        yield gen.moment
+        self.assertEqual(first.received, [{'n': 1}])
+        self.assertEqual(second.received, [{'n': 1}, {'n': 2}])
+        broker.unsubscribe('a', second)
+        broker.publish('a', {'n': 4})
+        yield gen.moment
+        self.assertEqual(first.received, [{'n': 1}, {'n': 4}])
+        self.assertEqual(second.received, [{'n': 1}, {'n': 2}])
+        broker.unsubscribe('a', first)
+        self.assertEqual(list(broker.subscriptions), ['b'])
+
+    def test_leases(self):
+        broker = LocalBroker()
+        self.assertTrue(self.claim(broker, 'key', 1, 0.05))
+        self.assertFalse(self.claim(broker, 'key', 2))
+        # The holder renews the lease.
+        self.assertTrue(self.claim(broker, 'key', 1, 0.05))
+        time.sleep(0.1)
+        # The lease has expired and is taken over.
+        self.assertTrue(self.claim(broker, 'key', 2))
+        self.assertFalse(self.claim(broker, 'key', 1))
+        # Only the holder releases the lease.
+        broker.release('key', 1)
+        self.assertFalse(self.claim(broker, 'key', 1))
+        broker.release('key', 2)
+        self.assertTrue(self.claim(broker, 'key', 1))
+
+
+class RESPServer(TCPServer):
+    """
+    A stand-in for a Redis server that understands the commands used by
+    RedisBroker, including the lease scripts.
+    """
+
+    def __init__(self):
+        super(RESPServer, self).__init__()
+        self.values = dict()
+        self.subscribers = dict()
+        self.commands = []
+
+    @gen.coroutine
+    def handle_stream(self, stream, address):
+        try:
+            while True:
+                line = yield stream.read_until(b'\r\n')
+                args = []
+                for i in range(int(line[1:-2])):
+                    line = yield stream.read_until(b'\r\n')
+                    data = yield stream.read_bytes(int(line[1:-2]) + 2)
+                    args.append(data[:-2])
+                self.commands.append(args)
+                stream.write(self.execute(stream, args))
+        except StreamClosedError:
+            for streams in self.subscribers.values():
+                streams.discard(stream)
+
+    def get(self, key):
+        value, expires = self.values.get(key, (None, None))
+        if expires is not None and expires < time.time():
+            del self.values[key]
+            return None
+        return value
+
+    def expire(self, key, milliseconds):
+        self.values[key] = (self.values[key][0], time.time() +
+                            int(milliseconds) / 1000.0)
+
+    def execute(self, stream, args):
+        command = args[0].upper()
+        if command == b'SET':
+            key, value = args[1], args[2]
+            if b'NX' in args and self.get(key) is not None:
+                return encode_reply(None)
+            self.values[key] = (value, None)
+            if b'PX' in args:
+                self.expire(key, args[args.index(b'PX') + 1])
+            return b'+OK\r\n'
+        elif command == b'EVAL':
+            script, key, value = args[1].decode('utf-8'), args[3], args[4]
+            if self.get(key) != value:
+                return encode_reply(0)
+            if script == RENEW_LEASE_SCRIPT:
+                self.expire(key, args[5])
+            elif script == RELEASE_LEASE_SCRIPT:
+                del self.values[key]
+            return encode_reply(1)
+        elif command == b'PUBLISH':
+            subscribers = self.subscribers.get(args[1], set())
+            for subscriber in subscribers:
+                subscriber.write(encode_reply([b'message', args[1], args[2]]))
+            return encode_reply(len(subscribers))
+        elif command in (b'SUBSCRIBE', b'UNSUBSCRIBE'):
+            replies = []
+            for channel in args[1:]:
+                streams = self.subscribers.setdefault(channel, set())
+                if command == b'SUBSCRIBE':
+                    streams.add(stream)
+                else:
+                    streams.discard(stream)
+                replies.append(encode_reply([command.lower(), channel, 1]))
+            return b''.join(replies)
+        elif command == b'GET':
+            return encode_reply(self.get(args[1]))
+        return b'-ERR unknown command\r\n'
+
+
+def encode_reply(reply):
+    if reply is None:
+        return b'$-1\r\n'
+    if isinstance(reply, int):
+        return (u':%d\r\n' % reply).encode('utf-8')
+    if isinstance(reply, list):
+        return (u'*%d\r\n' % len(reply)).encode('utf-8') + b''.join(
+            encode_reply(item) for item in reply)
+    return (u'$%d\r\n' % len(reply)).encode('utf-8') + reply + b'\r\n'
+
+
+class RedisBrokerTest(AsyncTestCase, SimpleTestCase):
+
+    def setUp(self):
+        super(RedisBrokerTest, self).setUp()
+        sock, self.port = bind_unused_port()
+        self.server = RESPServer()
+        self.server.add_socket(sock)
+        self.options = {'HOST': '127.0.0.1', 'PORT': self.port}
+
+    def tearDown(self):
+        self.server.stop()
+        super(RedisBrokerTest, self).tearDown()
+
+    @gen.coroutine
+    def claim(self, broker, key, value, ttl=30):
+        future = Future()
+        broker.claim(key, value, ttl, future.set_result)
+        result = yield future
+        raise gen.Return(result)
+
+    @gen_test
+    def test_connection(self):
+        connection = RedisConnection(self.options)
+        replies = yield [
+            connection.execute('SET', 'key', u'v\xe4lue'),
+            connection.execute('GET', 'key'),
+            connection.execute('GET', 'missing'),
+            connection.execute('PUBLISH', 'channel', 'message'),
+        ]
+        self.assertEqual(
+            replies,
+            [b'OK', u'v\xe4lue'.encode('utf-8'), None, 0]
+        )
+        with self.assertRaises(RedisError):
+            yield connection.execute('UNKNOWN')
+        # The connection can still be used after an error reply.
+        reply = yield connection.execute('GET', 'key')
+        self.assertEqual(reply, u'v\xe4lue'.encode('utf-8'))
+
+    @gen.coroutine
+    def wait_for(self, condition):
+        for i in range(500):
+            if condition():
+                break
+            yield gen.sleep(0.01)
+        self.assertTrue(condition())
+
+    def subscribed(self, channel):
+        return [
+            stream for stream in self.server.subscribers.get(
+                ('fiduswriter:' + channel).encode('utf-8'), set()
+            ) if not stream.closed()
+        ]
+
+    @gen_test
+    def test_publish(self):
+        first = RedisBroker(self.options)
+        second = RedisBroker(self.options)
+        messages = Messages()
+        second.subscribe('channel', messages)
+        second.subscribe('other', messages)
+        yield self.wait_for(lambda: self.subscribed('other'))
+        first.publish('channel', {'n': 1})
+        first.publish('other', {'n': 2})
+        first.publish('unknown', {'n': 3})
+        yield self.wait_for(lambda: len(messages.received) == 2)
+        self.assertEqual(messages.received, [{'n': 1}, {'n': 2}])
+        self.assertIn(
+            [b'PUBLISH', b'fiduswriter:channel', b'{"n": 1}'],
+            self.server.commands
+        )
+        second.unsubscribe('channel', messages)
+        yield self.wait_for(lambda: not self.subscribed('channel'))
+        first.publish('channel', {'n': 4})
+        first.publish('other', {'n': 5})
+        yield self.wait_for(lambda: len(messages.received) == 3)
+        self.assertEqual(messages.received, [{'n': 1}, {'n': 2}, {'n': 5}])
+
+    @gen_test
+    def test_leases(self):
+        broker = RedisBroker(self.options)
+        claimed = yield self.claim(broker, 'key', 1, 0.1)
+        self.assertTrue(claimed)
+        claimed = yield self.claim(broker, 'key', 2)
+        self.assertFalse(claimed)
+        # The holder renews the lease with the script.
+        claimed = yield self.claim(broker, 'key', 1, 0.1)
+        self.assertTrue(claimed)
+        self.assertEqual(self.server.commands[-1][:2],
+                         [b'EVAL', RENEW_LEASE_SCRIPT.encode('utf-8')])
+        yield gen.sleep(0.2)
+        # The lease has expired and is taken over.
+        claimed = yield self.claim(broker, 'key', 2)
+        self.assertTrue(claimed)
+        # Only the holder releases the lease.
+        yield broker.release_lease('key', 1)
+        self.assertEqual(self.server.get(b'fiduswriter:key'), b'2')
+        yield broker.release_lease('key', 2)
+        self.assertIsNone(self.server.get(b'fiduswriter:key'))
+
+    @gen_test
+    def test_reconnect(self):
+        broker = RedisBroker(self.options)
+        messages = Messages()
+        broker.subscribe('channel', messages)
+        yield self.wait_for(lambda: self.subscribed('channel'))
+        # The server drops the connection, the subscriptions are renewed once
+        # the broker has connected again.
+        [stream] = self.subscribed('channel')
+        stream.close()
+        yield self.wait_for(lambda: self.subscribed('channel'))
+        broker.publish('channel', {'n': 1})
+        yield self.wait_for(lambda: len(messages.received) == 1)
+        self.assertEqual(messages.received, [{'n': 1}])